@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 """
 calculate_mttr.py: Compute Mean Time To Respond (MTTR) from incidents CSV.
+
+The file is streamed in chunks (Parquet is also accepted) through
+metrics_engine.py, which also reports median, p90 and p99. With --state
+only incidents newer than the last run are processed and the result comes
+from the daily partials kept by materialize.py.
 """
 import argparse
-import pandas as pd
+
+from metrics_engine import calculator_main, DEFAULT_CHUNKSIZE, GROUP_BY
 
 
 def parse_args():
@@ -12,36 +18,34 @@ def parse_args():
     )
     parser.add_argument(
         "--input", required=True,
-        help="Path to incidents CSV with columns 'detection_time' and 'resolution_time'."
+        help="Path to incidents CSV (or Parquet) with columns 'detection_time' and 'resolution_time'."
     )
     parser.add_argument(
         "--output", required=False,
         help="Optional path to save CSV with added 'mttr_hours' column."
     )
+    parser.add_argument(
+        "--chunksize", type=int, default=DEFAULT_CHUNKSIZE,
+        help="Rows read per chunk."
+    )
+    parser.add_argument(
+        "--group-by", choices=GROUP_BY,
+        help="Also report MTTR statistics per severity, source or week."
+    )
+    parser.add_argument(
+        "--state", required=False,
+        help="Incremental mode: SQLite file with the daily partials (see materialize.py)."
+    )
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
-    # Load data with parsed dates
-    df = pd.read_csv(
-        args.input,
-        parse_dates=["detection_time", "resolution_time"]
-    )
-
-    # Calculate MTTR in hours
-    df["mttr_hours"] = (
-        df["resolution_time"] - df["detection_time"]
-    ).dt.total_seconds() / 3600.0
-
-    # Compute and print mean MTTR
-    mean_mttr = df["mttr_hours"].mean()
-    print(f"Mean Time To Respond (hours): {mean_mttr:.2f}")
-
-    # Save extended CSV if requested
-    if args.output:
-        df.to_csv(args.output, index=False)
-        print(f"Extended CSV with MTTR saved to {args.output}")
+    if args.state:
+        from materialize import incremental_calculator
+        incremental_calculator("mttr", args)
+    else:
+        calculator_main("mttr", args)
 
 
 if __name__ == "__main__":
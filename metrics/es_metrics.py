@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+es_metrics.py: Compute MTTD/MTTR directly in Elasticsearch.
+
+Incidents are the ML anomaly records (result_type 'record', record_score
+above the threshold) joined with the orchestrator actions index
+(orchestrator/action_log.py), which uses the same field names. One composite
+aggregation over both indices buckets documents per incident (job_id,
+partition_field_value and a date_histogram of the anomaly timestamp), with
+min(detected_at) and max(completed_at) of successful actions as
+sub-aggregations:
+  MTTD = detected_at - timestamp
+  MTTR = completed_at - detected_at
+Buckets are paged with ``after_key`` and folded into the streaming
+statistics of metrics_engine.py, so no raw documents are downloaded. The
+results can fill metrics/report_template.md.
+
+Example:
+  python es_metrics.py --start now-30d --end now --group-by severity --report report.md
+"""
+import os
+import heapq
+import argparse
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from elasticsearch import Elasticsearch
+
+from metrics_engine import MetricsAccumulator, GROUP_BY, DEFAULT_ACCURACY, print_results
+from report import fill_report, TEMPLATE_PATH
+
+ES_HOST = os.getenv("ELASTICSEARCH_HOST", "http://elasticsearch:9200")
+ANOMALY_INDEX = ".ml-anomalies-*"
+ACTIONS_INDEX = "orchestrator-actions"
+DEFAULT_MIN_SCORE = 75.0
+DEFAULT_PAGE_SIZE = 1000
+# Anomaly records of one entity within this interval count as one incident
+DEFAULT_INCIDENT_INTERVAL = "1m"
+DEFAULT_REPORT_INCIDENTS = 20
+# Kibana anomaly severity bands of record_score
+SEVERITY_BANDS = ((75, "critical"), (50, "major"), (25, "minor"), (3, "warning"))
+
+
+def severity_of(scores: np.ndarray) -> np.ndarray:
+    conditions = [scores >= low for low, _ in SEVERITY_BANDS]
+    return np.select(conditions, [name for _, name in SEVERITY_BANDS], default="low")
+
+
+def incidents_query(min_score: float, start: Optional[str], end: Optional[str], page_size: int,
+                    interval: str, after: Optional[dict] = None) -> dict:
+    time_range = {k: v for k, v in (("gte", start), ("lt", end)) if v}
+    filters = [{"range": {"timestamp": time_range}}] if time_range else []
+    composite = {
+        "size": page_size,
+        "sources": [
+            {"job_id": {"terms": {"field": "job_id"}}},
+            {"entity": {"terms": {"field": "partition_field_value", "missing_bucket": True}}},
+            {"occurred": {"date_histogram": {"field": "timestamp", "fixed_interval": interval}}},
+        ],
+    }
+    if after:
+        composite["after"] = after
+    return {
+        "size": 0,
+        "query": {"bool": {
+            "filter": filters,
+            "should": [
+                {"bool": {"filter": [
+                    {"term": {"result_type": "record"}},
+                    {"range": {"record_score": {"gte": min_score}}},
+                ]}},
+                {"term": {"result_type": "action"}},
+            ],
+            "minimum_should_match": 1,
+        }},
+        "aggs": {"incidents": {
+            "composite": composite,
+            "aggs": {
+                "score": {"max": {"field": "record_score"}},
+                "detected": {"min": {"field": "detected_at"}},
+                "resolved": {
+                    "filter": {"term": {"status": "success"}},
+                    "aggs": {"at": {"max": {"field": "completed_at"}}},
+                },
+            },
+        }},
+    }
+
+
+def iter_incident_pages(es, index: str, min_score: float = DEFAULT_MIN_SCORE, start: Optional[str] = None,
+                        end: Optional[str] = None, page_size: int = DEFAULT_PAGE_SIZE,
+                        interval: str = DEFAULT_INCIDENT_INTERVAL) -> Iterator[pd.DataFrame]:
+    """
+    Yield one DataFrame per page of composite buckets, with the columns
+    metrics_engine expects (occurrence_time, detection_time,
+    resolution_time, severity, source) plus id and record_score.
+    """
+    after = None
+    while True:
+        resp = es.search(
+            index=index, body=incidents_query(min_score, start, end, page_size, interval, after),
+            ignore_unavailable=True
+        )
+        agg = resp.get("aggregations", {}).get("incidents", {})
+        buckets = agg.get("buckets", [])
+        if not buckets:
+            return
+        keys = [b["key"] for b in buckets]
+        scores = np.array([b["score"]["value"] if b["score"]["value"] is not None else np.nan for b in buckets])
+        yield pd.DataFrame({
+            "id": [f"{k['job_id']}/{k['entity'] or '-'}" for k in keys],
+            "occurrence_time": pd.to_datetime([k["occurred"] for k in keys], unit="ms"),
+            "detection_time": pd.to_datetime([b["detected"]["value"] for b in buckets], unit="ms"),
+            "resolution_time": pd.to_datetime([b["resolved"]["at"]["value"] for b in buckets], unit="ms"),
+            "record_score": scores,
+            "severity": severity_of(np.nan_to_num(scores)),
+            "source": [k["job_id"] for k in keys],
+        })
+        after = agg.get("after_key")
+        if not after or len(buckets) < page_size:
+            return
+
+
+def latest_incidents(page: pd.DataFrame, heap: list, limit: int) -> None:
+    """Keep the ``limit`` most recent incidents in ``heap`` (min-heap on occurrence time)."""
+    for row in page.itertuples(index=False):
+        item = (row.occurrence_time.value, row.id, row)
+        if len(heap) < limit:
+            heapq.heappush(heap, item)
+        elif item[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, item)
+
+
+def incident_rows(heap: list) -> List[dict]:
+    rows = []
+    for _, _, row in sorted(heap, key=lambda item: item[:2], reverse=True):
+        hours = {}
+        for metric, (a, b) in (("mttd", ("occurrence_time", "detection_time")),
+                               ("mttr", ("detection_time", "resolution_time"))):
+            start, end = getattr(row, a), getattr(row, b)
+            hours[metric] = None if pd.isna(start) or pd.isna(end) else (end - start).total_seconds() / 3600.0
+        rows.append({
+            "id": row.id,
+            "occurrence_time": row.occurrence_time,
+            "detection_time": None if pd.isna(row.detection_time) else row.detection_time,
+            "resolution_time": None if pd.isna(row.resolution_time) else row.resolution_time,
+            "mttd_hours": hours["mttd"],
+            "mttr_hours": hours["mttr"],
+        })
+    return rows
+
+
+def compute(es, index: str, min_score: float = DEFAULT_MIN_SCORE, start: Optional[str] = None,
+            end: Optional[str] = None, group_by: Optional[str] = None, page_size: int = DEFAULT_PAGE_SIZE,
+            interval: str = DEFAULT_INCIDENT_INTERVAL, accuracy: float = DEFAULT_ACCURACY,
+            list_limit: int = DEFAULT_REPORT_INCIDENTS):
+    """
+    Page through every incident bucket.
+    :return: (accumulator, latest incidents, first occurrence, last occurrence)
+    """
+    acc = MetricsAccumulator(group_by=group_by, accuracy=accuracy)
+    heap: list = []
+    first = last = None
+    for page in iter_incident_pages(es, index, min_score, start, end, page_size, interval):
+        acc.update(page)
+        latest_incidents(page, heap, list_limit)
+        page_first, page_last = page["occurrence_time"].min(), page["occurrence_time"].max()
+        first = page_first if first is None else min(first, page_first)
+        last = page_last if last is None else max(last, page_last)
+    return acc, incident_rows(heap), first, last
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compute MTTD/MTTR from Elasticsearch anomalies and actions.")
+    parser.add_argument("--es-host", default=ES_HOST, help="Elasticsearch URL")
+    parser.add_argument("--anomaly-index", default=ANOMALY_INDEX, help="ML anomaly results indices")
+    parser.add_argument("--actions-index", default=ACTIONS_INDEX, help="Orchestrator actions index")
+    parser.add_argument("--min-score", type=float, default=DEFAULT_MIN_SCORE,
+                        help="Minimum record_score of an anomaly to count as an incident")
+    parser.add_argument("--start", help="Period start (date or date math, e.g. now-30d)")
+    parser.add_argument("--end", help="Period end, exclusive (date or date math)")
+    parser.add_argument("--group-by", choices=GROUP_BY, help="Also report statistics per group")
+    parser.add_argument("--interval", default=DEFAULT_INCIDENT_INTERVAL,
+                        help="Anomalies of one entity within this interval are one incident")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE, help="Composite buckets per request")
+    parser.add_argument("--format", choices=["table", "json"], default="table")
+    parser.add_argument("--save", help="Save mergeable results to this JSON file")
+    parser.add_argument("--report", help="Write the filled report template to this path")
+    parser.add_argument("--template", default=TEMPLATE_PATH, help="Report template")
+    parser.add_argument("--report-incidents", type=int, default=DEFAULT_REPORT_INCIDENTS,
+                        help="Most recent incidents listed in the report")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    es = Elasticsearch([args.es_host])
+    index = f"{args.anomaly_index},{args.actions_index}"
+    acc, incidents, first, last = compute(
+        es, index, args.min_score, args.start, args.end, args.group_by, args.page_size,
+        args.interval, list_limit=args.report_incidents
+    )
+    print_results(acc, args.format)
+    if args.save:
+        acc.save(args.save)
+        print(f"Results saved to {args.save}")
+    if args.report:
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M")
+        start = args.start or (str(first) if first is not None else "-")
+        end = args.end or (str(last) if last is not None else now)
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(fill_report(acc, start, end, incidents, args.template))
+        print(f"Report saved to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+materialize.py: Incremental MTTD/MTTR via per-day partial aggregates.
+
+Every metric keeps a watermark: the latest end timestamp (detection_time for
+MTTD, resolution_time for MTTR) already folded in. A run reads only
+incidents whose end timestamp is past the watermark (Parquet row groups
+before it are skipped by pyarrow) and merges their durations into
+per-day partials (count, sum, min/max and quantile sketch, from
+metrics_engine.MetricStats) overall and per severity and source. Partials
+and watermarks are stored in one SQLite file and committed in the same
+transaction, so an interrupted run never counts anything twice.
+
+Reports for any period merge only that period's daily rows, so they take
+milliseconds however long the history is. Durations are attributed to the
+day of their end event; rows arriving with an end timestamp at or before
+the watermark are ignored (use --rebuild to recompute from scratch).
+
+Examples:
+  python materialize.py update --input incidents.csv
+  python materialize.py report --start 2024-05-01 --end 2024-06-01 --group-by week --report may.md
+"""
+import os
+import json
+import time
+import sqlite3
+import argparse
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from metrics_engine import (
+    METRICS, OVERALL, DEFAULT_CHUNKSIZE, DEFAULT_ACCURACY, MetricStats, MetricsAccumulator,
+    duration_hours, group_rows, iter_incidents, print_metric, print_results,
+)
+from report import fill_report, TEMPLATE_PATH
+
+STATE_FILE = os.getenv("METRICS_STATE_FILE", os.path.join(os.path.dirname(__file__), "state", "daily_partials.sqlite"))
+# Columns kept as partial dimensions when the input has them
+DIMENSIONS = ("severity", "source")
+PERIODS = ("day", "week", "month")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS partials (
+    metric TEXT NOT NULL,
+    day TEXT NOT NULL,
+    grp TEXT NOT NULL,
+    stats TEXT NOT NULL,
+    PRIMARY KEY (metric, day, grp)
+);
+CREATE TABLE IF NOT EXISTS watermarks (metric TEXT PRIMARY KEY, ts TEXT NOT NULL);
+"""
+
+
+def input_columns(path: str) -> List[str]:
+    if path.endswith((".parquet", ".pq")):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).schema_arrow.names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def period_of(day: str, period: str) -> str:
+    """Key of the day/week (Monday)/month containing ``day`` (YYYY-MM-DD)."""
+    if period == "month":
+        return day[:7]
+    if period == "week":
+        date = pd.Timestamp(day)
+        return (date - pd.Timedelta(days=date.dayofweek)).strftime("%Y-%m-%d")
+    return day
+
+
+class DailyPartials:
+    """Per-day partial aggregates and per-metric watermarks in SQLite."""
+
+    def __init__(self, path: str = STATE_FILE, accuracy: float = DEFAULT_ACCURACY):
+        self.path = path
+        self.accuracy = accuracy
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def watermarks(self) -> Dict[str, pd.Timestamp]:
+        return {metric: pd.Timestamp(ts) for metric, ts in self._db.execute("SELECT metric, ts FROM watermarks")}
+
+    def rebuild(self) -> None:
+        """Forget every partial and watermark."""
+        with self._db:
+            self._db.execute("DELETE FROM partials")
+            self._db.execute("DELETE FROM watermarks")
+
+    def update(self, paths: List[str], metrics=tuple(METRICS), chunksize: int = DEFAULT_CHUNKSIZE) -> Dict[str, int]:
+        """
+        Fold incidents past the watermarks into the daily partials.
+        :return: metric -> durations added
+        """
+        watermarks = self.watermarks()
+        pending: Dict[tuple, MetricStats] = {}
+        latest: Dict[str, pd.Timestamp] = {}
+        added = {metric: 0 for metric in metrics}
+        for path in paths:
+            available = input_columns(path)
+            dims = [d for d in DIMENSIONS if d in available]
+            columns = sorted({col for metric in metrics for col in METRICS[metric]}) + dims
+            newer_than = {METRICS[m][1]: watermarks[m] for m in metrics if m in watermarks}
+            # Without a watermark for some metric every row is needed
+            if len(newer_than) < len(metrics):
+                newer_than = None
+            for chunk in iter_incidents(path, columns, chunksize, newer_than):
+                for metric in metrics:
+                    added[metric] += self._add_chunk(chunk, metric, dims, watermarks.get(metric), pending, latest)
+        self._commit(pending, latest)
+        return added
+
+    def _add_chunk(self, chunk: pd.DataFrame, metric: str, dims: List[str], watermark: Optional[pd.Timestamp],
+                   pending: Dict[tuple, MetricStats], latest: Dict[str, pd.Timestamp]) -> int:
+        end = chunk[METRICS[metric][1]]
+        mask = end.notna() & chunk[METRICS[metric][0]].notna()
+        if watermark is not None:
+            mask &= end > watermark
+        rows = chunk[mask]
+        if rows.empty:
+            return 0
+        hours = duration_hours(rows, metric)
+        days = rows[METRICS[metric][1]].dt.strftime("%Y-%m-%d")
+        keys = [days + "|" + OVERALL]
+        keys += [days + "|" + f"{dim}=" + rows[dim].astype("string").fillna("unknown") for dim in dims]
+        for key in keys:
+            for value, positions in group_rows(key):
+                day, grp = value.split("|", 1)
+                stats = pending.setdefault((metric, day, grp), MetricStats(self.accuracy))
+                stats.add(hours[positions])
+        newest = rows[METRICS[metric][1]].max()
+        if metric not in latest or newest > latest[metric]:
+            latest[metric] = newest
+        return len(rows)
+
+    def _commit(self, pending: Dict[tuple, MetricStats], latest: Dict[str, pd.Timestamp]) -> None:
+        with self._db:
+            for (metric, day, grp), stats in pending.items():
+                row = self._db.execute(
+                    "SELECT stats FROM partials WHERE metric = ? AND day = ? AND grp = ?", (metric, day, grp)
+                ).fetchone()
+                if row:
+                    stats = MetricStats.from_dict(json.loads(row[0])).merge(stats)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO partials (metric, day, grp, stats) VALUES (?, ?, ?, ?)",
+                    (metric, day, grp, json.dumps(stats.to_dict(), separators=(",", ":")))
+                )
+            for metric, ts in latest.items():
+                self._db.execute(
+                    "INSERT INTO watermarks (metric, ts) VALUES (?, ?) "
+                    "ON CONFLICT (metric) DO UPDATE SET ts = MAX(ts, excluded.ts)",
+                    (metric, ts.isoformat())
+                )
+
+    def rollup(self, metrics=tuple(METRICS), start: Optional[str] = None, end: Optional[str] = None,
+               group_by: Optional[str] = None) -> MetricsAccumulator:
+        """
+        Merge the daily partials of [start, end) (YYYY-MM-DD, open when None).
+
+        :param group_by: a dimension (severity, source) or a period (day, week, month).
+        """
+        acc = MetricsAccumulator(metrics, group_by, self.accuracy)
+        query = "SELECT metric, day, grp, stats FROM partials WHERE metric IN ({})".format(
+            ",".join("?" * len(acc.metrics)))
+        params: list = list(acc.metrics)
+        if start:
+            query += " AND day >= ?"
+            params.append(start)
+        if end:
+            query += " AND day < ?"
+            params.append(end)
+        if group_by in DIMENSIONS:
+            query += " AND (grp = ? OR grp LIKE ?)"
+            params += [OVERALL, f"{group_by}=%"]
+        else:
+            query += " AND grp = ?"
+            params.append(OVERALL)
+
+        for metric, day, grp, stats in self._db.execute(query, params):
+            stats = MetricStats.from_dict(json.loads(stats))
+            targets = [grp.split("=", 1)[1]] if grp != OVERALL else [OVERALL]
+            if grp == OVERALL and group_by in PERIODS:
+                targets.append(period_of(day, group_by))
+            for target in targets:
+                acc._stats(target)[metric].merge(stats)
+
+        # Incidents counted as the durations of the most complete metric
+        for group, by_metric in acc.groups.items():
+            count = max(s.count for s in by_metric.values())
+            if group == OVERALL:
+                acc.rows = count
+            else:
+                acc.group_rows[group] = count
+        return acc
+
+    def stats(self) -> Dict[str, object]:
+        days = self._db.execute("SELECT MIN(day), MAX(day), COUNT(DISTINCT day) FROM partials").fetchone()
+        rows = self._db.execute("SELECT COUNT(*) FROM partials").fetchone()[0]
+        return {
+            "watermarks": {m: ts.isoformat() for m, ts in self.watermarks().items()},
+            "first_day": days[0], "last_day": days[1], "days": days[2], "partials": rows,
+            "size_kb": round(os.path.getsize(self.path) / 1024, 1),
+        }
+
+
+def incremental_calculator(metric: str, args) -> None:
+    """calculate_mttd.py/calculate_mttr.py with --state: update the partials, then report all history."""
+    if args.output:
+        raise SystemExit("--output needs every row and cannot be combined with --state")
+    partials = DailyPartials(args.state)
+    try:
+        added = partials.update([args.input], [metric], args.chunksize)
+        print(f"Added {added[metric]} new incidents to {args.state}")
+        print_metric(partials.rollup([metric], group_by=args.group_by), metric)
+    finally:
+        partials.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Incremental MTTD/MTTR from per-day partial aggregates.")
+    parser.add_argument("--state", default=STATE_FILE, help="SQLite file with the partials and watermarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    upd = sub.add_parser("update", help="Fold incidents past the watermarks into the partials")
+    upd.add_argument("--input", required=True, nargs="+", help="Incident CSV or Parquet files")
+    upd.add_argument("--metrics", nargs="+", choices=list(METRICS), default=list(METRICS))
+    upd.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Rows per chunk")
+    upd.add_argument("--rebuild", action="store_true", help="Drop all partials and watermarks first")
+
+    rep = sub.add_parser("report", help="Merge partials of a period")
+    rep.add_argument("--start", help="First day (YYYY-MM-DD)")
+    rep.add_argument("--end", help="Day after the last one (YYYY-MM-DD)")
+    rep.add_argument("--last-days", type=int, help="Report the last N days up to today")
+    rep.add_argument("--group-by", choices=list(DIMENSIONS) + list(PERIODS), help="Dimension or period")
+    rep.add_argument("--format", choices=["table", "json"], default="table")
+    rep.add_argument("--report", help="Write the filled report template to this path")
+    rep.add_argument("--template", default=TEMPLATE_PATH, help="Report template")
+
+    sub.add_parser("status", help="Show watermarks and partials")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    partials = DailyPartials(args.state)
+    try:
+        if args.command == "update":
+            if args.rebuild:
+                partials.rebuild()
+            start = time.perf_counter()
+            added = partials.update(args.input, args.metrics, args.chunksize)
+            print(f"Added {added} in {time.perf_counter() - start:.1f}s; "
+                  f"watermarks {partials.stats()['watermarks']}")
+        elif args.command == "report":
+            start, end = args.start, args.end
+            if args.last_days:
+                today = pd.Timestamp.now().normalize()
+                start = (today - pd.Timedelta(days=args.last_days - 1)).strftime("%Y-%m-%d")
+                end = (today + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+            began = time.perf_counter()
+            acc = partials.rollup(start=start, end=end, group_by=args.group_by)
+            elapsed_ms = (time.perf_counter() - began) * 1000
+            print_results(acc, args.format)
+            print(f"Merged partials in {elapsed_ms:.1f} ms")
+            if args.report:
+                with open(args.report, "w", encoding="utf-8") as f:
+                    f.write(fill_report(acc, start or "-", end or "-", template_path=args.template))
+                print(f"Report saved to {args.report}")
+        else:
+            print(json.dumps(partials.stats(), indent=2))
+    finally:
+        partials.close()
+
+
+if __name__ == "__main__":
+    main()
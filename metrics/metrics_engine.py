@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+metrics_engine.py: Streaming MTTD/MTTR statistics for large incident exports.
+
+Reads the incidents CSV in chunks (or a Parquet file batch by batch) and
+computes MTTD and MTTR in a single pass: count, mean, min/max and quantiles
+(median, p90, p99) from a mergeable relative-error quantile sketch, overall
+and grouped by severity, source or week. Accumulated results can be saved
+as JSON and merged across shards, giving the same result as one run over
+all the files.
+
+Examples:
+  python metrics_engine.py compute --input incidents.csv --group-by severity
+  python metrics_engine.py compute --input 2023.parquet --group-by week --save shard-2023.json
+  python metrics_engine.py merge shard-2022.json shard-2023.json
+"""
+import json
+import math
+import argparse
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# metric -> (start column, end column)
+METRICS = {
+    "mttd": ("occurrence_time", "detection_time"),
+    "mttr": ("detection_time", "resolution_time"),
+}
+METRIC_NAMES = {"mttd": "Mean Time To Detect", "mttr": "Mean Time To Respond"}
+GROUP_BY = ("severity", "source", "week")
+QUANTILES = (0.5, 0.9, 0.99)
+DEFAULT_CHUNKSIZE = 200000
+DEFAULT_ACCURACY = 0.01
+OVERALL = "all"
+
+
+class QuantileSketch:
+    """
+    Relative-error quantile sketch (DDSketch-style log buckets).
+
+    Every positive value is counted in bucket ceil(log_gamma(x)), so any
+    quantile is returned within ``accuracy`` relative error and two sketches
+    merge exactly by adding bucket counts.
+    """
+
+    def __init__(self, accuracy: float = DEFAULT_ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+
+    @property
+    def count(self) -> int:
+        return self.zero_count + sum(self.buckets.values())
+
+    def add(self, values: np.ndarray) -> None:
+        """Add an array of non-negative values."""
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        if not len(positive):
+            return
+        keys, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        if other.accuracy != self.accuracy:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        self.zero_count += other.zero_count
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # Bucket midpoint in relative terms: within accuracy of every value in it
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self) -> dict:
+        return {"accuracy": self.accuracy, "zero_count": self.zero_count,
+                "buckets": {str(k): v for k, v in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "QuantileSketch":
+        sketch = cls(data["accuracy"])
+        sketch.zero_count = data["zero_count"]
+        sketch.buckets = {int(k): v for k, v in data["buckets"].items()}
+        return sketch
+
+
+class MetricStats:
+    """Count, sum, min/max and quantile sketch of one duration metric (hours)."""
+
+    def __init__(self, accuracy: float = DEFAULT_ACCURACY):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        # Rows where the end timestamp precedes the start one
+        self.negative = 0
+        self.sketch = QuantileSketch(accuracy)
+
+    def add(self, hours: np.ndarray) -> None:
+        hours = hours[~np.isnan(hours)]
+        valid = hours[hours >= 0]
+        self.negative += len(hours) - len(valid)
+        if not len(valid):
+            return
+        self.count += len(valid)
+        self.total += float(valid.sum())
+        self.min = min(self.min, float(valid.min()))
+        self.max = max(self.max, float(valid.max()))
+        self.sketch.add(valid)
+
+    def merge(self, other: "MetricStats") -> "MetricStats":
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.negative += other.negative
+        self.sketch.merge(other.sketch)
+        return self
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        result = {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "negative": self.negative,
+        }
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}"] = self.sketch.quantile(q)
+        return result
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "total": self.total, "negative": self.negative,
+                "min": self.min if self.count else None, "max": self.max if self.count else None,
+                "sketch": self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MetricStats":
+        stats = cls(data["sketch"]["accuracy"])
+        stats.count = data["count"]
+        stats.total = data["total"]
+        stats.negative = data["negative"]
+        stats.min = data["min"] if data["min"] is not None else math.inf
+        stats.max = data["max"] if data["max"] is not None else -math.inf
+        stats.sketch = QuantileSketch.from_dict(data["sketch"])
+        return stats
+
+
+def duration_hours(chunk: pd.DataFrame, metric: str) -> np.ndarray:
+    start, end = METRICS[metric]
+    return (chunk[end] - chunk[start]).dt.total_seconds().to_numpy(dtype=np.float64) / 3600.0
+
+
+def group_rows(keys: pd.Series):
+    """Yield (key, row positions) for every distinct value of ``keys``, sorting once."""
+    codes, uniques = pd.factorize(keys, sort=True)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    for i, key in enumerate(uniques):
+        yield key, order[bounds[i]:bounds[i + 1]]
+
+
+def week_of(timestamps: pd.Series) -> pd.Series:
+    """Monday (YYYY-MM-DD) of the week of every timestamp."""
+    day = timestamps.dt.floor("D")
+    return (day - pd.to_timedelta(day.dt.dayofweek, unit="D")).dt.strftime("%Y-%m-%d")
+
+
+class MetricsAccumulator:
+    """MetricStats per metric, overall and per group, updated chunk by chunk."""
+
+    def __init__(self, metrics=tuple(METRICS), group_by: Optional[str] = None,
+                 accuracy: float = DEFAULT_ACCURACY):
+        self.metrics = list(metrics)
+        self.group_by = group_by
+        self.accuracy = accuracy
+        self.rows = 0
+        # group -> incidents (rows), including those with no valid duration
+        self.group_rows: Dict[str, int] = {}
+        # Weeks follow the start of the first metric (occurrence for MTTD, detection for MTTR)
+        self.week_column = METRICS[self.metrics[0]][0]
+        # group -> metric -> MetricStats
+        self.groups: Dict[str, Dict[str, MetricStats]] = {}
+
+    def _stats(self, group: str) -> Dict[str, MetricStats]:
+        if group not in self.groups:
+            self.groups[group] = {metric: MetricStats(self.accuracy) for metric in self.metrics}
+        return self.groups[group]
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        self.rows += len(chunk)
+        hours = {metric: duration_hours(chunk, metric) for metric in self.metrics}
+        for metric, values in hours.items():
+            self._stats(OVERALL)[metric].add(values)
+        if not self.group_by:
+            return
+        keys = week_of(chunk[self.week_column]) if self.group_by == "week" else chunk[self.group_by].astype("string")
+        for group, rows in group_rows(keys.fillna("unknown")):
+            stats = self._stats(str(group))
+            self.group_rows[str(group)] = self.group_rows.get(str(group), 0) + len(rows)
+            for metric, values in hours.items():
+                stats[metric].add(values[rows])
+
+    def merge(self, other: "MetricsAccumulator") -> "MetricsAccumulator":
+        if other.group_by != self.group_by:
+            raise ValueError(f"Cannot merge results grouped by {other.group_by} into {self.group_by}")
+        self.rows += other.rows
+        for group, count in other.group_rows.items():
+            self.group_rows[group] = self.group_rows.get(group, 0) + count
+        for metric in other.metrics:
+            if metric not in self.metrics:
+                self.metrics.append(metric)
+        for group, metrics in other.groups.items():
+            stats = self._stats(group)
+            for metric, value in metrics.items():
+                if metric not in stats:
+                    stats[metric] = MetricStats(self.accuracy)
+                stats[metric].merge(value)
+        return self
+
+    def summary(self) -> List[dict]:
+        """One row per (group, metric), overall first."""
+        groups = [OVERALL] + sorted(g for g in self.groups if g != OVERALL)
+        return [
+            {"group": group, "metric": metric, **self.groups[group][metric].summary()}
+            for group in groups if group in self.groups
+            for metric in self.metrics if metric in self.groups[group]
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "metrics": self.metrics, "group_by": self.group_by, "accuracy": self.accuracy, "rows": self.rows,
+            "group_rows": self.group_rows,
+            "groups": {g: {m: s.to_dict() for m, s in metrics.items()} for g, metrics in self.groups.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MetricsAccumulator":
+        acc = cls(data["metrics"], data["group_by"], data["accuracy"])
+        acc.rows = data["rows"]
+        acc.group_rows = data.get("group_rows", {})
+        acc.groups = {
+            g: {m: MetricStats.from_dict(s) for m, s in metrics.items()} for g, metrics in data["groups"].items()
+        }
+        return acc
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str) -> "MetricsAccumulator":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def required_columns(metrics, group_by: Optional[str] = None) -> List[str]:
+    columns = sorted({col for metric in metrics for col in METRICS[metric]})
+    if group_by and group_by != "week":
+        columns.append(group_by)
+    return columns
+
+
+def _parquet_batches(path: str, columns: Optional[List[str]], chunksize: int,
+                     newer_than: Optional[Dict[str, pd.Timestamp]]):
+    import pyarrow.parquet as pq
+    if not newer_than:
+        return (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(chunksize, columns=columns))
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(path, format="parquet")
+    condition = None
+    for col, ts in newer_than.items():
+        if not pa.types.is_timestamp(dataset.schema.field(col).type):
+            # Only timestamp columns can be compared by pyarrow; filter after parsing instead
+            return _parquet_batches(path, columns, chunksize, None)
+        # Floored to microseconds: may let a few older rows through, which the exact check below drops
+        term = ds.field(col) > pa.scalar(ts.floor("us").to_pydatetime(), type=dataset.schema.field(col).type)
+        condition = term if condition is None else condition | term
+    # Row groups whose statistics rule out newer rows are skipped without being read
+    return (batch.to_pandas() for batch in dataset.to_batches(columns=columns, filter=condition,
+                                                              batch_size=chunksize))
+
+
+def iter_incidents(path: str, columns: Optional[List[str]] = None, chunksize: int = DEFAULT_CHUNKSIZE,
+                   newer_than: Optional[Dict[str, pd.Timestamp]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Yield incident chunks with timestamp columns parsed. Only ``columns`` are
+    read (all when None); Parquet is read batch by batch with pyarrow.
+
+    :param newer_than: column -> timestamp; only rows where at least one of
+        these columns is later than its timestamp are yielded.
+    """
+    if path.endswith((".parquet", ".pq")):
+        batches = _parquet_batches(path, columns, chunksize, newer_than)
+    else:
+        batches = pd.read_csv(path, usecols=columns, chunksize=chunksize)
+    time_columns = {col for cols in METRICS.values() for col in cols}
+    for chunk in batches:
+        for col in time_columns.intersection(chunk.columns):
+            if not pd.api.types.is_datetime64_any_dtype(chunk[col]):
+                chunk[col] = pd.to_datetime(chunk[col], errors="coerce")
+        if newer_than:
+            keep = np.zeros(len(chunk), dtype=bool)
+            for col, ts in newer_than.items():
+                keep |= (chunk[col] > ts).to_numpy()
+            if not keep.any():
+                continue
+            chunk = chunk[keep]
+        yield chunk
+
+
+def compute(paths: List[str], metrics=tuple(METRICS), group_by: Optional[str] = None,
+            chunksize: int = DEFAULT_CHUNKSIZE, accuracy: float = DEFAULT_ACCURACY,
+            extended_output: Optional[str] = None) -> MetricsAccumulator:
+    """
+    Single pass over every file in ``paths``. With ``extended_output`` every
+    row is also written, chunk by chunk, to that CSV with added
+    '<metric>_hours' columns.
+    """
+    acc = MetricsAccumulator(metrics, group_by, accuracy)
+    columns = None if extended_output else required_columns(metrics, group_by)
+    header = True
+    for path in paths:
+        for chunk in iter_incidents(path, columns, chunksize):
+            acc.update(chunk)
+            if extended_output:
+                for metric in metrics:
+                    chunk[f"{metric}_hours"] = duration_hours(chunk, metric)
+                chunk.to_csv(extended_output, mode="w" if header else "a", header=header, index=False)
+                header = False
+    return acc
+
+
+def format_table(rows: List[dict]) -> str:
+    def fmt(value):
+        return "-" if value is None else f"{value:.2f}"
+
+    lines = [f"{'group':<16} {'metric':<6} {'count':>9} {'mean':>9} {'median':>9} {'p90':>9} {'p99':>9} {'max':>9}"]
+    for row in rows:
+        lines.append(
+            f"{row['group']:<16} {row['metric']:<6} {row['count']:>9} {fmt(row['mean']):>9} {fmt(row['p50']):>9} "
+            f"{fmt(row['p90']):>9} {fmt(row['p99']):>9} {fmt(row['max']):>9}"
+        )
+    skipped = sum(row["negative"] for row in rows if row["group"] == OVERALL)
+    if skipped:
+        lines.append(f"Skipped {skipped} durations with end before start")
+    return "\n".join(lines)
+
+
+def print_results(acc: MetricsAccumulator, output_format: str = "table") -> None:
+    rows = acc.summary()
+    if output_format == "json":
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"Incidents analyzed: {acc.rows} (hours)")
+        print(format_table(rows))
+
+
+def calculator_main(metric: str, args) -> None:
+    """Shared entry point of calculate_mttd.py and calculate_mttr.py."""
+    acc = compute([args.input], [metric], args.group_by, args.chunksize, extended_output=args.output)
+    print_metric(acc, metric)
+    if args.output:
+        print(f"Extended CSV with {metric.upper()} saved to {args.output}")
+
+
+def print_metric(acc: MetricsAccumulator, metric: str) -> None:
+    """Overall mean and quantiles of ``metric``, then the per-group table if grouped."""
+    stats = acc.groups.get(OVERALL, {}).get(metric)
+    summary = stats.summary() if stats else {"mean": None}
+    if summary["mean"] is None:
+        print(f"{METRIC_NAMES[metric]} (hours): no valid incidents")
+    else:
+        print(f"{METRIC_NAMES[metric]} (hours): {summary['mean']:.2f}")
+        print(f"Median / p90 / p99 (hours): {summary['p50']:.2f} / {summary['p90']:.2f} / {summary['p99']:.2f}")
+    if acc.group_by:
+        print(format_table([row for row in acc.summary() if row["group"] != OVERALL]))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Streaming MTTD/MTTR statistics for incident exports.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    comp = sub.add_parser("compute", help="Compute statistics from incident files")
+    comp.add_argument("--input", required=True, nargs="+", help="Incident CSV or Parquet files")
+    comp.add_argument("--metrics", nargs="+", choices=list(METRICS), default=list(METRICS))
+    comp.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Rows per chunk")
+    comp.add_argument("--accuracy", type=float, default=DEFAULT_ACCURACY, help="Quantile relative accuracy")
+    comp.add_argument("--save", help="Save mergeable results to this JSON file")
+
+    merge = sub.add_parser("merge", help="Merge results saved by 'compute --save'")
+    merge.add_argument("shards", nargs="+", help="Saved result files")
+    merge.add_argument("--save", help="Save the merged results to this JSON file")
+
+    comp.add_argument("--group-by", choices=GROUP_BY, help="Also report statistics per group")
+    for p in (comp, merge):
+        p.add_argument("--format", choices=["table", "json"], default="table")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "compute":
+        acc = compute(args.input, args.metrics, args.group_by, args.chunksize, args.accuracy)
+    else:
+        acc = MetricsAccumulator.load(args.shards[0])
+        for shard in args.shards[1:]:
+            acc.merge(MetricsAccumulator.load(shard))
+    print_results(acc, args.format)
+    if args.save:
+        acc.save(args.save)
+        print(f"Results saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+report.py: Fill metrics/report_template.md from computed MTTD/MTTR statistics.
+
+Placeholders of the template are replaced with the overall values, the
+metrics table gets median/p90/p99 rows, the example incident row is replaced
+with the listed incidents and, for grouped statistics, a per-group table is
+added before the charts section.
+"""
+import os
+from typing import List, Optional
+
+from metrics_engine import MetricsAccumulator, OVERALL
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), "report_template.md")
+GROUP_TITLES = {"severity": "severidad", "source": "fuente", "day": "día", "week": "semana", "month": "mes"}
+
+
+def _fmt(value) -> str:
+    return "-" if value is None else f"{value:.2f}"
+
+
+def _time(value) -> str:
+    if value is None:
+        return "-"
+    return value.strftime("%Y-%m-%d %H:%M:%S") if hasattr(value, "strftime") else str(value)
+
+
+def _summary(acc: MetricsAccumulator, group: str, metric: str) -> dict:
+    stats = acc.groups.get(group, {}).get(metric)
+    return stats.summary() if stats else {"count": 0, "mean": None, "p50": None, "p90": None, "p99": None}
+
+
+def incident_row(incident: dict) -> str:
+    return (
+        f"| {incident['id']} | {_time(incident.get('occurrence_time'))} | {_time(incident.get('detection_time'))} "
+        f"| {_time(incident.get('resolution_time'))} | {_fmt(incident.get('mttd_hours'))} "
+        f"| {_fmt(incident.get('mttr_hours'))} |"
+    )
+
+
+def group_table(acc: MetricsAccumulator) -> List[str]:
+    title = GROUP_TITLES.get(acc.group_by, acc.group_by)
+    lines = [
+        f"## Métricas por {title}",
+        "",
+        f"| {title.capitalize()} | Incidentes | MTTD media | MTTD p90 | MTTR media | MTTR p90 |",
+        "|---|---|---|---|---|---|",
+    ]
+    for group in sorted(g for g in acc.groups if g != OVERALL):
+        mttd, mttr = _summary(acc, group, "mttd"), _summary(acc, group, "mttr")
+        lines.append(f"| {group} | {acc.group_rows.get(group, 0)} | {_fmt(mttd['mean'])} | {_fmt(mttd['p90'])} "
+                     f"| {_fmt(mttr['mean'])} | {_fmt(mttr['p90'])} |")
+    return lines + ["", "---", ""]
+
+
+def fill_report(acc: MetricsAccumulator, start: str, end: str, incidents: Optional[List[dict]] = None,
+                template_path: str = TEMPLATE_PATH, n_incidents: Optional[int] = None) -> str:
+    """
+    Render the report template.
+
+    :param start: Period start shown in the report.
+    :param end: Period end shown in the report.
+    :param incidents: Rows for the incident list (id, occurrence_time, detection_time,
+        resolution_time, mttd_hours, mttr_hours).
+    :param n_incidents: Incident count; defaults to the rows accumulated in ``acc``.
+    """
+    with open(template_path, encoding="utf-8") as f:
+        text = f.read()
+    mttd, mttr = _summary(acc, OVERALL, "mttd"), _summary(acc, OVERALL, "mttr")
+    values = {
+        "fecha_inicio": start,
+        "fecha_fin": end,
+        "num_incidentes": str(acc.rows if n_incidents is None else n_incidents),
+        "valor_mttd": _fmt(mttd["mean"]),
+        "valor_mttr": _fmt(mttr["mean"]),
+    }
+
+    lines = []
+    skip_ellipsis = False
+    for line in text.splitlines():
+        if skip_ellipsis and line.startswith("| ..."):
+            skip_ellipsis = False
+            continue
+        if "`<id>`" in line:
+            lines.extend(incident_row(incident) for incident in incidents or [])
+            skip_ellipsis = True
+            continue
+        if line.startswith("## Gráficos") and acc.group_by:
+            lines.extend(group_table(acc))
+        is_mttr_row = line.startswith("| MTTR") and "<valor_mttr>" in line
+        for key, value in values.items():
+            line = line.replace(f"`<{key}>`", value).replace(f"<{key}>", value)
+        lines.append(line)
+        if is_mttr_row:
+            for name, summary in (("MTTD", mttd), ("MTTR", mttr)):
+                for label, key in (("mediana", "p50"), ("p90", "p90"), ("p99", "p99")):
+                    lines.append(f"| {name} {label} | {_fmt(summary[key])} |")
+    return "\n".join(lines) + "\n"
@@ -4,7 +4,9 @@ misp_client.py: MISP API integration module using PyMISP.
 Provides helper functions to fetch events, retrieve IOCs, and push indicators to a MISP instance.
 """
 import os
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Dict, Any
 
 from pymisp import ExpandedPyMISP, MISPEvent, MISPAttribute
@@ -13,6 +15,10 @@ from pymisp import ExpandedPyMISP, MISPEvent, MISPAttribute
 MISP_URL = os.getenv('MISP_URL')  # e.g., https://misp.example.com
 MISP_KEY = os.getenv('MISP_KEY')  # your API key
 MISP_VERIFY = os.getenv('MISP_VERIFY', 'False').lower() in ('true', '1', 'yes')
+# Event fetching: time slice width, events per page and concurrent slices
+DEFAULT_SLICE_SECONDS = 3600
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_WORKERS = 4
 
 
 def setup_logging():
@@ -36,21 +42,44 @@ class MISPClient:
         setup_logging()
         logging.info(f"Initialized MISP client for {self.url}")
 
-    def get_events(self, last: Optional[int] = None) -> List[Dict[str, Any]]:
+    def get_events(self, last: Optional[int] = None, slice_seconds: int = DEFAULT_SLICE_SECONDS,
+                   page_size: int = DEFAULT_PAGE_SIZE, workers: int = DEFAULT_WORKERS) -> List[Dict[str, Any]]:
         """
         Fetch events from MISP. If 'last' (in seconds) is provided, returns events created/modified in that timeframe.
+        The timeframe is split into slices of 'slice_seconds' fetched concurrently, 'page_size' events per page.
         """
-        params: Dict[str, Any] = {"returnFormat": "json"}
-        if last:
-            params['last'] = last
-            logging.info(f"Fetching events from last {last} seconds")
-        else:
+        if not last:
             logging.info("Fetching all events")
-        result = self.client.search('events', **params)
-        events = result.get('response', [])
+            return self._search_pages(page_size=page_size)
+
+        end = int(time.time())
+        start = end - int(last)
+        slices = [(s, min(s + slice_seconds, end)) for s in range(start, end, slice_seconds)]
+        logging.info(f"Fetching events from last {last} seconds in {len(slices)} slices")
+        events: List[Dict[str, Any]] = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for batch in pool.map(lambda sl: self._search_pages(sl[0], sl[1], page_size), slices):
+                events.extend(batch)
         logging.info(f"Retrieved {len(events)} events from MISP")
         return events
 
+    def _search_pages(self, start: Optional[int] = None, end: Optional[int] = None,
+                      page_size: int = DEFAULT_PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Page through events/restSearch, optionally restricted to the [start, end) timestamp range."""
+        params: Dict[str, Any] = {"return_format": "json", "limit": page_size}
+        if start is not None:
+            params['timestamp'] = (str(start), str(end - 1))
+        events: List[Dict[str, Any]] = []
+        page = 1
+        while True:
+            result = self.client.search('events', page=page, **params)
+            batch = result.get('response', []) if isinstance(result, dict) else result
+            events.extend(batch)
+            if len(batch) < page_size:
+                break
+            page += 1
+        return events
+
     def get_iocs_from_event(self, event_id: int) -> List[Dict[str, Any]]:
         """
         Retrieve all attributes (IOCs) from a specific event by ID.
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+chunked_training.py: Out-of-core training path for datasets that don't fit in RAM.
+
+Streams the CSV/Parquet file in chunks with explicit dtypes:
+  1. one pass fits the FeaturePreprocessor statistics (partial_fit), counts
+     rows and learns the label classes,
+  2. a second pass transforms each chunk straight into float32 design
+     matrices memory-mapped on disk (train and test split, stratified per
+     class), with labels stored as integer class codes,
+then trains on the memmap, or with bounded memory either by growing a
+warm-started forest block by block or by fitting on a stratified reservoir
+sample of the training rows.
+
+With a sparse preprocessor the chunks are stacked into CSR matrices saved as
+.npz instead, since their size follows the non-zeros rather than the width.
+The original labels are kept in ``preprocessor.classes_`` (code i is
+classes_[i]); restore_classes() makes a model trained on the codes predict them.
+"""
+import os
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse as sp
+from sklearn.ensemble import RandomForestClassifier
+
+from dataset_preprocessing import FeaturePreprocessor, iter_chunks, infer_dtypes, DEFAULT_CHUNKSIZE
+
+LABEL = 'label'
+
+
+def split_masks(chunks: Iterator[pd.DataFrame], test_size: float, seed: int = 42) -> Iterator[Tuple[pd.DataFrame, np.ndarray]]:
+    """
+    Pair every chunk with a boolean test-row mask, stratified per class: each
+    class's test rows so far stay at round(test_size * rows of the class so
+    far), picked at random within the chunk. The masks come from one seeded
+    generator, so two passes over the same file get identical splits.
+    """
+    rng = np.random.default_rng(seed)
+    seen: Dict[object, int] = {}
+    in_test: Dict[object, int] = {}
+    for chunk in chunks:
+        mask = np.zeros(len(chunk), dtype=bool)
+        for label, positions in chunk.groupby(LABEL, sort=True).indices.items():
+            total = seen.get(label, 0) + len(positions)
+            n_test = int(round(test_size * total)) - in_test.get(label, 0)
+            if n_test > 0:
+                mask[rng.permutation(positions)[:n_test]] = True
+            seen[label] = total
+            in_test[label] = in_test.get(label, 0) + max(n_test, 0)
+        yield chunk, mask
+
+
+def label_dtype(n_classes: int):
+    """Smallest signed integer type holding the class codes."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_classes <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def encode_labels(labels: pd.Series, classes: np.ndarray) -> np.ndarray:
+    """Class codes of ``labels`` (index into ``classes``)."""
+    codes = pd.Categorical(labels, categories=classes).codes
+    if (codes < 0).any():
+        raise ValueError(f'{int((codes < 0).sum())} rows have a missing {LABEL!r} value')
+    return codes.astype(label_dtype(len(classes)))
+
+
+def restore_classes(clf, classes: np.ndarray):
+    """Make a model fitted on class codes predict the original labels."""
+    clf.classes_ = np.asarray(classes)
+    return clf
+
+
+def fit_preprocessor(path: str, dtypes: Dict[str, str], chunksize: int, test_size: float,
+                     **preprocessor_kwargs):
+    """
+    Pass 1: fit the preprocessor on the training rows, count rows per split and
+    class and store the sorted classes (of both splits) as ``classes_``.
+    :return: (preprocessor, n_train, n_test, class_counts)
+    """
+    preprocessor = FeaturePreprocessor(**preprocessor_kwargs)
+    n_train = n_test = 0
+    class_counts: Dict[object, int] = {}
+    classes = set()
+    for chunk, test_mask in split_masks(iter_chunks(path, chunksize, dtypes), test_size):
+        train = chunk[~test_mask]
+        preprocessor.partial_fit(train.drop(columns=[LABEL]))
+        n_train += len(train)
+        n_test += int(test_mask.sum())
+        classes.update(chunk[LABEL].dropna().unique().tolist())
+        for label, count in train[LABEL].value_counts().items():
+            class_counts[label] = class_counts.get(label, 0) + int(count)
+    preprocessor = preprocessor.finalize()
+    preprocessor.classes_ = np.asarray(sorted(classes))
+    return preprocessor, n_train, n_test, class_counts
+
+
+def build_design_matrices(path: str, dtypes: Dict[str, str], chunksize: int, test_size: float,
+                          preprocessor: FeaturePreprocessor, n_train: int, n_test: int, cache_dir: str):
+    """
+    Pass 2: transform every chunk into float32 memory-mapped matrices.
+    :return: (X_train, y_train, X_test, y_test) as read-only memmaps.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    if preprocessor.sparse:
+        return build_sparse_matrices(path, dtypes, chunksize, test_size, preprocessor, cache_dir)
+    width = preprocessor.n_features
+    y_dtype = label_dtype(len(preprocessor.classes_))
+    paths = {name: os.path.join(cache_dir, f'{name}.npy') for name in ('X_train', 'y_train', 'X_test', 'y_test')}
+    X_train = np.lib.format.open_memmap(paths['X_train'], mode='w+', dtype=np.float32, shape=(n_train, width))
+    y_train = np.lib.format.open_memmap(paths['y_train'], mode='w+', dtype=y_dtype, shape=(n_train,))
+    X_test = np.lib.format.open_memmap(paths['X_test'], mode='w+', dtype=np.float32, shape=(n_test, width))
+    y_test = np.lib.format.open_memmap(paths['y_test'], mode='w+', dtype=y_dtype, shape=(n_test,))
+
+    i_train = i_test = 0
+    for chunk, test_mask in split_masks(iter_chunks(path, chunksize, dtypes), test_size):
+        X = preprocessor.transform(chunk.drop(columns=[LABEL]))
+        y = encode_labels(chunk[LABEL], preprocessor.classes_)
+        n_tr, n_te = int((~test_mask).sum()), int(test_mask.sum())
+        X_train[i_train:i_train + n_tr] = X[~test_mask]
+        y_train[i_train:i_train + n_tr] = y[~test_mask]
+        X_test[i_test:i_test + n_te] = X[test_mask]
+        y_test[i_test:i_test + n_te] = y[test_mask]
+        i_train += n_tr
+        i_test += n_te
+    for array in (X_train, y_train, X_test, y_test):
+        array.flush()
+    del X_train, y_train, X_test, y_test
+    return tuple(np.load(paths[name], mmap_mode='r') for name in ('X_train', 'y_train', 'X_test', 'y_test'))
+
+
+def build_sparse_matrices(path: str, dtypes: Dict[str, str], chunksize: int, test_size: float,
+                          preprocessor: FeaturePreprocessor, cache_dir: str):
+    """Pass 2 for sparse preprocessors: stack chunk CSR matrices and save them as .npz."""
+    parts = {'X_train': [], 'y_train': [], 'X_test': [], 'y_test': []}
+    for chunk, test_mask in split_masks(iter_chunks(path, chunksize, dtypes), test_size):
+        X = preprocessor.transform(chunk.drop(columns=[LABEL]))
+        y = encode_labels(chunk[LABEL], preprocessor.classes_)
+        parts['X_train'].append(X[~test_mask])
+        parts['y_train'].append(y[~test_mask])
+        parts['X_test'].append(X[test_mask])
+        parts['y_test'].append(y[test_mask])
+    result = []
+    for name in ('X_train', 'y_train', 'X_test', 'y_test'):
+        if name.startswith('X'):
+            matrix = sp.vstack(parts[name], format='csr')
+            sp.save_npz(os.path.join(cache_dir, f'{name}.npz'), matrix)
+        else:
+            matrix = np.concatenate(parts[name])
+            np.save(os.path.join(cache_dir, f'{name}.npy'), matrix)
+        result.append(matrix)
+    return tuple(result)
+
+
+def matrix_nbytes(X) -> int:
+    """Memory footprint of a dense array or CSR matrix."""
+    if sp.issparse(X):
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return X.nbytes
+
+
+def _rows(X, start: int, stop: int):
+    block = X[start:stop]
+    return block if sp.issparse(block) else np.asarray(block)
+
+
+def _stack(blocks):
+    return sp.vstack(blocks, format='csr') if sp.issparse(blocks[0]) else np.concatenate(blocks)
+
+
+class StratifiedReservoir:
+    """Uniform sample of at most ``per_class`` rows of each class, fed block by block."""
+
+    def __init__(self, per_class: int, seed: int = 42):
+        self.per_class = per_class
+        self.rng = np.random.default_rng(seed)
+        # class -> (random keys, rows)
+        self._samples: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def add(self, X: np.ndarray, y: np.ndarray) -> None:
+        for label in np.unique(y):
+            rows = X[y == label]
+            keys = self.rng.random(rows.shape[0])
+            if label in self._samples:
+                old_keys, old_rows = self._samples[label]
+                keys = np.concatenate([old_keys, keys])
+                rows = _stack([old_rows, rows])
+            if len(keys) > self.per_class:
+                keep = np.argpartition(keys, self.per_class)[:self.per_class]
+                keys, rows = keys[keep], rows[keep]
+            self._samples[label] = (keys, rows)
+
+    def sample(self) -> Tuple[np.ndarray, np.ndarray]:
+        labels = sorted(self._samples)
+        X = _stack([self._samples[label][1] for label in labels])
+        y = np.concatenate([np.full(self._samples[label][1].shape[0], label) for label in labels])
+        return X, y
+
+
+def iter_blocks(X: np.ndarray, y: np.ndarray, block_rows: int):
+    for start in range(0, X.shape[0], block_rows):
+        yield _rows(X, start, start + block_rows), np.asarray(y[start:start + block_rows])
+
+
+def train(X_train, y_train, mode: str = 'full', n_estimators: int = 100, block_rows: int = DEFAULT_CHUNKSIZE,
+          trees_per_block: Optional[int] = None, reservoir_per_class: int = 200000, max_depth: Optional[int] = None):
+    """
+    Train a RandomForest on the memory-mapped training matrix.
+
+    :param mode: 'full' fits on the whole memmap; 'warm-start' adds
+        ``trees_per_block`` trees per block of ``block_rows`` rows
+        (warm_start=True); 'reservoir' fits on a stratified reservoir sample.
+    """
+    if mode == 'full':
+        clf = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, random_state=42, n_jobs=-1)
+        clf.fit(X_train, y_train)
+        return clf
+
+    if mode == 'warm-start':
+        n_blocks = max(1, -(-X_train.shape[0] // block_rows))
+        per_block = trees_per_block or max(1, n_estimators // n_blocks)
+        clf = RandomForestClassifier(n_estimators=0, max_depth=max_depth, warm_start=True,
+                                     random_state=42, n_jobs=-1)
+        for X_block, y_block in iter_blocks(X_train, y_train, block_rows):
+            if len(np.unique(y_block)) < 2:
+                continue  # a single-class block would add trees that only ever predict that class
+            clf.set_params(n_estimators=clf.n_estimators + per_block)
+            clf.fit(X_block, y_block)
+        if clf.n_estimators == 0:
+            raise ValueError('No training block contained more than one class')
+        return clf
+
+    if mode == 'reservoir':
+        reservoir = StratifiedReservoir(reservoir_per_class)
+        for X_block, y_block in iter_blocks(X_train, y_train, block_rows):
+            reservoir.add(X_block, y_block)
+        X_sample, y_sample = reservoir.sample()
+        clf = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, random_state=42, n_jobs=-1)
+        clf.fit(X_sample, y_sample)
+        return clf
+
+    raise ValueError(f'Unknown training mode: {mode}')
+
+
+def predict_blocks(clf, X, block_rows: int = DEFAULT_CHUNKSIZE) -> np.ndarray:
+    """Predict a memory-mapped (or sparse) matrix block by block."""
+    return np.concatenate([
+        clf.predict(_rows(X, i, i + block_rows)) for i in range(0, X.shape[0], block_rows)
+    ])
+
+
+def prepare(path: str, cache_dir: str, dtypes: Optional[Dict[str, str]] = None,
+            chunksize: int = DEFAULT_CHUNKSIZE, test_size: float = 0.2, **preprocessor_kwargs):
+    """
+    Run both passes over ``path``; ``preprocessor_kwargs`` go to FeaturePreprocessor.
+    :return: (preprocessor, X_train, y_train, X_test, y_test)
+    """
+    dtypes = dtypes or infer_dtypes(path, label=LABEL)
+    start = time.perf_counter()
+    preprocessor, n_train, n_test, class_counts = fit_preprocessor(
+        path, dtypes, chunksize, test_size, **preprocessor_kwargs
+    )
+    print(f"Pass 1: {n_train} train / {n_test} test rows, classes {class_counts}, "
+          f"{preprocessor.n_features} features ({time.perf_counter() - start:.1f}s)")
+    start = time.perf_counter()
+    X_train, y_train, X_test, y_test = build_design_matrices(
+        path, dtypes, chunksize, test_size, preprocessor, n_train, n_test, cache_dir
+    )
+    size_mb = (matrix_nbytes(X_train) + matrix_nbytes(X_test)) / 1024 ** 2
+    kind = 'sparse CSR' if preprocessor.sparse else 'float32'
+    print(f"Pass 2: {kind} design matrices in {cache_dir} ({size_mb:.1f} MB, "
+          f"{time.perf_counter() - start:.1f}s)")
+    return preprocessor, X_train, y_train, X_test, y_test
@@ -2,48 +2,291 @@
 """
 dataset_preprocessing.py: Load and preprocess datasets for ML models.
 """
+import json
+from typing import Dict, Iterator, List, Optional
+
 import pandas as pd
 import numpy as np
-from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import StandardScaler
+from scipy import sparse as sp
+
+# Placeholder for missing categorical values
+MISSING_CATEGORY = 'missing'
+# Rows read per chunk by iter_chunks
+DEFAULT_CHUNKSIZE = 100000
+# Values per numeric column sampled to estimate the median in partial_fit
+MEDIAN_SAMPLE_SIZE = 100000
+
 
+def is_parquet(path: str) -> bool:
+    return path.endswith(('.parquet', '.pq'))
 
-def load_dataset(path: str) -> pd.DataFrame:
+
+def load_dataset(path: str, dtypes: Optional[Dict[str, str]] = None) -> pd.DataFrame:
     """
-    Load dataset from CSV file and return a pandas DataFrame.
+    Load dataset from a CSV (or Parquet) file and return a pandas DataFrame.
     """
-    df = pd.read_csv(path)
+    if is_parquet(path):
+        df = pd.read_parquet(path)
+        return df.astype(dtypes) if dtypes else df
+    df = pd.read_csv(path, dtype=dtypes)
     return df
 
 
-def preprocess_features(df: pd.DataFrame) -> np.ndarray:
+def load_dtypes(path: str) -> Dict[str, str]:
+    """Read a JSON {column: dtype} mapping, e.g. {"bytes": "float32", "process.name": "object"}."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def infer_dtypes(path: str, label: str = 'label', sample_rows: int = 10000) -> Dict[str, str]:
+    """
+    Infer compact dtypes from the first rows: float32 for numeric features
+    and object (str) for everything else. The label keeps its sampled type
+    (object for string labels); chunked training encodes it to class codes.
     """
-    Preprocess features:
-      - Impute missing numeric values with median.
-      - Scale numeric features to zero mean and unit variance.
-      - One-hot encode categorical features.
-    Returns a numpy array of processed features.
-    """
-    # Separate numeric and categorical columns
-    numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
-    categorical_cols = df.select_dtypes(exclude=[np.number]).columns.tolist()
-
-    # Impute numeric features
-    num_imputer = SimpleImputer(strategy='median')
-    X_num = num_imputer.fit_transform(df[numeric_cols])
-
-    # Scale numeric features
-    scaler = StandardScaler()
-    X_num_scaled = scaler.fit_transform(X_num)
-
-    # Encode categorical features
-    if categorical_cols:
-        df_cat = df[categorical_cols].fillna('missing')
-        X_cat = pd.get_dummies(df_cat, drop_first=True).values
-        # Concatenate numeric and categorical arrays
-        X_preprocessed = np.hstack([X_num_scaled, X_cat])
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        sample = next(pq.ParquetFile(path).iter_batches(batch_size=sample_rows)).to_pandas()
     else:
-        X_preprocessed = X_num_scaled
+        sample = pd.read_csv(path, nrows=sample_rows)
+    dtypes = {}
+    for col, dtype in sample.dtypes.items():
+        if col == label:
+            dtypes[col] = str(dtype) if pd.api.types.is_numeric_dtype(dtype) else 'object'
+        elif pd.api.types.is_numeric_dtype(dtype):
+            dtypes[col] = 'float32'
+        else:
+            dtypes[col] = 'object'
+    return dtypes
+
+
+def iter_chunks(path: str, chunksize: int = DEFAULT_CHUNKSIZE,
+                dtypes: Optional[Dict[str, str]] = None) -> Iterator[pd.DataFrame]:
+    """Stream a CSV or Parquet file as DataFrames of at most ``chunksize`` rows with explicit dtypes."""
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            df = batch.to_pandas()
+            yield df.astype(dtypes) if dtypes else df
+        return
+    yield from pd.read_csv(path, chunksize=chunksize, dtype=dtypes)
+
+
+def _bottom_k(keys: np.ndarray, values: np.ndarray, k: int):
+    """Keep the ``k`` entries with the smallest random keys (a uniform sample)."""
+    if len(keys) <= k:
+        return keys, values
+    keep = np.argpartition(keys, k)[:k]
+    return keys[keep], values[keep]
+
+
+class FeaturePreprocessor:
+    """
+    Fit/transform feature preprocessing whose fitted state is saved with the model.
+
+      - Numeric features: missing values imputed with the training median,
+        then scaled to zero mean and unit variance.
+      - Categorical features: one-hot encoded against the vocabulary seen at
+        fit time, plus one trailing "unknown" column per feature for values
+        never seen in training. The output width never changes between batches.
+
+    With ``max_categories`` each vocabulary keeps only its most frequent
+    values (the rest fall into the unknown column); with ``hash_buckets`` as
+    well, columns whose cardinality exceeds ``max_categories`` are instead
+    hashed into that many columns. ``sparse=True`` returns a scipy CSR
+    matrix, so memory scales with non-zeros rather than rows x categories.
+    """
+
+    # Defaults for preprocessors pickled before these options existed
+    sparse = False
+    max_categories = None
+    hash_buckets = None
+    hashed: Dict[str, int] = {}
+
+    def __init__(self, dtype=np.float32, sparse: bool = False, max_categories: Optional[int] = None,
+                 hash_buckets: Optional[int] = None):
+        self.dtype = dtype
+        self.sparse = sparse
+        self.max_categories = max_categories
+        self.hash_buckets = hash_buckets
+        self.numeric_cols: List[str] = []
+        self.categorical_cols: List[str] = []
+        self.medians: Optional[np.ndarray] = None
+        self.means: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.vocabularies: Dict[str, List[str]] = {}
+        # column -> number of hash buckets, for high-cardinality columns
+        self.hashed: Dict[str, int] = {}
+
+    def partial_fit(self, df: pd.DataFrame, seed: int = 42) -> 'FeaturePreprocessor':
+        """
+        Accumulate statistics from one chunk; call finalize() after the last one.
 
-    return X_preprocessed
+        Means and variances are merged exactly across chunks (including the
+        effect of median imputation); the median is estimated from a uniform
+        sample of MEDIAN_SAMPLE_SIZE values per column.
+        """
+        acc = getattr(self, '_acc', None)
+        if acc is None:
+            self.numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
+            self.categorical_cols = df.select_dtypes(exclude=[np.number]).columns.tolist()
+            k = len(self.numeric_cols)
+            acc = self._acc = {
+                'rng': np.random.default_rng(seed),
+                'count': np.zeros(k), 'mean': np.zeros(k), 'm2': np.zeros(k), 'missing': np.zeros(k),
+                'samples': [(np.empty(0), np.empty(0)) for _ in range(k)],
+                'vocab': {col: {} for col in self.categorical_cols},
+            }
 
+        X_num = df.reindex(columns=self.numeric_cols).to_numpy(dtype=np.float64)
+        observed = ~np.isnan(X_num)
+        n_b = observed.sum(axis=0)
+        sum_b = np.where(observed, X_num, 0).sum(axis=0)
+        mean_b = np.divide(sum_b, n_b, out=np.zeros_like(sum_b), where=n_b > 0)
+        m2_b = np.where(observed, (X_num - mean_b) ** 2, 0).sum(axis=0)
+        n_a, mean_a = acc['count'], acc['mean']
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        safe_n = np.where(n > 0, n, 1)
+        acc['mean'] = mean_a + delta * n_b / safe_n
+        acc['m2'] = acc['m2'] + m2_b + delta ** 2 * n_a * n_b / safe_n
+        acc['count'] = n
+        acc['missing'] += len(X_num) - n_b
+
+        for j in range(len(self.numeric_cols)):
+            values = X_num[observed[:, j], j]
+            keys, sample = acc['samples'][j]
+            acc['samples'][j] = _bottom_k(
+                np.concatenate([keys, acc['rng'].random(len(values))]),
+                np.concatenate([sample, values]), MEDIAN_SAMPLE_SIZE
+            )
+        for col in self.categorical_cols:
+            counts = acc['vocab'][col]
+            for value, count in self._categories(df[col]).value_counts().items():
+                counts[value] = counts.get(value, 0) + int(count)
+        return self
+
+    def finalize(self) -> 'FeaturePreprocessor':
+        """Turn the statistics accumulated by partial_fit into the fitted state."""
+        acc = self._acc
+        self.medians = np.array([
+            np.median(sample) if len(sample) else 0.0 for _, sample in acc['samples']
+        ])
+        # Missing values are imputed with the median before scaling
+        n_obs, n_miss = acc['count'], acc['missing']
+        total = np.where(n_obs + n_miss > 0, n_obs + n_miss, 1)
+        self.means = (n_obs * acc['mean'] + n_miss * self.medians) / total
+        m2 = acc['m2'] + n_obs * (acc['mean'] - self.means) ** 2 + n_miss * (self.medians - self.means) ** 2
+        std = np.sqrt(m2 / total)
+        self.scales = np.where(std > 0, std, 1.0)
+        self.hashed = {}
+        for col, counts in acc['vocab'].items():
+            self._set_vocabulary(col, pd.Series(counts, dtype=np.int64))
+        del self._acc
+        return self
+
+    def fit(self, df: pd.DataFrame) -> 'FeaturePreprocessor':
+        self.numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
+        self.categorical_cols = df.select_dtypes(exclude=[np.number]).columns.tolist()
+
+        X_num = df[self.numeric_cols].to_numpy(dtype=np.float64)
+        self.medians = np.nan_to_num(np.nanmedian(X_num, axis=0)) if len(X_num) else np.zeros(X_num.shape[1])
+        X_num = np.where(np.isnan(X_num), self.medians, X_num)
+        self.means = X_num.mean(axis=0) if len(X_num) else np.zeros(X_num.shape[1])
+        std = X_num.std(axis=0) if len(X_num) else np.ones(X_num.shape[1])
+        self.scales = np.where(std > 0, std, 1.0)
+
+        self.hashed = {}
+        for col in self.categorical_cols:
+            self._set_vocabulary(col, self._categories(df[col]).value_counts())
+        return self
+
+    def _set_vocabulary(self, col: str, counts: pd.Series) -> None:
+        """Pick the encoding of ``col`` from its category frequencies."""
+        if self.max_categories and len(counts) > self.max_categories:
+            if self.hash_buckets:
+                self.hashed[col] = self.hash_buckets
+                self.vocabularies[col] = []
+                return
+            counts = counts.sort_values(ascending=False, kind='stable').iloc[:self.max_categories]
+        self.vocabularies[col] = sorted(counts.index.tolist())
+
+    @staticmethod
+    def _categories(series: pd.Series) -> pd.Series:
+        return series.astype(object).where(series.notna(), MISSING_CATEGORY).astype(str)
+
+    def _width(self, col: str) -> int:
+        return self.hashed[col] if col in self.hashed else len(self.vocabularies[col]) + 1
+
+    @property
+    def n_features(self) -> int:
+        return len(self.numeric_cols) + sum(self._width(col) for col in self.categorical_cols)
+
+    @property
+    def feature_names(self) -> List[str]:
+        names = list(self.numeric_cols)
+        for col in self.categorical_cols:
+            if col in self.hashed:
+                names.extend(f'{col}#{i}' for i in range(self.hashed[col]))
+                continue
+            names.extend(f'{col}={value}' for value in self.vocabularies[col])
+            names.append(f'{col}=<unknown>')
+        return names
+
+    def _codes(self, col: str, values: pd.Series) -> np.ndarray:
+        """Column index within the block of ``col`` for every value."""
+        categories = self._categories(values)
+        if col in self.hashed:
+            hashes = pd.util.hash_array(categories.to_numpy(dtype=object))
+            return (hashes % np.uint64(self.hashed[col])).astype(np.int64)
+        vocab = self.vocabularies[col]
+        codes = pd.Categorical(categories, categories=vocab).codes.astype(np.int64)
+        codes[codes < 0] = len(vocab)  # unknown bucket
+        return codes
+
+    def transform(self, df: pd.DataFrame):
+        """
+        Vectorized transform to a fixed-width array (CSR matrix if ``sparse``);
+        missing columns are treated as missing values.
+        """
+        if self.medians is None:
+            raise ValueError('FeaturePreprocessor must be fitted before transform')
+        n = len(df)
+        n_num = len(self.numeric_cols)
+        # Every row has one entry per numeric column and one per categorical column
+        indices = np.empty((n, n_num + len(self.categorical_cols)), dtype=np.int64)
+        data = np.ones(indices.shape, dtype=self.dtype)
+
+        if self.numeric_cols:
+            X_num = df.reindex(columns=self.numeric_cols).to_numpy(dtype=np.float64)
+            X_num = np.where(np.isnan(X_num), self.medians, X_num)
+            data[:, :n_num] = (X_num - self.means) / self.scales
+            indices[:, :n_num] = np.arange(n_num)
+
+        offset = n_num
+        for j, col in enumerate(self.categorical_cols):
+            values = df[col] if col in df.columns else pd.Series([None] * n, index=df.index)
+            indices[:, n_num + j] = offset + self._codes(col, values)
+            offset += self._width(col)
+
+        if self.sparse:
+            X = sp.csr_matrix(
+                (data.ravel(), indices.ravel(), np.arange(n + 1) * indices.shape[1]),
+                shape=(n, self.n_features)
+            )
+            X.eliminate_zeros()
+            return X
+        X = np.zeros((n, self.n_features), dtype=self.dtype)
+        X[np.arange(n)[:, None], indices] = data
+        return X
+
+    def fit_transform(self, df: pd.DataFrame):
+        return self.fit(df).transform(df)
+
+
+def preprocess_features(df: pd.DataFrame) -> np.ndarray:
+    """
+    Fit a FeaturePreprocessor on ``df`` and return the processed feature array.
+    Use FeaturePreprocessor directly to keep the fitted state for inference.
+    """
+    return FeaturePreprocessor().fit_transform(df)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+forest_export.py: Export the trained RandomForest to compact flattened arrays.
+
+All trees are concatenated into one set of node arrays (feature, threshold,
+left/right child, leaf class probabilities) saved as a single .npz, with
+optional pruning to the first N trees and/or a maximum depth (nodes at that
+depth become leaves predicting their class distribution). CompactForest
+predicts with NumPy only, walking every row through every tree at once, one
+level per step.
+
+Thresholds are stored as the largest float32 not above sklearn's float64
+threshold, so float32 inputs take exactly the same branches as in sklearn.
+
+Example:
+  python forest_export.py --model lateral_movement_model.pkl --output lateral_movement_forest.npz \\
+      --max-trees 50 --max-depth 16 --bench-data holdout.csv
+"""
+import os
+import time
+import argparse
+import tracemalloc
+from typing import Optional
+
+import joblib
+import numpy as np
+from scipy import sparse as sp
+
+from model_utils import load_model
+
+LEAF = -1
+
+
+def _flatten_tree(tree, max_depth: Optional[int] = None):
+    """Node arrays of one sklearn tree, optionally cut at ``max_depth``."""
+    left = tree.children_left.astype(np.int64)
+    right = tree.children_right.astype(np.int64)
+    n = tree.node_count
+    depth = np.zeros(n, dtype=np.int64)
+    # Children always have larger indices than their parent in sklearn trees
+    for node in range(n):
+        if left[node] != -1:
+            depth[left[node]] = depth[right[node]] = depth[node] + 1
+
+    keep = np.ones(n, dtype=bool) if max_depth is None else depth <= max_depth
+    new_index = np.cumsum(keep) - 1
+    is_leaf = (left == -1) | (depth == max_depth if max_depth is not None else False)
+    is_leaf = is_leaf[keep]
+
+    feature = np.where(is_leaf, LEAF, tree.feature[keep]).astype(np.int32)
+    threshold = tree.threshold[keep]
+    threshold32 = threshold.astype(np.float32)
+    # Round down so that x <= threshold32 exactly when x <= threshold for float32 x
+    too_high = threshold32.astype(np.float64) > threshold
+    threshold32[too_high] = np.nextafter(threshold32[too_high], np.float32(-np.inf))
+    kept_left = np.where(is_leaf, LEAF, new_index[np.maximum(left[keep], 0)]).astype(np.int32)
+    kept_right = np.where(is_leaf, LEAF, new_index[np.maximum(right[keep], 0)]).astype(np.int32)
+
+    value = tree.value[keep][:, 0, :].astype(np.float64)
+    value /= np.maximum(value.sum(axis=1, keepdims=True), 1e-12)
+    tree_depth = int(depth[keep].max()) if keep.any() else 0
+    return feature, threshold32, kept_left, kept_right, value.astype(np.float32), tree_depth
+
+
+def export_forest(clf, max_trees: Optional[int] = None, max_depth: Optional[int] = None) -> dict:
+    """Flatten a fitted RandomForestClassifier into concatenated node arrays."""
+    if not hasattr(clf, 'estimators_') or not all(hasattr(est, 'tree_') for est in clf.estimators_[:1]):
+        raise ValueError(
+            f'Only a fitted RandomForestClassifier can be exported, not {type(clf).__name__}; '
+            f'probability-calibrated models (train_classifier.py --calibrate) must be scored with the pickle'
+        )
+    estimators = clf.estimators_[:max_trees] if max_trees else clf.estimators_
+    parts = [_flatten_tree(est.tree_, max_depth) for est in estimators]
+    offsets = np.cumsum([0] + [len(p[0]) for p in parts[:-1]])
+    shift = lambda arr, off: np.where(arr == LEAF, LEAF, arr + off).astype(np.int32)
+    return {
+        'feature': np.concatenate([p[0] for p in parts]),
+        'threshold': np.concatenate([p[1] for p in parts]),
+        'left': np.concatenate([shift(p[2], off) for p, off in zip(parts, offsets)]),
+        'right': np.concatenate([shift(p[3], off) for p, off in zip(parts, offsets)]),
+        'value': np.concatenate([p[4] for p in parts]),
+        'roots': offsets.astype(np.int32),
+        'depth': np.array(max(p[5] for p in parts), dtype=np.int32),
+        'classes': _portable_classes(clf.classes_),
+        'n_features': np.array(clf.n_features_in_, dtype=np.int32),
+    }
+
+
+def _portable_classes(classes) -> np.ndarray:
+    """Class labels as a numeric or fixed-width string array, which np.load reads without pickle."""
+    classes = np.asarray(classes)
+    return classes.astype(str) if classes.dtype == object else classes
+
+
+class CompactForest:
+    """NumPy-only predictor over arrays produced by export_forest."""
+
+    def __init__(self, arrays: dict):
+        for name in ('feature', 'threshold', 'left', 'right', 'value', 'roots', 'classes'):
+            setattr(self, name, arrays[name])
+        self.depth = int(arrays['depth'])
+        self.n_features = int(arrays['n_features'])
+        self.classes_ = self.classes
+
+    @classmethod
+    def load(cls, path: str) -> 'CompactForest':
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+    def save(self, path: str) -> None:
+        np.savez(path, feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+                 value=self.value, roots=self.roots, depth=np.array(self.depth, dtype=np.int32),
+                 classes=self.classes, n_features=np.array(self.n_features, dtype=np.int32))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in ('feature', 'threshold', 'left', 'right', 'value', 'roots'))
+
+    def apply(self, X) -> np.ndarray:
+        """Leaf index reached in every tree, shape (n_rows, n_trees)."""
+        if sp.issparse(X):
+            X = X.toarray()
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_trees = X.shape[0], len(self.roots)
+        nodes = np.tile(self.roots, n_rows)
+        # Offset of each (row, tree) pair's row in the flattened X
+        row_base = np.repeat(np.arange(n_rows, dtype=np.int64) * X.shape[1], n_trees)
+        flat_X = X.ravel()
+        # Only pairs still at an internal node are gathered at each level
+        active = np.arange(len(nodes))
+        for _ in range(self.depth):
+            current = nodes[active]
+            feat = self.feature[current]
+            internal = feat != LEAF
+            active, current, feat = active[internal], current[internal], feat[internal]
+            if not len(active):
+                break
+            go_right = flat_X[row_base[active] + feat] > self.threshold[current]
+            nodes[active] = np.where(go_right, self.right[current], self.left[current])
+        return nodes.reshape(n_rows, n_trees)
+
+    def predict_proba(self, X) -> np.ndarray:
+        return self.value[self.apply(X)].mean(axis=1)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def export_model(model_path: str, output_path: str, max_trees: Optional[int] = None,
+                 max_depth: Optional[int] = None) -> CompactForest:
+    """Export a model saved by train_classifier.py; its preprocessor is saved next to it."""
+    clf, preprocessor = load_model(model_path)
+    forest = CompactForest(export_forest(clf, max_trees, max_depth))
+    forest.save(output_path)
+    if preprocessor is not None:
+        joblib.dump(preprocessor, preprocessor_path(output_path))
+    return forest
+
+
+def preprocessor_path(forest_path: str) -> str:
+    return os.path.splitext(forest_path)[0] + '.preprocessor.joblib'
+
+
+def load_compact_model(forest_path: str):
+    """Load an exported forest and its preprocessor, as (forest, preprocessor)."""
+    pre_path = preprocessor_path(forest_path)
+    preprocessor = joblib.load(pre_path) if os.path.exists(pre_path) else None
+    return CompactForest.load(forest_path), preprocessor
+
+
+def _timed_load(loader, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    obj = loader(path)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, seconds, peak
+
+
+def _single_row_ms(predict, X, samples: int) -> np.ndarray:
+    times = []
+    for i in np.random.default_rng(42).integers(0, X.shape[0], samples):
+        row = X[i:i + 1]
+        start = time.perf_counter()
+        predict(row)
+        times.append(time.perf_counter() - start)
+    return np.asarray(times) * 1000
+
+
+def benchmark(model_path: str, forest_path: str, X, samples: int = 500) -> None:
+    """Compare load time, memory and predict latency of the joblib pickle and the exported forest."""
+    (clf, _), pkl_load, pkl_mem = _timed_load(load_model, model_path)
+    (forest, _), cf_load, cf_mem = _timed_load(load_compact_model, forest_path)
+
+    rows = []
+    for name, model, load_s, mem, size in (
+        ('joblib pickle', clf, pkl_load, pkl_mem, os.path.getsize(model_path)),
+        ('compact forest', forest, cf_load, cf_mem, os.path.getsize(forest_path)),
+    ):
+        single = _single_row_ms(model.predict_proba, X, samples)
+        start = time.perf_counter()
+        model.predict_proba(X)
+        batch_us = (time.perf_counter() - start) / X.shape[0] * 1e6
+        rows.append((name, size / 1024 ** 2, load_s * 1000, mem / 1024 ** 2,
+                     np.percentile(single, 50), np.percentile(single, 99), batch_us))
+
+    agreement = float(np.mean(clf.predict(X) == forest.predict(X)))
+    print(f"{'model':<15} {'file MB':>8} {'load ms':>9} {'load peak MB':>13} "
+          f"{'1-row p50 ms':>13} {'1-row p99 ms':>13} {'batch us/row':>13}")
+    for name, size_mb, load_ms, mem_mb, p50, p99, batch_us in rows:
+        print(f"{name:<15} {size_mb:8.2f} {load_ms:9.1f} {mem_mb:13.2f} {p50:13.3f} {p99:13.3f} {batch_us:13.2f}")
+    print(f"Prediction agreement on {X.shape[0]} rows: {agreement:.4%}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export the trained forest to compact arrays and benchmark it.")
+    parser.add_argument('--model', default='lateral_movement_model.pkl', help='Model saved by train_classifier.py')
+    parser.add_argument('--output', default='lateral_movement_forest.npz', help='Exported forest (.npz)')
+    parser.add_argument('--max-trees', type=int, help='Keep only the first N trees')
+    parser.add_argument('--max-depth', type=int, help='Cut trees at this depth')
+    parser.add_argument('--bench-data', help='CSV/Parquet rows (label column optional) to benchmark on')
+    parser.add_argument('--bench-rows', type=int, default=10000, help='Synthetic rows when --bench-data is not given')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    forest = export_model(args.model, args.output, args.max_trees, args.max_depth)
+    print(f"Exported {len(forest.roots)} trees, {len(forest.feature)} nodes, depth {forest.depth} "
+          f"({forest.nbytes / 1024 ** 2:.2f} MB) to {args.output}")
+
+    if args.bench_data:
+        from dataset_preprocessing import load_dataset
+        _, preprocessor = load_model(args.model)
+        df = load_dataset(args.bench_data)
+        X = preprocessor.transform(df.drop(columns=['label'], errors='ignore'))
+        if sp.issparse(X):
+            X = X.toarray()
+    else:
+        X = np.random.default_rng(0).normal(size=(args.bench_rows, forest.n_features)).astype(np.float32)
+    benchmark(args.model, args.output, X)
+
+
+if __name__ == '__main__':
+    main()
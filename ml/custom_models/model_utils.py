@@ -3,6 +3,8 @@
 model_utils.py: Utility functions for model evaluation and reporting.
 """
 import json
+
+import joblib
 from sklearn.metrics import classification_report
 
 
@@ -20,4 +22,23 @@ def save_classification_report(report: dict, path: str):
     """
     with open(path, 'w') as f:
         json.dump(report, f, indent=2)
+
+
+def save_model(model, preprocessor, path: str):
+    """
+    Save the trained model together with its fitted FeaturePreprocessor,
+    so inference applies exactly the transforms used in training.
+    """
+    joblib.dump({'model': model, 'preprocessor': preprocessor}, path)
+
+
+def load_model(path: str, mmap_mode=None):
+    """
+    Load a model saved by save_model and return (model, preprocessor).
+    Bare estimators saved by older versions load with preprocessor None.
+    """
+    bundle = joblib.load(path, mmap_mode=mmap_mode)
+    if isinstance(bundle, dict) and 'model' in bundle:
+        return bundle['model'], bundle.get('preprocessor')
+    return bundle, None
 # Utility functions
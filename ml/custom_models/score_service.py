@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+score_service.py: Real-time lateral-movement scoring with the trained RandomForest.
+
+Loads the model saved by train_classifier.py once (arrays memory-mapped with
+joblib mmap_mode), pulls new endpoint/netflow documents from Elasticsearch in
+micro-batches, scores each batch with one vectorized predict_proba call and
+sends high-probability hosts to the orchestrator's playbook executor.
+Throughput (docs/sec) and p50/p99 batch latency are logged periodically.
+A forest exported with forest_export.py (.npz) can be given instead of the
+pickle for faster loading and single-row scoring.
+
+Uses the orchestrator configuration (orchestrator/playbooks/config.yml) for
+Elasticsearch, AWS and firewall settings; its cursor and dedup state are kept
+in the orchestrator state directory, separate from the runner's.
+
+Example:
+  python score_service.py --model lateral_movement_model.pkl --threshold 0.9 --action block_ip
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from orchestrator import runner
+from orchestrator.utils import setup_logging
+from orchestrator.cursors import JobCursorStore
+from orchestrator.dedup import DedupStore
+from orchestrator.executor import PlaybookExecutor
+
+from model_utils import load_model
+from forest_export import load_compact_model
+
+DEFAULT_INDEX = 'endpoint-*,netflow-*'
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_THRESHOLD = 0.9
+CURSOR_FILE = os.path.join(runner.STATE_DIR, 'scoring_cursors.json')
+DEDUP_FILE = os.path.join(runner.STATE_DIR, 'scoring_dedup.sqlite')
+# Batch latencies kept for the percentile report
+LATENCY_WINDOW = 1000
+
+
+class LateralMovementScorer:
+    """Model + fitted preprocessor loaded once and applied to whole batches."""
+
+    def __init__(self, model_path: str, mmap_mode: str = 'r'):
+        if model_path.endswith('.npz'):
+            self.model, self.preprocessor = load_compact_model(model_path)
+        else:
+            self.model, self.preprocessor = load_model(model_path, mmap_mode=mmap_mode)
+        if self.preprocessor is None:
+            raise ValueError(f'{model_path} has no saved preprocessor; retrain with train_classifier.py')
+        classes = list(self.model.classes_)
+        # Probability column of the positive (lateral movement) class
+        self.positive_index = classes.index(1) if 1 in classes else len(classes) - 1
+        logging.info(f'Loaded model {model_path} ({self.preprocessor.n_features} features)')
+
+    def score(self, df: pd.DataFrame) -> np.ndarray:
+        """Probability of lateral movement for every row of ``df``."""
+        X = self.preprocessor.transform(df)
+        return self.model.predict_proba(X)[:, self.positive_index]
+
+
+def fetch_batch(es, index: str, cursor: dict, batch_size: int):
+    """
+    Next micro-batch of documents newer than ``cursor``, oldest first.
+    Documents at the cursor timestamp already processed are excluded by ID.
+    """
+    query = {'bool': {'filter': [], 'must_not': []}}
+    if cursor['timestamp'] is not None:
+        query['bool']['filter'].append(
+            {'range': {'@timestamp': {'gte': cursor['timestamp'], 'format': 'epoch_millis'}}}
+        )
+    if cursor['record_ids']:
+        query['bool']['must_not'].append({'ids': {'values': cursor['record_ids']}})
+    resp = es.search(
+        index=index,
+        body={'query': query, 'sort': [{'@timestamp': 'asc'}], 'size': batch_size},
+        ignore_unavailable=True
+    )
+    return resp['hits']['hits']
+
+
+def hits_to_frame(hits) -> pd.DataFrame:
+    """Flatten nested _source documents into dotted columns (e.g. source.ip)."""
+    return pd.json_normalize([hit['_source'] for hit in hits])
+
+
+class LatencyStats:
+    """Throughput and batch latency percentiles over a sliding window."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.docs = 0
+        self.busy = 0.0
+        self.started = time.monotonic()
+
+    def record(self, docs: int, seconds: float) -> None:
+        self.latencies.append(seconds)
+        self.docs += docs
+        self.busy += seconds
+
+    def report(self) -> str:
+        if not self.latencies:
+            return 'no batches scored yet'
+        lat_ms = np.asarray(self.latencies) * 1000
+        wall = time.monotonic() - self.started
+        return (
+            f'{self.docs} docs, {self.docs / wall:.0f} docs/s wall, '
+            f'{self.docs / self.busy:.0f} docs/s scoring, '
+            f'batch latency p50 {np.percentile(lat_ms, 50):.1f} ms, p99 {np.percentile(lat_ms, 99):.1f} ms'
+        )
+
+
+def dispatch(args, flagged, executor, resolver, dedup):
+    """Send flagged (ip, probability) pairs to the playbook executor."""
+    to_isolate = []
+    for ip, proba in flagged:
+        action_key = f'{args.action}:{ip}'
+        if dedup.check_and_add(action_key):
+            continue
+        logging.info(f'[LateralMovement] IP={ip} p={proba:.3f} -> {args.action}')
+        if args.action == 'block_ip':
+            dedup.release_on_failure(executor.block_ip(ip), action_key)
+        elif args.action == 'isolate':
+            to_isolate.append(ip)
+    if to_isolate:
+        keys = {ip: f'isolate:{ip}' for ip in to_isolate}
+        try:
+            instances = resolver.resolve(to_isolate)
+        except Exception:
+            for key in keys.values():
+                dedup.discard(key)
+            raise
+        for ip in to_isolate:
+            if not instances.get(ip):
+                dedup.discard(keys[ip])
+        ids = [iid for ip in to_isolate for iid in instances.get(ip, [])]
+        if ids:
+            # A failed batch releases every host in it, so all are retried
+            dedup.release_on_failure(executor.isolate_instances(ids), *(keys[ip] for ip in to_isolate if instances.get(ip)))
+
+
+def score_batch(args, hits, scorer, stats, executor, resolver, dedup) -> None:
+    """Score one micro-batch and act on the hosts above the threshold."""
+    start = time.perf_counter()
+    df = hits_to_frame(hits)
+    proba = scorer.score(df)
+    stats.record(len(hits), time.perf_counter() - start)
+
+    flagged_rows = np.flatnonzero(proba >= args.threshold)
+    if not len(flagged_rows):
+        return
+    if args.ip_field not in df.columns:
+        logging.warning(f'{len(flagged_rows)} documents above the threshold have no {args.ip_field} field; '
+                        f'no action taken')
+        return
+    ips = df[args.ip_field].to_numpy()
+    flagged = [(ips[i], proba[i]) for i in flagged_rows if isinstance(ips[i], str)]
+    if len(flagged) < len(flagged_rows):
+        logging.warning(f'{len(flagged_rows) - len(flagged)} flagged documents have an empty {args.ip_field}')
+    if executor is not None:
+        dispatch(args, flagged, executor, resolver, dedup)
+    else:
+        for ip, p in flagged:
+            logging.info(f'[LateralMovement] IP={ip} p={p:.3f}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Score endpoint/netflow events for lateral movement in real time.")
+    parser.add_argument('--model', default='lateral_movement_model.pkl', help='Model saved by train_classifier.py, or a forest exported by forest_export.py (.npz)')
+    parser.add_argument('--index', default=DEFAULT_INDEX, help='Indices to score')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Documents per micro-batch')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Minimum probability that triggers the playbook')
+    parser.add_argument('--ip-field', default='source.ip', help='Field holding the host IP to act on')
+    parser.add_argument('--action', choices=['block_ip', 'isolate', 'log'], default='log',
+                        help='Playbook dispatched for flagged hosts')
+    parser.add_argument('--lookback', type=float, default=runner.INITIAL_LOOKBACK,
+                        help='Seconds of history scored on the first run (before any cursor is saved)')
+    parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds to wait when no new documents')
+    parser.add_argument('--report-interval', type=float, default=60.0, help='Seconds between throughput reports')
+    return parser.parse_args()
+
+
+def main():
+    setup_logging()
+    args = parse_args()
+    scorer = LateralMovementScorer(args.model)
+    es = runner.get_es_client()
+    cursors = JobCursorStore(CURSOR_FILE, args.lookback)
+    os.makedirs(runner.STATE_DIR, exist_ok=True)
+    dedup = DedupStore(ttl=runner.DEDUP_CFG.get('ttl_seconds', 24 * 3600), path=DEDUP_FILE)
+    executor = resolver = None
+    if args.action != 'log':
+        aws = runner.get_aws_client()
+        executor = PlaybookExecutor(runner.config, aws)
+        resolver = runner.get_instance_resolver(aws) if args.action == 'isolate' else None
+
+    stats = LatencyStats()
+    last_report = time.monotonic()
+    logging.info(f'Scoring {args.index} in batches of {args.batch_size} (threshold {args.threshold})')
+    try:
+        while True:
+            try:
+                hits = fetch_batch(es, args.index, cursors.get(args.index), args.batch_size)
+            except Exception as e:
+                # Nothing was read: the same batch is requested again after the poll interval
+                logging.error(f'Error fetching documents from {args.index}: {e}')
+                time.sleep(args.poll_interval)
+                continue
+            if hits:
+                try:
+                    score_batch(args, hits, scorer, stats, executor, resolver, dedup)
+                except Exception as e:
+                    # A batch that cannot be scored is skipped so it does not stall the service
+                    logging.exception(
+                        f'Skipping batch of {len(hits)} documents ({hits[0]["_id"]} .. {hits[-1]["_id"]}): {e}'
+                    )
+                for hit in hits:
+                    cursors.advance(args.index, {'timestamp': hit['sort'][0], 'record_id': hit['_id']})
+                cursors.save()
+            if time.monotonic() - last_report >= args.report_interval:
+                logging.info(f'Scoring stats: {stats.report()}')
+                last_report = time.monotonic()
+            if len(hits) < args.batch_size:
+                time.sleep(args.poll_interval)
+    finally:
+        logging.info(f'Scoring stats: {stats.report()}')
+        if executor is not None:
+            executor.shutdown()
+        dedup.close()
+
+
+if __name__ == '__main__':
+    main()
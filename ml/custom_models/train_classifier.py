@@ -3,17 +3,16 @@
 train_classifier.py: Train a RandomForest classifier to detect lateral movement based on endpoint and network log features.
 """
 import os
+import json
 import argparse
-import joblib
 
 import numpy as np
-import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 
 # Custom preprocessing and utils
-from dataset_preprocessing import load_dataset, preprocess_features
-from model_utils import evaluate_model, save_classification_report
+from dataset_preprocessing import load_dataset, load_dtypes, FeaturePreprocessor, DEFAULT_CHUNKSIZE
+from model_utils import evaluate_model, save_classification_report, save_model
 
 
 def parse_args():
@@ -22,7 +21,7 @@ def parse_args():
     )
     parser.add_argument(
         "--data-path", required=True,
-        help="Path to CSV file containing features and label."
+        help="Path to CSV (or Parquet) file containing features and label."
     )
     parser.add_argument(
         "--output-dir", default=".",
@@ -40,12 +39,159 @@ def parse_args():
         "--n-estimators", type=int, default=100,
         help="Number of trees in the RandomForest"
     )
+    parser.add_argument(
+        "--sparse", action="store_true",
+        help="Encode categorical features into a scipy.sparse CSR matrix"
+    )
+    parser.add_argument(
+        "--max-categories", type=int,
+        help="Keep at most this many categories per column (the rest map to the unknown column)"
+    )
+    parser.add_argument(
+        "--hash-buckets", type=int,
+        help="Hash columns with more than --max-categories categories into this many columns"
+    )
+    parser.add_argument(
+        "--chunked", action="store_true",
+        help="Out-of-core mode: stream the file in chunks into memory-mapped float32 matrices"
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=DEFAULT_CHUNKSIZE,
+        help="Rows per chunk in chunked mode"
+    )
+    parser.add_argument(
+        "--dtypes",
+        help="JSON file mapping column -> dtype (default: inferred from the first rows)"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory for the memory-mapped matrices (default: <output-dir>/cache)"
+    )
+    parser.add_argument(
+        "--train-mode", choices=["full", "warm-start", "reservoir"], default="full",
+        help="Chunked mode: fit on the whole memmap, grow a warm-started forest per block, "
+             "or fit on a stratified reservoir sample"
+    )
+    parser.add_argument(
+        "--trees-per-block", type=int,
+        help="Trees added per block in warm-start mode (default: n_estimators / blocks)"
+    )
+    parser.add_argument(
+        "--reservoir-per-class", type=int, default=200000,
+        help="Rows kept per class in reservoir mode"
+    )
+    parser.add_argument(
+        "--max-depth", type=int,
+        help="Maximum tree depth (default: unbounded)"
+    )
+    parser.add_argument(
+        "--tune", action="store_true",
+        help="Hyperparameter search on a cached, memory-mapped preprocessed dataset"
+    )
+    parser.add_argument(
+        "--search", choices=["random", "halving"], default="random",
+        help="Tuning: randomized or successive-halving search"
+    )
+    parser.add_argument(
+        "--n-iter", type=int, default=20,
+        help="Tuning: candidates sampled"
+    )
+    parser.add_argument(
+        "--cv", type=int, default=3,
+        help="Tuning: cross-validation folds"
+    )
+    parser.add_argument(
+        "--n-jobs", type=int, default=-1,
+        help="Tuning: worker processes"
+    )
+    parser.add_argument(
+        "--top-k", type=int, default=5,
+        help="Tuning: best candidates refit and profiled for latency and size"
+    )
+    parser.add_argument(
+        "--latency-budget-ms", type=float,
+        help="Tuning: max p99 single-row predict latency of the chosen model"
+    )
+    parser.add_argument(
+        "--calibrate", choices=["sigmoid", "isotonic"],
+        help="Tuning: calibrate the chosen model's probabilities"
+    )
     return parser.parse_args()
 
 
+def preprocessor_options(args):
+    return {
+        "sparse": args.sparse,
+        "max_categories": args.max_categories,
+        "hash_buckets": args.hash_buckets,
+    }
+
+
+def train_chunked(args):
+    """Out-of-core training; returns (clf, preprocessor, y_test, y_pred)."""
+    from chunked_training import prepare, train, predict_blocks, restore_classes
+
+    dtypes = load_dtypes(args.dtypes) if args.dtypes else None
+    cache_dir = args.cache_dir or os.path.join(args.output_dir, "cache")
+    preprocessor, X_train, y_train, X_test, y_test = prepare(
+        args.data_path, cache_dir, dtypes, args.chunksize, args.test_size,
+        **preprocessor_options(args)
+    )
+    clf = train(
+        X_train, y_train, mode=args.train_mode, n_estimators=args.n_estimators,
+        block_rows=args.chunksize, trees_per_block=args.trees_per_block,
+        reservoir_per_class=args.reservoir_per_class, max_depth=args.max_depth
+    )
+    # Trained on class codes: report and save with the original labels
+    restore_classes(clf, preprocessor.classes_)
+    y_test = preprocessor.classes_[np.asarray(y_test)]
+    return clf, preprocessor, y_test, predict_blocks(clf, X_test, args.chunksize)
+
+
+def tune_model(args):
+    """Tuning mode; returns (clf, preprocessor, y_test, y_pred) for the chosen candidate."""
+    from tuning import load_or_prepare, tune, select, fit_final, print_profiles
+    from chunked_training import restore_classes
+
+    dtypes = load_dtypes(args.dtypes) if args.dtypes else None
+    cache_root = args.cache_dir or os.path.join(args.output_dir, "cache")
+    preprocessor, X_train, y_train, X_test, y_test = load_or_prepare(
+        args.data_path, cache_root, dtypes, args.chunksize, args.test_size,
+        **preprocessor_options(args)
+    )
+    profiles = tune(
+        X_train, y_train, X_test, y_test, method=args.search, n_iter=args.n_iter,
+        cv=args.cv, n_jobs=args.n_jobs, top_k=args.top_k,
+        calibrate=args.calibrate
+    )
+    print_profiles(profiles)
+    chosen = select(profiles, args.latency_budget_ms)
+    print(f"Chosen parameters: {chosen['params']}")
+    clf, y_pred, extra = fit_final(chosen["params"], X_train, y_train, X_test, y_test, args.calibrate)
+    restore_classes(clf, preprocessor.classes_)
+    y_test, y_pred = preprocessor.classes_[np.asarray(y_test)], preprocessor.classes_[y_pred]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    results_path = os.path.join(args.output_dir, "tuning_results.json")
+    with open(results_path, "w") as f:
+        json.dump({"candidates": profiles, "chosen": chosen, **extra}, f, indent=2, default=str)
+    print(f"Tuning results saved to {results_path}")
+    return clf, preprocessor, y_test, y_pred
+
+
 def main():
     args = parse_args()
 
+    if args.tune:
+        clf, preprocessor, y_test, y_pred = tune_model(args)
+        save_outputs(args, clf, preprocessor, y_test, y_pred)
+        return
+
+    if args.chunked:
+        clf, preprocessor, y_test, y_pred = train_chunked(args)
+        save_outputs(args, clf, preprocessor, y_test, y_pred)
+        return
+
     # Load raw dataset
     df = load_dataset(args.data_path)
 
@@ -53,17 +199,20 @@ def main():
     X_raw = df.drop(columns=["label"])
     y = df["label"]
 
-    # Preprocess features (scaling, encoding, feature engineering)
-    X = preprocess_features(X_raw)
-
     # Split into train and test sets
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=args.test_size, random_state=42, stratify=y
+    X_train_raw, X_test_raw, y_train, y_test = train_test_split(
+        X_raw, y, test_size=args.test_size, random_state=42, stratify=y
     )
 
+    # Fit preprocessing (imputation, scaling, encoding) on the training split only
+    preprocessor = FeaturePreprocessor(**preprocessor_options(args))
+    X_train = preprocessor.fit_transform(X_train_raw)
+    X_test = preprocessor.transform(X_test_raw)
+
     # Initialize and train classifier
     clf = RandomForestClassifier(
         n_estimators=args.n_estimators,
+        max_depth=args.max_depth,
         random_state=42,
         n_jobs=-1
     )
@@ -71,6 +220,10 @@ def main():
 
     # Predict and evaluate
     y_pred = clf.predict(X_test)
+    save_outputs(args, clf, preprocessor, y_test, y_pred)
+
+
+def save_outputs(args, clf, preprocessor, y_test, y_pred):
     report = evaluate_model(y_test, y_pred)
 
     # Save classification report as JSON
@@ -78,9 +231,9 @@ def main():
     report_path = os.path.join(args.output_dir, "classification_report.json")
     save_classification_report(report, report_path)
 
-    # Save trained model
+    # Save trained model with its fitted preprocessor
     model_path = os.path.join(args.output_dir, args.model_name)
-    joblib.dump(clf, model_path)
+    save_model(clf, preprocessor, model_path)
     print(f"Trained model saved to {model_path}")
     print(f"Classification report saved to {report_path}")
 
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+action_log.py: Record playbook actions in Elasticsearch for response metrics.
+
+Every dispatched action is written to the actions index once its playbook
+finishes, keyed by the anomaly record that triggered it. Documents reuse the
+ML anomaly field names (job_id, partition_field_value, timestamp,
+record_score) so metrics can aggregate anomalies and actions in one search:
+  timestamp     anomaly bucket time (occurrence)
+  detected_at   when the orchestrator picked up the record (detection)
+  completed_at  when the playbook finished (response)
+Documents are buffered and bulk-indexed from a background thread, so
+recording never blocks polling or the playbook workers.
+"""
+import time
+import logging
+import threading
+from typing import Any, Dict, List
+
+from elasticsearch import helpers
+
+DEFAULT_INDEX = 'orchestrator-actions'
+DEFAULT_FLUSH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 5.0
+RESULT_TYPE = 'action'
+# Same formats as the ML results indices, so date ranges work across both
+DATE = {'type': 'date', 'format': 'strict_date_optional_time||epoch_millis'}
+
+MAPPINGS = {
+    'properties': {
+        'result_type': {'type': 'keyword'},
+        'job_id': {'type': 'keyword'},
+        'partition_field_value': {'type': 'keyword'},
+        'timestamp': DATE,
+        'record_score': {'type': 'double'},
+        'playbook': {'type': 'keyword'},
+        'target': {'type': 'keyword'},
+        'status': {'type': 'keyword'},
+        'detected_at': DATE,
+        'completed_at': DATE,
+    }
+}
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class ActionLog:
+    """Buffered writer of action documents."""
+
+    def __init__(self, es, index: str = DEFAULT_INDEX, flush_size: int = DEFAULT_FLUSH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        """
+        :param es: Synchronous Elasticsearch client.
+        :param index: Index the actions are written to (created with MAPPINGS if missing).
+        :param flush_size: Buffered documents that trigger an early flush.
+        :param flush_interval: Seconds between background flushes.
+        """
+        self.es = es
+        self.index = index
+        self.flush_size = flush_size
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._ensure_index()
+        self._thread = threading.Thread(
+            target=self._flush_loop, args=(flush_interval,), name='action-log', daemon=True
+        )
+        self._thread.start()
+
+    def _ensure_index(self) -> None:
+        try:
+            if not self.es.indices.exists(index=self.index):
+                self.es.indices.create(index=self.index, body={'mappings': MAPPINGS})
+        except Exception as e:
+            logging.warning(f'Could not create actions index {self.index}: {e}')
+
+    def record(self, future, playbook: str, target: str, record: Dict[str, Any]) -> None:
+        """
+        Log ``playbook`` on ``target`` for the anomaly ``record`` once ``future``
+        (as returned by PlaybookExecutor) completes.
+        """
+        detected_at = _now_ms()
+        doc = {
+            'result_type': RESULT_TYPE,
+            'job_id': record.get('job_id'),
+            'partition_field_value': record.get('partition_field_value'),
+            'timestamp': record.get('timestamp'),
+            'record_score': record.get('record_score'),
+            'playbook': playbook,
+            'target': target,
+            'detected_at': detected_at,
+        }
+
+        def done(fut):
+            try:
+                ok = fut.result()
+            except Exception:
+                ok = False
+            doc['status'] = 'success' if ok else 'failed'
+            doc['completed_at'] = _now_ms()
+            self._add(doc)
+
+        future.add_done_callback(done)
+
+    def _add(self, doc: Dict[str, Any]) -> None:
+        with self._lock:
+            self._buffer.append(doc)
+            full = len(self._buffer) >= self.flush_size
+        if full:
+            self._wake.set()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                docs, self._buffer = self._buffer, []
+            if not docs:
+                return
+            actions = [
+                {
+                    '_index': self.index,
+                    # Re-recording the same action overwrites instead of duplicating
+                    '_id': f"{d['job_id']}_{d['timestamp']}_{d['partition_field_value']}_{d['playbook']}_{d['target']}",
+                    '_source': d,
+                }
+                for d in docs
+            ]
+            try:
+                _, errors = helpers.bulk(self.es, actions, raise_on_error=False, stats_only=True)
+                if errors:
+                    logging.warning(f'{errors} of {len(actions)} action documents were not indexed')
+            except Exception as e:
+                logging.error(f'Error indexing {len(actions)} action documents: {e}')
+
+    def _flush_loop(self, interval: float) -> None:
+        while not self._closed.is_set():
+            self._wake.wait(interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self) -> None:
+        """Stop the background thread and write what is still buffered."""
+        self._closed.set()
+        self._wake.set()
+        self._thread.join()
+        self.flush()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+async_runner.py: Asyncio mode of the orchestrator.
+Runs one polling task per Elastic ML job against an AsyncElasticsearch client.
+Jobs push response actions onto a shared queue that a separate set of
+workers drains into the playbook executor without waiting for results, so a
+slow job or playbook never delays another job's actions.
+Finished actions are recorded through the optional ActionLog.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple
+
+from elasticsearch import AsyncElasticsearch
+
+from orchestrator.cursors import aiter_new_records
+
+DEFAULT_ACTION_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 1000
+
+# An action is (playbook, target, anomaly record)
+Action = Tuple[str, str, Dict[str, Any]]
+
+
+async def login_actions(records: List[Dict[str, Any]], resolver) -> List[Action]:
+    """anomaly_login -> block the partition IP."""
+    actions = []
+    for rec in records:
+        ip = rec.get('partition_field_value')
+        if not ip:
+            continue
+        logging.info(f"[LoginAnomaly] ID={rec['record_id']}, IP={ip}")
+        actions.append(('block_ip', ip, rec))
+    return actions
+
+
+async def traffic_actions(records: List[Dict[str, Any]], resolver) -> List[Action]:
+    """anomaly_traffic -> isolate every EC2 instance owning the partition IP."""
+    by_ip: Dict[str, Dict[str, Any]] = {}
+    for rec in records:
+        ip = rec.get('partition_field_value')
+        if not ip:
+            continue
+        logging.info(f"[TrafficAnomaly] ID={rec['record_id']}, IP={ip}")
+        by_ip.setdefault(ip, rec)
+    if not by_ip:
+        return []
+    loop = asyncio.get_running_loop()
+    # A failed resolution propagates so poll_job rewinds the cursor and retries the records
+    instances_by_ip = await loop.run_in_executor(None, resolver.resolve, list(by_ip))
+    return [
+        ('isolate_endpoint', iid, rec)
+        for ip, rec in by_ip.items()
+        for iid in instances_by_ip.get(ip, [])
+    ]
+
+
+# ML job -> coroutine turning a batch of anomaly records into actions
+JOB_HANDLERS = {
+    'anomaly_login': login_actions,
+    'anomaly_traffic': traffic_actions,
+}
+
+DEDUP_PREFIX = {
+    'block_ip': 'block_ip',
+    'isolate_endpoint': 'isolate',
+}
+
+
+async def poll_job(job_id: str, handler, es, resolver, queue: asyncio.Queue, cursors, dedup,
+                   score_threshold: float, page_size: int, poll_interval: float) -> None:
+    """Poll one ML job forever, enqueueing actions for new anomaly records."""
+    while True:
+        try:
+            records = []
+            start_cursor = cursors.get(job_id)
+            async for rec in aiter_new_records(es, job_id, cursors, score_threshold, page_size):
+                cursors.advance(job_id, rec)
+                records.append(rec)
+            try:
+                actions = await handler(records, resolver)
+            except Exception as e:
+                logging.error(f"Error preparando acciones de {job_id} ({len(records)} registros): {e}; se reintentará")
+                cursors.reset(job_id, start_cursor)
+                actions = []
+            for playbook, target, rec in actions:
+                if dedup.check_and_add(f'{DEDUP_PREFIX[playbook]}:{target}'):
+                    logging.info(f"[{job_id}] {playbook} {target} ya ejecutado recientemente")
+                    continue
+                await queue.put((playbook, target, rec))
+        except Exception as e:
+            logging.error(f"Error procesando {job_id}: {e}")
+        finally:
+            cursors.save()
+        await asyncio.sleep(poll_interval)
+
+
+def _log_failure(name: str, playbook: str, targets: List[str]):
+    """Done-callback logging a playbook future that failed or raised."""
+    def done(future) -> None:
+        try:
+            ok = future.result()
+        except Exception as e:
+            logging.error(f"[{name}] Error ejecutando {playbook} para {', '.join(targets)}: {e}")
+            return
+        if not ok:
+            logging.error(f"[{name}] {playbook} falló para {', '.join(targets)}")
+    return done
+
+
+def dispatch_actions(name: str, actions: List[Action], executor, action_log=None, dedup=None) -> None:
+    """
+    Hand a batch of actions to the executor without waiting for them.
+
+    Blocks go one by one to the executor's coalescer, which groups them into
+    bulk requests; isolations are sent as one isolate_instances batch. Results
+    are handled in done-callbacks: failures are logged, recorded in the
+    ActionLog and release the dedup keys claimed by poll_job.
+    """
+    batches: Dict[str, List[Action]] = {}
+    for action in actions:
+        batches.setdefault(action[0], []).append(action)
+
+    submitted = []
+    for playbook, target, rec in batches.get('block_ip', []):
+        logging.info(f"[{name}] block_ip -> {target} (record {rec.get('record_id')})")
+        submitted.append((lambda t=target: executor.block_ip(t), [(playbook, target, rec)]))
+    isolations = batches.get('isolate_endpoint', [])
+    if isolations:
+        targets = [target for _, target, _ in isolations]
+        logging.info(f"[{name}] isolate_endpoint -> {', '.join(targets)}")
+        submitted.append((lambda t=targets: executor.isolate_instances(t), isolations))
+
+    for submit, group in submitted:
+        keys = [f'{DEDUP_PREFIX[playbook]}:{target}' for playbook, target, _ in group]
+        try:
+            future = submit()
+        except Exception as e:
+            logging.error(f"[{name}] Error enviando {group[0][0]} para {', '.join(t for _, t, _ in group)}: {e}")
+            if dedup is not None:
+                for key in keys:
+                    dedup.discard(key)
+            continue
+        future.add_done_callback(_log_failure(name, group[0][0], [target for _, target, _ in group]))
+        if dedup is not None:
+            # A failed isolation batch releases every instance in it, so all are retried
+            dedup.release_on_failure(future, *keys)
+        if action_log is not None:
+            for playbook, target, rec in group:
+                action_log.record(future, playbook, target, rec)
+
+
+async def action_worker(name: str, queue: asyncio.Queue, executor, action_log=None, dedup=None) -> None:
+    """
+    Drain the action queue into the executor. Each pass takes every action
+    already queued, so blocks share coalescing windows and isolations are
+    batched, and never waits for a playbook to finish.
+    """
+    while True:
+        actions = [await queue.get()]
+        while not queue.empty():
+            actions.append(queue.get_nowait())
+        try:
+            dispatch_actions(name, actions, executor, action_log, dedup)
+        except Exception as e:
+            logging.error(f"[{name}] Error despachando {len(actions)} acciones: {e}")
+        finally:
+            for _ in actions:
+                queue.task_done()
+
+
+async def run(config: dict, es_host: str, resolver, executor, cursors, dedup,
+              score_threshold: float, page_size: int, poll_interval: float, action_log=None) -> None:
+    """
+    Start one polling task per configured ML job plus the action workers.
+
+    :param config: Parsed playbooks/config.yml (uses async_workers, queue_size, jobs).
+    :param action_log: Optional ActionLog recording finished actions.
+    """
+    es = AsyncElasticsearch([es_host])
+    queue: asyncio.Queue = asyncio.Queue(maxsize=config.get('queue_size', DEFAULT_QUEUE_SIZE))
+    job_ids = config.get('jobs') or list(JOB_HANDLERS)
+    n_workers = config.get('async_workers', DEFAULT_ACTION_WORKERS)
+
+    tasks = [
+        asyncio.create_task(
+            poll_job(job_id, JOB_HANDLERS[job_id], es, resolver, queue, cursors, dedup,
+                     score_threshold, page_size, poll_interval),
+            name=f'poll-{job_id}'
+        )
+        for job_id in job_ids
+    ]
+    tasks += [
+        asyncio.create_task(action_worker(f'worker-{i}', queue, executor, action_log, dedup), name=f'worker-{i}')
+        for i in range(n_workers)
+    ]
+    logging.info(f"Orquestador asíncrono iniciado: jobs={job_ids}, workers={n_workers}")
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await es.close()
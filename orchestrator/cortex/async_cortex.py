@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+async_cortex.py: asyncio client for Cortex, for enriching many observables at once.
+
+Fans out run_analyzer over (analyzer, indicator) pairs on one pooled aiohttp
+session, with a cap on in-flight jobs. Jobs are awaited with Cortex's
+long-poll endpoint (/api/job/{id}/waitreport); if the server does not offer
+it, the job is polled with exponential backoff instead. Results are yielded
+as soon as each job finishes. Reports are served from a ReportCache when the
+same (analyzer, dataType, data) was analyzed within the analyzer's TTL, and
+concurrent requests for one observable share a single job.
+
+Uses the same environment variables as cortex_integration.py
+(CORTEX_URL, CORTEX_API_KEY, CORTEX_VERIFY_SSL).
+
+Example usage:
+  async with AsyncCortexClient(concurrency=20) as client:
+      async for result in client.analyze_many(pairs(['MISPGeneric', 'VirusTotal_GetReport'], indicators)):
+          print(result['analyzer'], result['indicator'], result['status'])
+
+  python async_cortex.py --analyzers MISPGeneric Abuse_Finder --ip 1.2.3.4 --domain bad.example.com
+"""
+import asyncio
+import logging
+import argparse
+import itertools
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+
+# Attempt to load shared logging setup and Cortex configuration
+try:
+    from orchestrator.utils import setup_logging
+except ImportError:
+    def setup_logging():
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s %(levelname)s %(message)s',
+            datefmt='%Y-%m-%dT%H:%M:%SZ'
+        )
+try:
+    from orchestrator.cortex.cortex_integration import CORTEX_URL, CORTEX_API_KEY, CORTEX_VERIFY
+    from orchestrator.cortex.report_cache import ReportCache, cache_key
+except ImportError:
+    from cortex_integration import CORTEX_URL, CORTEX_API_KEY, CORTEX_VERIFY
+    from report_cache import ReportCache, cache_key
+
+# Defaults
+DEFAULT_CONCURRENCY = 10
+DEFAULT_JOB_TIMEOUT = 300
+WAITREPORT_AT_MOST = 60
+POLL_INITIAL = 1.0
+POLL_MAX = 30.0
+FINAL_STATUSES = ('Success', 'Done', 'Failure', 'Failed', 'Deleted')
+
+Pair = Tuple[str, Dict[str, Any]]
+
+
+def pairs(analyzers: Iterable[str], indicators: Iterable[Dict[str, Any]]) -> List[Pair]:
+    """Cross product of analyzers and indicators as (analyzer, indicator) pairs."""
+    return list(itertools.product(analyzers, indicators))
+
+
+def _data(body: Any) -> Dict[str, Any]:
+    """Unwrap {'data': ...} envelopes; plain Cortex responses are returned as is."""
+    if isinstance(body, dict) and 'data' in body:
+        return body['data'] or {}
+    return body or {}
+
+
+class AsyncCortexClient:
+    """asyncio Cortex client with a pooled session and concurrent analyzer fan-out."""
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        verify: bool = CORTEX_VERIFY,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        job_timeout: int = DEFAULT_JOB_TIMEOUT,
+        use_waitreport: bool = True,
+        poll_initial: float = POLL_INITIAL,
+        poll_max: float = POLL_MAX,
+        cache: Optional[ReportCache] = None,
+        use_cache: bool = True
+    ):
+        """
+        :param concurrency: Maximum analyzer jobs submitted and awaited at once.
+        :param job_timeout: Max seconds to wait for one job.
+        :param use_waitreport: Long-poll /waitreport; falls back to backoff polling when unavailable.
+        :param poll_initial: First backoff delay in seconds when polling.
+        :param poll_max: Backoff delay ceiling in seconds.
+        :param cache: Report cache to use; a default ReportCache is created if omitted.
+        :param use_cache: Set to False to always submit new jobs.
+        """
+        base_url = base_url or CORTEX_URL
+        api_key = api_key or CORTEX_API_KEY
+        if not base_url or not api_key:
+            logging.error('CORTEX_URL and CORTEX_API_KEY must be set as environment variables')
+            raise ValueError('Missing Cortex configuration')
+        self.base_url = base_url.rstrip('/')
+        self.headers = {
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json'
+        }
+        self.verify = verify
+        self.concurrency = concurrency
+        self.job_timeout = job_timeout
+        self.use_waitreport = use_waitreport
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.cache = (cache or ReportCache()) if use_cache else None
+        # cache key -> task running the job, shared by concurrent requests
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+
+    async def __aenter__(self) -> 'AsyncCortexClient':
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def open(self) -> None:
+        if self._semaphore is None:
+            # Created inside the running loop (required on Python < 3.10)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, ssl=None if self.verify else False)
+            self._session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+            logging.info(f'Opened async Cortex session for {self.base_url} (concurrency {self.concurrency})')
+
+    async def close(self) -> None:
+        for task in list(self._inflight.values()):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        await self.open()
+        async with self._session.request(method, f'{self.base_url}{path}', **kwargs) as resp:
+            resp.raise_for_status()
+            return _data(await resp.json(content_type=None))
+
+    async def list_analyzers(self) -> List[Dict[str, Any]]:
+        """Retrieve list of available analyzers from Cortex."""
+        return await self._request('GET', '/api/analyzer')
+
+    async def run_analyzer(
+        self,
+        analyzer: str,
+        indicator: Dict[str, Any],
+        params: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Submit an analyzer job for an indicator; returns the job object."""
+        payload = {
+            'dataType': indicator.get('type'),
+            'data': indicator.get('value')
+        }
+        if params:
+            payload['params'] = params
+        logging.debug(f'Running analyzer {analyzer} on {indicator}')
+        return await self._request('POST', f'/api/analyzer/{analyzer}/run', json=payload)
+
+    async def wait_report(self, job_id: str, timeout: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Wait for a job to finish and return it with its report.
+
+        Uses the long-poll waitreport endpoint; on servers without it (404),
+        switches to polling with exponential backoff for the rest of the session.
+        """
+        timeout = self.job_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while self.use_waitreport:
+            remaining = int(deadline - time.monotonic())
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f'Timeout waiting for job {job_id}')
+            at_most = min(WAITREPORT_AT_MOST, remaining)
+            try:
+                job = await self._request(
+                    'GET', f'/api/job/{job_id}/waitreport',
+                    params={'atMost': f'{at_most}seconds'},
+                    timeout=aiohttp.ClientTimeout(total=at_most + 30)
+                )
+            except aiohttp.ClientResponseError as e:
+                if e.status != 404:
+                    raise
+                if self.use_waitreport:
+                    logging.warning('Cortex waitreport endpoint not available; polling with backoff')
+                    self.use_waitreport = False
+                break
+            if job.get('status') in FINAL_STATUSES:
+                return job
+        return await self._poll_job(job_id, deadline)
+
+    async def _poll_job(self, job_id: str, deadline: float) -> Dict[str, Any]:
+        delay = self.poll_initial
+        while True:
+            job = await self._request('GET', f'/api/job/{job_id}')
+            if job.get('status') in FINAL_STATUSES:
+                if 'report' not in job:
+                    job['report'] = await self._request('GET', f'/api/job/{job_id}/report')
+                return job
+            if time.monotonic() + delay > deadline:
+                raise asyncio.TimeoutError(f'Timeout waiting for job {job_id}')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.poll_max)
+
+    async def analyze(
+        self,
+        analyzer: str,
+        indicator: Dict[str, Any],
+        params: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Run one analyzer on one indicator and wait for the report.
+        Errors are returned in the result instead of raised, so one failing
+        job does not abort a batch.
+        """
+        result = {'analyzer': analyzer, 'indicator': indicator, 'cached': False}
+        start = time.monotonic()
+        key = cache_key(analyzer, indicator, params)
+        job = self.cache.get(key) if self.cache is not None else None
+        if job is not None:
+            result['cached'] = True
+        else:
+            task = self._inflight.get(key)
+            if task is None:
+                task = self._inflight[key] = asyncio.ensure_future(self._run_job(analyzer, indicator, params))
+                task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            try:
+                # Shielded so one cancelled caller does not cancel a job others share
+                job = await asyncio.shield(task)
+            except (aiohttp.ClientError, asyncio.TimeoutError, KeyError) as e:
+                logging.error(f'Analyzer {analyzer} failed on {indicator}: {e}')
+                result.update(status='Error', error=str(e), elapsed=time.monotonic() - start)
+                return result
+        result.update(
+            job_id=job.get('id'), status=job.get('status'), report=job.get('report'),
+            elapsed=time.monotonic() - start
+        )
+        return result
+
+    async def _run_job(
+        self,
+        analyzer: str,
+        indicator: Dict[str, Any],
+        params: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        await self.open()
+        async with self._semaphore:
+            job = await self.run_analyzer(analyzer, indicator, params)
+            job = await self.wait_report(job['id'])
+        if self.cache is not None:
+            self.cache.put(cache_key(analyzer, indicator, params), job)
+        return job
+
+    async def analyze_many(
+        self,
+        jobs: Iterable[Pair],
+        params: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Fan out analyze() over (analyzer, indicator) pairs and yield results as they finish."""
+        tasks = [asyncio.ensure_future(self.analyze(analyzer, indicator, params)) for analyzer, indicator in jobs]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+async def analyze_batch(
+    analyzers: Iterable[str],
+    indicators: Iterable[Dict[str, Any]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    **client_kwargs
+) -> List[Dict[str, Any]]:
+    """Run every analyzer on every indicator and collect the results."""
+    jobs = pairs(analyzers, indicators)
+    results = []
+    start = time.monotonic()
+    async with AsyncCortexClient(concurrency=concurrency, **client_kwargs) as client:
+        async for result in client.analyze_many(jobs):
+            results.append(result)
+    elapsed = time.monotonic() - start
+    failed = sum(1 for r in results if r['status'] not in ('Success', 'Done'))
+    cached = sum(1 for r in results if r['cached'])
+    logging.info(
+        f'Completed {len(results)} analyzer jobs in {elapsed:.1f}s '
+        f'({cached} from cache, {failed} not successful)'
+    )
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run Cortex analyzers on many indicators concurrently.")
+    parser.add_argument('--analyzers', nargs='+', required=True, help='Analyzer names')
+    parser.add_argument('--ip', nargs='*', default=[], help='IP indicators')
+    parser.add_argument('--domain', nargs='*', default=[], help='Domain indicators')
+    parser.add_argument('--hash', nargs='*', default=[], help='File hash indicators')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Max jobs in flight')
+    return parser.parse_args()
+
+
+async def _main(args):
+    indicators = (
+        [{'type': 'ip', 'value': v} for v in args.ip]
+        + [{'type': 'domain', 'value': v} for v in args.domain]
+        + [{'type': 'hash', 'value': v} for v in args.hash]
+    )
+    async with AsyncCortexClient(concurrency=args.concurrency) as client:
+        async for result in client.analyze_many(pairs(args.analyzers, indicators)):
+            logging.info(
+                f"{result['analyzer']} {result['indicator']['value']}: {result['status']} "
+                f"({result['elapsed']:.1f}s)"
+            )
+
+
+if __name__ == '__main__':
+    setup_logging()
+    asyncio.run(_main(parse_args()))
@@ -6,12 +6,18 @@ Uses environment variables for configuration:
   CORTEX_URL         - Base URL of Cortex server (e.g., https://cortex.example.com)
   CORTEX_API_KEY     - API key for Cortex
   CORTEX_VERIFY_SSL  - 'True' or 'False' to verify SSL certificates
+  CORTEX_INFLIGHT_TTL - Seconds a submitted job is shared before a new one may be submitted (default 3600)
 
 Provides CortexClient class with methods to:
   - list available analyzers
   - run an analyzer against an indicator
   - check job status and retrieve results
 
+Finished reports are cached (see report_cache.py): run_analyzer returns the
+cached job for an observable analyzed within its analyzer's TTL, and
+concurrent requests for the same observable share one submitted job.
+Jobs whose result is never fetched stop being shared after CORTEX_INFLIGHT_TTL.
+
 Example usage:
   client = CortexClient()
   analyzers = client.list_analyzers()
@@ -21,7 +27,9 @@ Example usage:
 import os
 import logging
 import requests
+import threading
 import time
+from concurrent.futures import Future
 from typing import Any, Dict, List, Optional
 
 # Attempt to load shared logging setup
@@ -35,16 +43,30 @@ except ImportError:
             datefmt='%Y-%m-%dT%H:%M:%SZ'
         )
 
+try:
+    from orchestrator.cortex.report_cache import ReportCache, cache_key
+except ImportError:
+    from report_cache import ReportCache, cache_key
+
 # Cortex configuration from environment
 CORTEX_URL = os.getenv('CORTEX_URL')
 CORTEX_API_KEY = os.getenv('CORTEX_API_KEY')
 CORTEX_VERIFY = os.getenv('CORTEX_VERIFY_SSL', 'True').lower() in ('true', '1', 'yes')
+INFLIGHT_TTL = int(os.getenv('CORTEX_INFLIGHT_TTL', '3600'))
+# Cortex 3 reports Success/Failure, older releases Done/Failed
+FINAL_STATUSES = ('Success', 'Done', 'Failure', 'Failed', 'Deleted')
 
 
 class CortexClient:
     """Client for interacting with Atlas Cortex server."""
 
-    def __init__(self):
+    def __init__(self, cache: Optional[ReportCache] = None, use_cache: bool = True,
+                 inflight_ttl: int = INFLIGHT_TTL):
+        """
+        :param cache: Report cache to use; a default ReportCache is created if omitted.
+        :param use_cache: Set to False to always submit new jobs.
+        :param inflight_ttl: Seconds a submitted job is shared if its result is never fetched.
+        """
         setup_logging()
         if not CORTEX_URL or not CORTEX_API_KEY:
             logging.error('CORTEX_URL and CORTEX_API_KEY must be set as environment variables')
@@ -54,12 +76,22 @@ class CortexClient:
             'Authorization': f'Bearer {CORTEX_API_KEY}',
             'Content-Type': 'application/json'
         }
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.verify = CORTEX_VERIFY
+        self.cache = (cache or ReportCache()) if use_cache else None
+        self.inflight_ttl = inflight_ttl
+        # key -> (Future of the submitted job, submission time), while the job is running
+        self._inflight: Dict[tuple, tuple] = {}
+        # job id -> (key, registration time)
+        self._job_keys: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
         logging.info(f'Initialized Cortex client for {self.base_url}')
 
     def list_analyzers(self) -> List[Dict[str, Any]]:
         """Retrieve list of available analyzers from Cortex."""
         url = f'{self.base_url}/api/analyzer'
-        resp = requests.get(url, headers=self.headers, verify=CORTEX_VERIFY)
+        resp = self.session.get(url)
         resp.raise_for_status()
         data = resp.json()
         return data.get('data', [])
@@ -75,8 +107,56 @@ class CortexClient:
         :param analyzer: Name of the analyzer (e.g., 'MISPGeneric')
         :param indicator: Indicator payload, e.g., {'value': '1.2.3.4', 'type': 'ip'}
         :param params: Optional analyzer-specific parameters
-        :return: Job object containing job 'id'
+        :return: Job object containing job 'id' (a finished one if served from the cache)
         """
+        if self.cache is None:
+            return self._submit(analyzer, indicator, params)
+        key = cache_key(analyzer, indicator, params)
+        cached = self.cache.get(key)
+        if cached is not None:
+            logging.info(f'Cache hit for analyzer {analyzer} on {indicator}')
+            with self._lock:
+                self._expire_inflight()
+                self._job_keys[cached.get('id')] = (key, time.time())
+            return cached
+        with self._lock:
+            self._expire_inflight()
+            entry = self._inflight.get(key)
+            owner = entry is None
+            if owner:
+                future = Future()
+                self._inflight[key] = (future, time.time())
+            else:
+                future = entry[0]
+        if not owner:
+            logging.info(f'Sharing running {analyzer} job for {indicator}')
+            return future.result()
+        try:
+            job = self._submit(analyzer, indicator, params)
+        except Exception as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._job_keys[job.get('id')] = (key, time.time())
+        future.set_result(job)
+        return job
+
+    def _expire_inflight(self) -> None:
+        """Drop jobs older than the in-flight TTL whose result was never fetched. Called with the lock held."""
+        cutoff = time.time() - self.inflight_ttl
+        for key in [k for k, (_, started) in self._inflight.items() if started < cutoff]:
+            del self._inflight[key]
+        for job_id in [j for j, (_, added) in self._job_keys.items() if added < cutoff]:
+            del self._job_keys[job_id]
+
+    def _submit(
+        self,
+        analyzer: str,
+        indicator: Dict[str, Any],
+        params: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
         url = f'{self.base_url}/api/analyzer/{analyzer}/run'
         payload = {
             'dataType': indicator.get('type'),
@@ -85,7 +165,7 @@ class CortexClient:
         if params:
             payload['params'] = params
         logging.info(f'Running analyzer {analyzer} on {indicator}')
-        resp = requests.post(url, json=payload, headers=self.headers, verify=CORTEX_VERIFY)
+        resp = self.session.post(url, json=payload)
         resp.raise_for_status()
         return resp.json().get('data', {})
 
@@ -97,19 +177,33 @@ class CortexClient:
         :param timeout: Max seconds to wait
         :return: Result data
         """
+        with self._lock:
+            key = self._job_keys.get(job_id, (None, None))[0]
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None and cached.get('id') == job_id:
+                with self._lock:
+                    self._job_keys.pop(job_id, None)
+                return cached
         url = f'{self.base_url}/api/job/{job_id}'
         start = time.time()
         while True:
-            resp = requests.get(url, headers=self.headers, verify=CORTEX_VERIFY)
+            resp = self.session.get(url)
             resp.raise_for_status()
             data = resp.json().get('data', {})
             status = data.get('status')
-            if not wait or status in ('Done', 'Failed'):
+            if not wait or status in FINAL_STATUSES:
                 break
             if time.time() - start > timeout:
                 logging.error(f'Timeout waiting for job {job_id}')
                 break
             time.sleep(5)
+        # Finished (or timed out): cache successful reports and stop sharing the job
+        if key is not None and (wait or status in FINAL_STATUSES):
+            self.cache.put(key, data)
+            with self._lock:
+                self._job_keys.pop(job_id, None)
+                self._inflight.pop(key, None)
         return data
 
 
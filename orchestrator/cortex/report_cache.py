@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+report_cache.py: Local cache of Cortex analyzer reports.
+
+Finished jobs are keyed by (analyzer, dataType, data[, params]) and kept for a
+per-analyzer TTL, so an observable analyzed minutes ago is not submitted
+again. The memory tier is an LRU capped in bytes; an optional SQLite file
+keeps reports (with their expiry) across restarts.
+
+Configuration from environment:
+  CORTEX_CACHE_TTL      - Default TTL in seconds (default 3600, 0 disables caching)
+  CORTEX_CACHE_TTLS     - JSON object of per-analyzer TTLs, e.g. '{"VirusTotal_GetReport_3_0": 86400}'
+  CORTEX_CACHE_MAX_MB   - Memory cap of the LRU tier (default 64)
+  CORTEX_CACHE_FILE     - Optional SQLite file for the disk tier
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_TTL = int(os.getenv('CORTEX_CACHE_TTL', '3600'))
+ANALYZER_TTLS = json.loads(os.getenv('CORTEX_CACHE_TTLS', '{}'))
+MAX_BYTES = int(float(os.getenv('CORTEX_CACHE_MAX_MB', '64')) * 1024 * 1024)
+CACHE_FILE = os.getenv('CORTEX_CACHE_FILE')
+# Only successful jobs are cached; failures are retried on the next request
+CACHEABLE_STATUSES = ('Success', 'Done')
+
+Key = Tuple[str, str, str, str]
+
+
+def cache_key(analyzer: str, indicator: Dict[str, Any], params: Optional[Dict[str, Any]] = None) -> Key:
+    """(analyzer, dataType, data, params) identifying one analysis."""
+    return (
+        analyzer,
+        str(indicator.get('type')),
+        str(indicator.get('value')),
+        json.dumps(params, sort_keys=True) if params else ''
+    )
+
+
+class ReportCache:
+    """Per-analyzer TTL cache of job results with a byte-capped LRU and an optional SQLite tier."""
+
+    def __init__(self, default_ttl: int = DEFAULT_TTL, ttls: Optional[Dict[str, int]] = None,
+                 max_bytes: int = MAX_BYTES, path: Optional[str] = CACHE_FILE):
+        """
+        :param default_ttl: Seconds a report stays valid unless the analyzer has its own TTL.
+        :param ttls: Per-analyzer TTL overrides (0 disables caching for that analyzer).
+        :param max_bytes: Memory budget of the LRU tier, measured as serialized report size.
+        :param path: SQLite file for the disk tier, or None for memory only.
+        """
+        self.default_ttl = default_ttl
+        self.ttls = dict(ANALYZER_TTLS if ttls is None else ttls)
+        self.max_bytes = max_bytes
+        # key -> (expires_at, serialized result); most recently used last
+        self._entries: 'OrderedDict[Key, Tuple[float, str]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS reports ('
+                ' analyzer TEXT, data_type TEXT, data TEXT, params TEXT,'
+                ' expires_at REAL, result TEXT,'
+                ' PRIMARY KEY (analyzer, data_type, data, params))'
+            )
+            self._db.execute('DELETE FROM reports WHERE expires_at < ?', (time.time(),))
+            self._db.commit()
+
+    def ttl(self, analyzer: str) -> int:
+        return int(self.ttls.get(analyzer, self.default_ttl))
+
+    def get(self, key: Key) -> Optional[Dict[str, Any]]:
+        """Return the cached result for ``key``, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, blob = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(blob)
+                self._remove(key)
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT expires_at, result FROM reports'
+                    ' WHERE analyzer = ? AND data_type = ? AND data = ? AND params = ?', key
+                ).fetchone()
+                if row and row[0] > now:
+                    self._insert(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return json.loads(row[1])
+            self.misses += 1
+            return None
+
+    def put(self, key: Key, result: Dict[str, Any]) -> bool:
+        """Cache a finished job result; returns False if it is not cacheable."""
+        ttl = self.ttl(key[0])
+        if ttl <= 0 or result.get('status') not in CACHEABLE_STATUSES:
+            return False
+        expires_at = time.time() + ttl
+        blob = json.dumps(result, separators=(',', ':'))
+        with self._lock:
+            self._insert(key, expires_at, blob)
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO reports (analyzer, data_type, data, params, expires_at, result)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)', key + (expires_at, blob)
+                )
+                self._db.commit()
+        return True
+
+    def _insert(self, key: Key, expires_at: float, blob: str) -> None:
+        if len(blob) > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (expires_at, blob)
+        self._bytes += len(blob)
+        while self._bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _remove(self, key: Key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits,
+                'disk_hits': self.disk_hits, 'misses': self.misses, 'evictions': self.evictions,
+            }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        logging.info(f'Cortex report cache stats: {self.stats()}')
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+cursors.py: Persistent high-water marks for incremental Elastic ML polling.
+Keeps, per ML job, the timestamp of the last processed anomaly record and the
+record IDs seen at that timestamp, and pages through only newer records.
+A job without a saved cursor starts ``initial_lookback`` seconds before the
+first poll instead of replaying its whole history.
+"""
+import os
+import json
+import time
+import logging
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+DEFAULT_PAGE_SIZE = 100
+# How far back a job without a saved cursor starts (seconds)
+DEFAULT_INITIAL_LOOKBACK = 3600
+
+
+class JobCursorStore:
+    """Per-job cursors (last timestamp + record_ids) saved to a JSON file."""
+
+    def __init__(self, path: str, initial_lookback: Optional[float] = DEFAULT_INITIAL_LOOKBACK):
+        """
+        :param path: JSON file where cursors are persisted.
+        :param initial_lookback: Seconds before now where a job without a cursor
+            starts; None reads its whole history.
+        """
+        self.path = path
+        self.initial_lookback = initial_lookback
+        self._cursors: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._cursors = json.load(f)
+                logging.info(f'Loaded ML job cursors from {path}')
+            except (OSError, ValueError) as e:
+                logging.warning(f'Could not load cursors from {path}: {e}; starting from scratch')
+
+    def get(self, job_id: str) -> Dict[str, Any]:
+        """Return the cursor for ``job_id`` ({'timestamp': ms or None, 'record_ids': [...]})."""
+        if job_id not in self._cursors and self.initial_lookback is not None:
+            # Fixed on first use (and saved with the rest) so later polls don't skip ahead
+            start = int((time.time() - self.initial_lookback) * 1000)
+            self._cursors[job_id] = {'timestamp': start, 'record_ids': []}
+            logging.info(f'No cursor for {job_id}; starting {self.initial_lookback:g}s back')
+        cursor = self._cursors.get(job_id) or {}
+        return {
+            'timestamp': cursor.get('timestamp'),
+            'record_ids': list(cursor.get('record_ids', [])),
+        }
+
+    def advance(self, job_id: str, record: Dict[str, Any]) -> None:
+        """Move the cursor of ``job_id`` past ``record``."""
+        ts = record.get('timestamp')
+        rid = record.get('record_id')
+        cursor = self._cursors.setdefault(job_id, {'timestamp': None, 'record_ids': []})
+        if cursor['timestamp'] is None or ts > cursor['timestamp']:
+            cursor['timestamp'] = ts
+            cursor['record_ids'] = [rid]
+        elif ts == cursor['timestamp'] and rid not in cursor['record_ids']:
+            cursor['record_ids'].append(rid)
+
+    def reset(self, job_id: str, cursor: Dict[str, Any]) -> None:
+        """Put ``job_id`` back at ``cursor`` (as returned by :meth:`get`) so its records are read again."""
+        self._cursors[job_id] = {'timestamp': cursor['timestamp'], 'record_ids': list(cursor['record_ids'])}
+
+    def save(self) -> None:
+        """Atomically write all cursors to disk."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._cursors, f)
+        os.replace(tmp_path, self.path)
+
+
+def _records_query(job_id: str, cursor: Dict[str, Any], record_score: float, page_size: int) -> Dict[str, Any]:
+    params = {
+        'job_id': job_id,
+        'record_score': record_score,
+        'sort': 'timestamp',
+        'desc': False,
+        'size': page_size,
+    }
+    if cursor['timestamp'] is not None:
+        params['start'] = cursor['timestamp']
+    return params
+
+
+def _is_seen(record: Dict[str, Any], cursor: Dict[str, Any], seen_at_cursor: set) -> bool:
+    return record.get('timestamp') == cursor['timestamp'] and record.get('record_id') in seen_at_cursor
+
+
+def iter_new_records(es, job_id: str, cursors: JobCursorStore, record_score: float,
+                     page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Yield anomaly records of ``job_id`` newer than its cursor, oldest first.
+
+    Records are paged with ``start``/``from`` so each poll only downloads what
+    was written since the last one. The caller advances the cursor after
+    handling each record.
+    """
+    cursor = cursors.get(job_id)
+    seen_at_cursor = set(cursor['record_ids'])
+    params = _records_query(job_id, cursor, record_score, page_size)
+
+    offset = 0
+    while True:
+        resp = es.ml.get_records(from_=offset, **params)
+        records = resp.get('records', [])
+        for rec in records:
+            if not _is_seen(rec, cursor, seen_at_cursor):
+                yield rec
+        if len(records) < page_size:
+            break
+        offset += len(records)
+
+
+async def aiter_new_records(es, job_id: str, cursors: JobCursorStore, record_score: float,
+                            page_size: int = DEFAULT_PAGE_SIZE) -> AsyncIterator[Dict[str, Any]]:
+    """Async counterpart of :func:`iter_new_records` for an ``AsyncElasticsearch`` client."""
+    cursor = cursors.get(job_id)
+    seen_at_cursor = set(cursor['record_ids'])
+    params = _records_query(job_id, cursor, record_score, page_size)
+
+    offset = 0
+    while True:
+        resp = await es.ml.get_records(from_=offset, **params)
+        records = resp.get('records', [])
+        for rec in records:
+            if not _is_seen(rec, cursor, seen_at_cursor):
+                yield rec
+        if len(records) < page_size:
+            break
+        offset += len(records)
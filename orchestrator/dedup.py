@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+dedup.py: Bounded deduplication store for orchestrator actions.
+A time-bucketed set with TTL-based eviction and a fixed entry ceiling,
+optionally backed by SQLite so already-executed actions survive restarts.
+Keys are claimed before an action is dispatched (so concurrent pollers never
+run it twice) and released again if the action fails, so it is retried.
+"""
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+DEFAULT_TTL_SECONDS = 24 * 3600
+DEFAULT_BUCKET_SECONDS = 3600
+DEFAULT_MAX_ENTRIES = 100000
+
+
+class DedupStore:
+    """Remember keys for ``ttl`` seconds, holding at most ``max_entries`` of them."""
+
+    def __init__(self, ttl: int = DEFAULT_TTL_SECONDS, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 bucket_seconds: int = DEFAULT_BUCKET_SECONDS, path: Optional[str] = None):
+        """
+        :param ttl: Seconds a key is remembered.
+        :param max_entries: Memory ceiling; oldest entries are dropped beyond it.
+        :param bucket_seconds: Width of each time bucket (eviction granularity).
+        :param path: Optional SQLite file used as persistent backing.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bucket_seconds = max(1, int(bucket_seconds))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # bucket start -> insertion-ordered keys of that bucket
+        self._buckets: "OrderedDict[int, Dict[str, None]]" = OrderedDict()
+        self._index: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY, ts REAL NOT NULL)')
+            self._db.commit()
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            self._evict(time.time())
+            return key in self._index
+
+    def check_and_add(self, key: str) -> bool:
+        """
+        Return True if ``key`` was already seen within the TTL; otherwise
+        remember it and return False.
+        """
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            if key in self._index:
+                self.hits += 1
+                return True
+            self.misses += 1
+            self._insert(key, now)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO seen (key, ts) VALUES (?, ?)', (key, now))
+                self._db.commit()
+            self._enforce_ceiling()
+            return False
+
+    def discard(self, key: str) -> None:
+        """Forget ``key`` so the next :meth:`check_and_add` treats it as new."""
+        with self._lock:
+            bucket = self._index.pop(key, None)
+            if bucket is None:
+                return
+            keys = self._buckets[bucket]
+            del keys[key]
+            if not keys:
+                del self._buckets[bucket]
+            if self._db is not None:
+                self._db.execute('DELETE FROM seen WHERE key = ?', (key,))
+                self._db.commit()
+
+    def release_on_failure(self, future, *keys: str) -> None:
+        """
+        Discard ``keys`` once ``future`` (a playbook result, True on success)
+        completes unsuccessfully, so the failed action is not skipped as done.
+        """
+        def done(fut):
+            try:
+                ok = fut.result()
+            except Exception:
+                ok = False
+            if not ok:
+                logging.info(f'Action failed; releasing dedup keys {list(keys)}')
+                for key in keys:
+                    self.discard(key)
+
+        future.add_done_callback(done)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters and current size."""
+        return {
+            'size': len(self._index),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _insert(self, key: str, ts: float) -> None:
+        bucket = int(ts // self.bucket_seconds) * self.bucket_seconds
+        if bucket not in self._buckets:
+            self._buckets[bucket] = {}
+            # Keep buckets ordered oldest-first even when loading out of order
+            if len(self._buckets) > 1 and bucket < next(reversed(self._buckets)):
+                self._buckets = OrderedDict(sorted(self._buckets.items()))
+        self._buckets[bucket][key] = None
+        self._index[key] = bucket
+
+    def _drop_oldest_bucket(self) -> None:
+        _, keys = self._buckets.popitem(last=False)
+        for key in keys:
+            del self._index[key]
+        self.evictions += len(keys)
+
+    def _evict(self, now: float) -> None:
+        cutoff = now - self.ttl
+        expired = False
+        # A bucket is expired once its newest possible entry is past the TTL
+        while self._buckets and next(iter(self._buckets)) + self.bucket_seconds <= cutoff:
+            self._drop_oldest_bucket()
+            expired = True
+        if expired and self._db is not None:
+            self._db.execute('DELETE FROM seen WHERE ts < ?', (cutoff,))
+            self._db.commit()
+
+    def _enforce_ceiling(self) -> None:
+        evicted = []
+        while len(self._index) > self.max_entries:
+            bucket, keys = next(iter(self._buckets.items()))
+            key = next(iter(keys))
+            del keys[key]
+            del self._index[key]
+            evicted.append(key)
+            if not keys:
+                del self._buckets[bucket]
+        self.evictions += len(evicted)
+        if evicted and self._db is not None:
+            self._db.executemany('DELETE FROM seen WHERE key = ?', [(k,) for k in evicted])
+            self._db.commit()
+
+    def _load(self) -> None:
+        cutoff = time.time() - self.ttl
+        rows = self._db.execute(
+            'SELECT key, ts FROM seen WHERE ts >= ? ORDER BY ts DESC LIMIT ?',
+            (cutoff, self.max_entries)
+        ).fetchall()
+        for key, ts in reversed(rows):
+            self._insert(key, ts)
+        logging.info(f'Loaded {len(rows)} dedup keys from disk')
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+executor.py: In-process playbook executor for the orchestrator.
+Runs the block_ip and isolate_endpoint playbooks on bounded thread pools,
+sharing one loaded configuration and one set of API clients. Each playbook
+with a concurrency limit (to stay within firewall and EC2 API quotas) gets
+its own pool of that size, so actions queued behind a saturated playbook
+never hold up the others.
+Firewall blocks are coalesced into bulk requests by block_ip.BlockCoalescer and
+EC2 ENI updates share one rate limiter across all isolations.
+"""
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from orchestrator.playbooks import block_ip, isolate_endpoint
+
+DEFAULT_MAX_WORKERS = 8
+# block_ip is serialized through the coalescer and needs no pool limit
+DEFAULT_PLAYBOOK_LIMITS = {
+    'isolate_endpoint': 2,
+}
+
+
+class PlaybookExecutor:
+    """Dispatch playbook actions to bounded worker pools, one per limited playbook."""
+
+    def __init__(self, config: dict, ec2_client, max_workers: int = None, limits: dict = None):
+        """
+        :param config: Parsed playbooks/config.yml.
+        :param ec2_client: Shared boto3 EC2 client.
+        :param max_workers: Size of the pool shared by playbooks without a limit
+            (defaults to config executor.max_workers).
+        :param limits: Per-playbook concurrency limits (defaults to config executor.limits).
+        """
+        exec_cfg = config.get('executor') or {}
+        fw_cfg = config.get('firewall') or {}
+
+        self.api_url = fw_cfg.get('api_url')
+        self.api_key = fw_cfg.get('api_key')
+        self.restrictive_sg = config.get('restrictive_security_group_id')
+        if not self.api_url or not self.api_key:
+            logging.warning('firewall.api_url or firewall.api_key not set; block_ip actions are disabled')
+        if not self.restrictive_sg:
+            logging.warning('restrictive_security_group_id not set; isolate_endpoint actions will fail')
+
+        self.ec2 = ec2_client
+        iso_cfg = config.get('isolation') or {}
+        self.isolation_concurrency = iso_cfg.get('max_concurrency', isolate_endpoint.DEFAULT_CONCURRENCY)
+        self.ec2_limiter = isolate_endpoint.RateLimiter(iso_cfg.get('rate', isolate_endpoint.DEFAULT_RATE))
+        # Retries are done per IP by the coalescer, not by the HTTP session
+        self.http = block_ip.create_session(retries=0)
+        self.blocker = None
+        if self.api_url and self.api_key:
+            self.blocker = block_ip.BlockCoalescer(
+                self.api_url, self.api_key, session=self.http,
+                window=fw_cfg.get('batch_window', 0.5),
+                chunk_size=fw_cfg.get('batch_size', block_ip.DEFAULT_CHUNK_SIZE),
+                max_attempts=fw_cfg.get('max_attempts', 3),
+                retry_backoff=fw_cfg.get('retry_backoff', 1.0)
+            )
+
+        workers = max_workers or exec_cfg.get('max_workers', DEFAULT_MAX_WORKERS)
+        playbook_limits = dict(DEFAULT_PLAYBOOK_LIMITS)
+        playbook_limits.update(limits or exec_cfg.get('limits') or {})
+        self._pools = {
+            name: ThreadPoolExecutor(max_workers=int(n), thread_name_prefix=f'playbook-{name}')
+            for name, n in playbook_limits.items()
+        }
+        self._pool = ThreadPoolExecutor(max_workers=int(workers), thread_name_prefix='playbook')
+        logging.info(f'Playbook executor started with {workers} workers, limits={playbook_limits}')
+
+    def block_ip(self, ip: str):
+        """Queue a firewall block for ``ip``. Returns a Future resolving to True on success."""
+        if self.blocker is None:
+            # Without firewall settings the block fails at once instead of queueing
+            logging.error(f'Cannot block {ip}: firewall.api_url or firewall.api_key not set')
+            future = Future()
+            future.set_result(False)
+            return future
+        return self.blocker.submit(ip)
+
+    def isolate_instance(self, instance_id: str):
+        """Queue isolation of ``instance_id``. Returns a Future resolving to True on success."""
+        return self._submit(
+            'isolate_endpoint', instance_id, isolate_endpoint.isolate_instance,
+            instance_id, self.restrictive_sg, self.ec2, rate_limiter=self.ec2_limiter
+        )
+
+    def isolate_instances(self, instance_ids: list):
+        """Queue isolation of several instances as one batch. Returns a Future resolving to True if all succeed."""
+        return self._submit(
+            'isolate_endpoint', ','.join(instance_ids), self._isolate_batch, instance_ids
+        )
+
+    def _isolate_batch(self, instance_ids: list) -> bool:
+        results = isolate_endpoint.isolate_instances(
+            instance_ids, self.restrictive_sg, self.ec2,
+            max_concurrency=self.isolation_concurrency, rate_limiter=self.ec2_limiter
+        )
+        return all(results.values())
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting actions and optionally wait for queued ones to finish."""
+        if self.blocker is not None:
+            self.blocker.close()
+        for pool in (*self._pools.values(), self._pool):
+            pool.shutdown(wait=wait)
+        self.http.close()
+
+    def _submit(self, playbook: str, target: str, fn, *args, **kwargs):
+        # The pool size is the playbook's limit, so no worker ever waits on it
+        pool = self._pools.get(playbook, self._pool)
+        return pool.submit(self._run, playbook, target, fn, *args, **kwargs)
+
+    def _run(self, playbook: str, target: str, fn, *args, **kwargs) -> bool:
+        try:
+            result = fn(*args, **kwargs)
+            return result is None or bool(result)
+        except SystemExit:
+            # Playbooks still exit on fatal errors when run as scripts
+            logging.error(f'Playbook {playbook} failed for {target}')
+        except Exception as e:
+            logging.error(f'Playbook {playbook} raised for {target}: {e}')
+        return False
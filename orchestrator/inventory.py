@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+inventory.py: Cached resolution of private IP addresses to EC2 instance IDs.
+Collects the IPs of a poll cycle into multi-value describe_instances calls
+(paginated), caches IP -> InstanceId with a TTL, remembers misses with a
+shorter negative TTL and can pre-warm the whole VPC inventory on startup.
+"""
+import time
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_TTL_SECONDS = 300
+DEFAULT_NEGATIVE_TTL_SECONDS = 60
+# describe_instances accepts at most 200 values per filter
+MAX_FILTER_VALUES = 200
+
+
+def _instance_ips(instance: dict) -> List[str]:
+    """Return every private IP attached to an instance (all ENIs)."""
+    ips = set()
+    if instance.get('PrivateIpAddress'):
+        ips.add(instance['PrivateIpAddress'])
+    for iface in instance.get('NetworkInterfaces', []):
+        for addr in iface.get('PrivateIpAddresses', []):
+            if addr.get('PrivateIpAddress'):
+                ips.add(addr['PrivateIpAddress'])
+    return list(ips)
+
+
+class InstanceResolver:
+    """IP -> [InstanceId] lookups backed by batched, paginated EC2 calls."""
+
+    def __init__(self, ec2_client, ttl: int = DEFAULT_TTL_SECONDS,
+                 negative_ttl: int = DEFAULT_NEGATIVE_TTL_SECONDS):
+        """
+        :param ec2_client: boto3 EC2 client.
+        :param ttl: Seconds a resolved IP stays cached.
+        :param negative_ttl: Seconds an IP with no instance stays cached.
+        """
+        self.ec2 = ec2_client
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.api_calls = 0
+        # ip -> (expires_at, [instance_ids])
+        self._cache: Dict[str, Tuple[float, List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, ips: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        Resolve many IPs at once. Cached entries are served locally; the rest
+        are looked up in chunks of up to 200 values per describe_instances call.
+        """
+        now = time.time()
+        result: Dict[str, List[str]] = {}
+        missing = []
+        with self._lock:
+            for ip in set(ips):
+                entry = self._cache.get(ip)
+                if entry and entry[0] > now:
+                    result[ip] = entry[1]
+                else:
+                    missing.append(ip)
+
+        for i in range(0, len(missing), MAX_FILTER_VALUES):
+            chunk = missing[i:i + MAX_FILTER_VALUES]
+            found = self._describe([{'Name': 'private-ip-address', 'Values': chunk}])
+            now = time.time()
+            with self._lock:
+                for ip in chunk:
+                    instances = found.get(ip, [])
+                    ttl = self.ttl if instances else self.negative_ttl
+                    self._cache[ip] = (now + ttl, instances)
+                    result[ip] = instances
+        return result
+
+    def prewarm(self, vpc_id: Optional[str] = None) -> int:
+        """Load the running inventory (optionally of one VPC) into the cache."""
+        filters = [{'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopping', 'stopped']}]
+        if vpc_id:
+            filters.append({'Name': 'vpc-id', 'Values': [vpc_id]})
+        found = self._describe(filters)
+        expires = time.time() + self.ttl
+        with self._lock:
+            for ip, instances in found.items():
+                self._cache[ip] = (expires, instances)
+        logging.info(f'Pre-warmed EC2 inventory with {len(found)} IPs')
+        return len(found)
+
+    def _describe(self, filters: list) -> Dict[str, List[str]]:
+        found: Dict[str, List[str]] = {}
+        paginator = self.ec2.get_paginator('describe_instances')
+        for page in paginator.paginate(Filters=filters):
+            self.api_calls += 1
+            for reservation in page.get('Reservations', []):
+                for instance in reservation.get('Instances', []):
+                    for ip in _instance_ips(instance):
+                        found.setdefault(ip, []).append(instance['InstanceId'])
+        return found
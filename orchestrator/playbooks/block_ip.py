@@ -1,15 +1,24 @@
 #!/usr/bin/env python3
 """
-block_ip.py: Block a malicious IP by calling the configured firewall/EDR API.
-Uses API endpoint and key from playbooks/config.yml to submit a block request.
+block_ip.py: Block malicious IPs by calling the configured firewall/EDR API.
+Uses API endpoint and key from playbooks/config.yml to submit block requests.
+IPs can be blocked one at a time, in bulk chunks, or through BlockCoalescer,
+which groups IPs arriving within a short window into a single bulk request
+and retries partial failures with backoff.
 """
 import os
 import sys
+import time
 import yaml
 import logging
 import argparse
+import threading
+from concurrent.futures import Future
+from typing import Dict, Iterable, List
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Attempt to load shared logging setup
 try:
@@ -22,7 +31,13 @@ except ImportError:
             datefmt='%Y-%m-%dT%H:%M:%SZ'
         )
 
-# Path to playbook configuration\CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.yml')
+# Path to playbook configuration
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.yml')
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_BULK_PATH = '/block/bulk'
+OK_STATUSES = ('ok', 'blocked', 'success', 'already_blocked')
 
 
 def load_config(path: str) -> dict:
@@ -36,25 +51,226 @@ def load_config(path: str) -> dict:
         sys.exit(1)
 
 
-def block_ip(ip: str, api_url: str, api_key: str) -> None:
-    """Call the firewall API to block the given IP."""
+def create_session(retries: int = 3, backoff: float = 0.5, pool_size: int = 10) -> requests.Session:
+    """Build a keep-alive session that retries throttled and 5xx responses with backoff.
+
+    :param retries: HTTP-level retries per request; 0 when the caller retries
+        itself (BlockCoalescer), so the two layers do not multiply.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['POST']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _headers(api_key: str) -> dict:
+    return {'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'}
+
+
+def block_ip(ip: str, api_url: str, api_key: str, session: requests.Session = None) -> bool:
+    """Call the firewall API to block the given IP.
+
+    :param session: Optional shared requests.Session to reuse connections.
+    :return: True if the firewall accepted the block.
+    """
     url = api_url.rstrip('/') + '/block'
-    headers = {'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'}
     payload = {'ip': ip}
 
     logging.info(f"Sending block request for IP {ip} to {url}")
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        http = session or requests
+        response = http.post(url, json=payload, headers=_headers(api_key), timeout=DEFAULT_TIMEOUT)
         response.raise_for_status()
         logging.info(f"IP {ip} blocked successfully. API response: {response.text}")
+        return True
     except requests.exceptions.RequestException as e:
         logging.error(f"Error blocking IP {ip}: {e}")
-        sys.exit(1)
+        return False
+
+
+def _parse_bulk_response(response: requests.Response, chunk: List[str]) -> Dict[str, bool]:
+    """
+    Map a bulk response to per-IP results. Understands
+    ``{"results": [{"ip": ..., "status"|"success": ...}]}`` and
+    ``{"failed": [ip, ...]}``; any other 2xx body means the whole chunk succeeded.
+    """
+    results = {ip: True for ip in chunk}
+    try:
+        body = response.json()
+    except ValueError:
+        return results
+    if not isinstance(body, dict):
+        return results
+    if isinstance(body.get('failed'), list):
+        for ip in body['failed']:
+            results[ip] = False
+    elif isinstance(body.get('results'), list):
+        for item in body['results']:
+            if not isinstance(item, dict):
+                continue
+            ip = item.get('ip')
+            if ip not in results:
+                continue
+            if 'success' in item:
+                results[ip] = bool(item['success'])
+            else:
+                results[ip] = str(item.get('status', '')).lower() in OK_STATUSES
+    return results
+
+
+def block_ips(ips: Iterable[str], api_url: str, api_key: str, session: requests.Session = None,
+              chunk_size: int = DEFAULT_CHUNK_SIZE, bulk_path: str = DEFAULT_BULK_PATH) -> Dict[str, bool]:
+    """Block many IPs with one bulk request per chunk.
+
+    Falls back to one request per IP if the firewall has no bulk endpoint.
+
+    :return: Mapping of IP -> True if blocked, False if it should be retried.
+    """
+    unique = list(dict.fromkeys(ips))
+    url = api_url.rstrip('/') + bulk_path
+    http = session or requests
+    results: Dict[str, bool] = {}
+
+    for i in range(0, len(unique), chunk_size):
+        chunk = unique[i:i + chunk_size]
+        logging.info(f"Sending bulk block request for {len(chunk)} IPs to {url}")
+        try:
+            response = http.post(url, json={'ips': chunk}, headers=_headers(api_key), timeout=DEFAULT_TIMEOUT)
+            if response.status_code in (404, 405):
+                logging.warning(f"Bulk endpoint {url} not available; blocking IPs one by one")
+                for ip in chunk:
+                    results[ip] = block_ip(ip, api_url, api_key, session=session)
+                continue
+            response.raise_for_status()
+            results.update(_parse_bulk_response(response, chunk))
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error blocking {len(chunk)} IPs: {e}")
+            results.update({ip: False for ip in chunk})
+
+    failed = [ip for ip, ok in results.items() if not ok]
+    logging.info(f"Bulk block finished: {len(results) - len(failed)} blocked, {len(failed)} failed")
+    return results
+
+
+class BlockCoalescer:
+    """Coalesce block requests arriving within ``window`` seconds into bulk calls."""
+
+    def __init__(self, api_url: str, api_key: str, session: requests.Session = None,
+                 window: float = 0.5, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 max_attempts: int = 3, retry_backoff: float = 1.0):
+        """
+        :param window: Seconds to wait for more IPs before sending a batch.
+        :param chunk_size: Maximum IPs per bulk request.
+        :param max_attempts: Attempts per IP before giving up.
+        :param retry_backoff: Base delay (doubled per attempt) before retrying failed IPs.
+        """
+        if not api_url or not api_key:
+            raise ValueError('BlockCoalescer needs the firewall api_url and api_key')
+        self.api_url = api_url
+        self.api_key = api_key
+        self.session = session or create_session(retries=0)
+        self.window = window
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        # ip -> [future, attempts, not_before]
+        self._pending: Dict[str, list] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name='block-ip-coalescer', daemon=True)
+        self._thread.start()
+
+    def submit(self, ip: str) -> Future:
+        """Queue ``ip`` for blocking. The Future resolves to True once blocked."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('BlockCoalescer is closed')
+            entry = self._pending.get(ip)
+            if entry:
+                return entry[0]
+            future = Future()
+            self._pending[ip] = [future, 0, 0.0]
+            self._cond.notify()
+            return future
+
+    def close(self) -> None:
+        """Flush pending IPs (ignoring retry backoff) and stop the worker thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _wait_ready(self) -> None:
+        """Block until some IP is due (or the coalescer is closed). Called with the lock held."""
+        while True:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return
+            now = time.time()
+            if any(self._closed or entry[2] <= now for entry in self._pending.values()):
+                return
+            self._cond.wait(timeout=min(entry[2] for entry in self._pending.values()) - now)
+
+    def _next_batch(self) -> Dict[str, list]:
+        with self._cond:
+            self._wait_ready()
+            # Let IPs arriving within the window join this batch
+            deadline = time.time() + self.window
+            while not self._closed and len(self._pending) < self.chunk_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(timeout=remaining)
+            now = time.time()
+            ready = [ip for ip, entry in self._pending.items()
+                     if self._closed or entry[2] <= now][:self.chunk_size]
+            return {ip: self._pending.pop(ip) for ip in ready}
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                results = block_ips(list(batch), self.api_url, self.api_key,
+                                    session=self.session, chunk_size=self.chunk_size)
+            except Exception as e:
+                # Never let one bad batch kill the thread: its IPs go through the retry path
+                logging.exception(f"Unexpected error blocking {len(batch)} IPs: {e}")
+                results = {}
+            with self._cond:
+                for ip, (future, attempts, _) in batch.items():
+                    attempts += 1
+                    if results.get(ip):
+                        future.set_result(True)
+                    elif attempts >= self.max_attempts:
+                        logging.error(f"Giving up blocking IP {ip} after {attempts} attempts")
+                        future.set_result(False)
+                    elif ip in self._pending:
+                        # Resubmitted meanwhile: share the outcome of the newer request
+                        self._pending[ip][0].add_done_callback(
+                            lambda f, fut=future: fut.set_result(f.result())
+                        )
+                    else:
+                        not_before = time.time() + self.retry_backoff * 2 ** (attempts - 1)
+                        self._pending[ip] = [future, attempts, not_before]
+                        self._cond.notify()
 
 
 def parse_args():
-    parser = argparse.ArgumentParser(description="Block an IP address via firewall API.")
-    parser.add_argument('ip', help='IP address to block')
+    parser = argparse.ArgumentParser(description="Block IP addresses via firewall API.")
+    parser.add_argument('ips', nargs='+', metavar='ip', help='IP address(es) to block')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='Maximum IPs per bulk request')
     return parser.parse_args()
 
 
@@ -70,7 +286,14 @@ def main():
         logging.error('firewall.api_url or firewall.api_key not set in config.yml')
         sys.exit(1)
 
-    block_ip(args.ip, api_url, api_key)
+    session = create_session()
+    if len(args.ips) == 1:
+        ok = block_ip(args.ips[0], api_url, api_key, session=session)
+    else:
+        results = block_ips(args.ips, api_url, api_key, session=session, chunk_size=args.chunk_size)
+        ok = all(results.values())
+    if not ok:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -1,13 +1,23 @@
 #!/usr/bin/env python3
 """
-isolate_endpoint.py: Isolate an AWS EC2 instance by modifying its security groups to a restrictive group.
+isolate_endpoint.py: Isolate AWS EC2 instances by modifying their security groups to a restrictive group.
 Uses AWS credentials and target security group ID from playbooks/config.yml.
+Many instances can be isolated at once: they are fetched with a single
+describe_instances call and their ENIs are updated concurrently under a rate
+limit. If some ID does not exist, instances are fetched one call per ID.
+The original security groups of every ENI are saved so the isolation
+can be rolled back in bulk with --rollback.
 """
 import os
 import sys
+import json
+import time
 import yaml
 import logging
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
 import boto3
 from botocore.exceptions import ClientError
@@ -25,6 +35,17 @@ except ImportError:
 
 # Path to playbook configuration
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.yml')
+# Orchestrator state directory (same default as runner.STATE_DIR)
+STATE_DIR = os.getenv('ORCHESTRATOR_STATE_DIR', os.path.join(os.path.dirname(__file__), '..', 'state'))
+# Original security groups per ENI, used for rollback
+STATE_PATH = os.getenv('ISOLATION_STATE_FILE', os.path.join(STATE_DIR, 'isolation_state.json'))
+# describe_instances fails for the whole request if any of these applies to one ID
+BAD_ID_ERRORS = ('InvalidInstanceID.NotFound', 'InvalidInstanceID.Malformed')
+
+DEFAULT_CONCURRENCY = 5
+DEFAULT_RATE = 10.0  # modify_network_interface_attribute calls per second
+
+_state_lock = threading.Lock()
 
 
 def load_config(path: str) -> dict:
@@ -34,37 +55,194 @@ def load_config(path: str) -> dict:
     return cfg
 
 
-def isolate_instance(instance_id: str, restrictive_sg: str, ec2_client) -> None:
-    """Modify the security groups of the instance to the restrictive security group."""
+class RateLimiter:
+    """Thread-safe limiter allowing at most ``rate`` calls per second."""
+
+    def __init__(self, rate: float = DEFAULT_RATE):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _load_state(path: str) -> Dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_state(path: str, state: Dict[str, dict]) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _update_state(path: str, updates: Dict[str, Optional[dict]]) -> None:
+    """Merge ENI entries into the rollback state; a None value removes the ENI."""
+    with _state_lock:
+        state = _load_state(path)
+        for eni_id, entry in updates.items():
+            if entry is None:
+                state.pop(eni_id, None)
+            else:
+                state[eni_id] = entry
+        _save_state(path, state)
+
+
+def _describe(instance_ids: List[str], ec2_client, interfaces: Dict[str, List[dict]]) -> None:
+    paginator = ec2_client.get_paginator('describe_instances')
+    for page in paginator.paginate(InstanceIds=list(instance_ids)):
+        for reservation in page.get('Reservations', []):
+            for instance in reservation.get('Instances', []):
+                interfaces[instance['InstanceId']] = instance.get('NetworkInterfaces', [])
+
+
+def describe_interfaces(instance_ids: List[str], ec2_client) -> Dict[str, List[dict]]:
+    """Return the ENIs of every instance, fetched in one paginated describe_instances call.
+
+    If some ID does not exist the batch call fails as a whole; the instances
+    are then described one by one and unknown IDs get no interfaces.
+    """
+    interfaces: Dict[str, List[dict]] = {iid: [] for iid in instance_ids}
     try:
-        # Retrieve current network interfaces
-        resp = ec2_client.describe_instances(InstanceIds=[instance_id])
-        reservations = resp.get('Reservations', [])
-        if not reservations:
-            logging.error(f"Instance {instance_id} not found")
-            sys.exit(1)
-        instance = reservations[0]['Instances'][0]
-        interfaces = instance.get('NetworkInterfaces', [])
-        if not interfaces:
-            logging.error(f"No network interfaces found on {instance_id}")
-            sys.exit(1)
-
-        for iface in interfaces:
-            eni_id = iface['NetworkInterfaceId']
-            logging.info(f"Updating ENI {eni_id} security groups to [{restrictive_sg}]")
-            ec2_client.modify_network_interface_attribute(
-                NetworkInterfaceId=eni_id,
-                Groups=[restrictive_sg]
-            )
-        logging.info(f"Instance {instance_id} isolated successfully.")
+        _describe(instance_ids, ec2_client, interfaces)
+        return interfaces
     except ClientError as e:
-        logging.error(f"Error isolating instance {instance_id}: {e}")
-        sys.exit(1)
+        if e.response.get('Error', {}).get('Code') not in BAD_ID_ERRORS or len(instance_ids) == 1:
+            raise
+        logging.warning(f"Batch describe failed ({e}); describing {len(instance_ids)} instances one by one")
+    for iid in instance_ids:
+        try:
+            _describe([iid], ec2_client, interfaces)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in BAD_ID_ERRORS:
+                raise
+            logging.error(f"Instance {iid} not found: {e}")
+    return interfaces
+
+
+def _modify_groups(ec2_client, eni_id: str, groups: List[str], limiter: RateLimiter) -> bool:
+    limiter.wait()
+    try:
+        ec2_client.modify_network_interface_attribute(NetworkInterfaceId=eni_id, Groups=groups)
+        return True
+    except ClientError as e:
+        logging.error(f"Error updating ENI {eni_id} security groups: {e}")
+        return False
+
+
+def isolate_instances(instance_ids: List[str], restrictive_sg: str, ec2_client,
+                      max_concurrency: int = DEFAULT_CONCURRENCY,
+                      rate_limiter: Optional[RateLimiter] = None,
+                      state_path: str = STATE_PATH) -> Dict[str, bool]:
+    """Isolate many instances, updating their ENIs concurrently.
+
+    :return: Mapping of instance ID -> True if every ENI was isolated.
+    """
+    limiter = rate_limiter or RateLimiter()
+    instance_ids = list(dict.fromkeys(instance_ids))
+    try:
+        interfaces = describe_interfaces(instance_ids, ec2_client)
+    except ClientError as e:
+        logging.error(f"Error describing instances {instance_ids}: {e}")
+        return {iid: False for iid in instance_ids}
+
+    results = {iid: True for iid in instance_ids}
+    saved: Dict[str, dict] = {}
+    targets = []
+    for iid, ifaces in interfaces.items():
+        if not ifaces:
+            logging.error(f"No network interfaces found on {iid}")
+            results[iid] = False
+            continue
+        for iface in ifaces:
+            eni_id = iface['NetworkInterfaceId']
+            groups = [g['GroupId'] for g in iface.get('Groups', [])]
+            # Never overwrite the original groups of an ENI that is already isolated
+            if groups != [restrictive_sg]:
+                saved[eni_id] = {'instance_id': iid, 'groups': groups}
+            targets.append((iid, eni_id))
+    if saved:
+        _update_state(state_path, saved)
+
+    def isolate(target):
+        iid, eni_id = target
+        logging.info(f"Updating ENI {eni_id} of {iid} security groups to [{restrictive_sg}]")
+        return iid, _modify_groups(ec2_client, eni_id, [restrictive_sg], limiter)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        for iid, ok in pool.map(isolate, targets):
+            results[iid] = results[iid] and ok
+
+    for iid, ok in results.items():
+        if ok:
+            logging.info(f"Instance {iid} isolated successfully.")
+        else:
+            logging.error(f"Instance {iid} could not be fully isolated")
+    return results
+
+
+def rollback_instances(instance_ids: List[str], ec2_client,
+                       max_concurrency: int = DEFAULT_CONCURRENCY,
+                       rate_limiter: Optional[RateLimiter] = None,
+                       state_path: str = STATE_PATH) -> Dict[str, bool]:
+    """Restore the saved security groups of the given instances' ENIs.
+
+    :return: Mapping of instance ID -> True if every ENI was restored.
+    """
+    limiter = rate_limiter or RateLimiter()
+    wanted = set(instance_ids)
+    with _state_lock:
+        state = _load_state(state_path)
+    targets = [(eni_id, entry) for eni_id, entry in state.items() if entry['instance_id'] in wanted]
+    results = {iid: True for iid in wanted}
+    for iid in wanted - {entry['instance_id'] for _, entry in targets}:
+        logging.error(f"No saved security groups for {iid}; cannot roll back")
+        results[iid] = False
+
+    def restore(target):
+        eni_id, entry = target
+        logging.info(f"Restoring ENI {eni_id} of {entry['instance_id']} security groups to {entry['groups']}")
+        return eni_id, entry['instance_id'], _modify_groups(ec2_client, eni_id, entry['groups'], limiter)
+
+    restored = {}
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        for eni_id, iid, ok in pool.map(restore, targets):
+            results[iid] = results[iid] and ok
+            if ok:
+                restored[eni_id] = None
+    if restored:
+        _update_state(state_path, restored)
+    return results
+
+
+def isolate_instance(instance_id: str, restrictive_sg: str, ec2_client,
+                     rate_limiter: Optional[RateLimiter] = None) -> bool:
+    """Modify the security groups of the instance to the restrictive security group."""
+    return isolate_instances([instance_id], restrictive_sg, ec2_client, rate_limiter=rate_limiter)[instance_id]
 
 
 def parse_args():
-    parser = argparse.ArgumentParser(description="Isolate an EC2 instance by assigning a restrictive security group.")
-    parser.add_argument('instance_id', help='EC2 Instance ID to isolate')
+    parser = argparse.ArgumentParser(description="Isolate EC2 instances by assigning a restrictive security group.")
+    parser.add_argument('instance_ids', nargs='+', metavar='instance_id', help='EC2 Instance ID(s) to isolate')
+    parser.add_argument('--rollback', action='store_true',
+                        help='Restore the security groups saved when the instances were isolated')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Maximum concurrent ENI updates')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help='Maximum ENI updates per second')
     return parser.parse_args()
 
 
@@ -76,7 +254,7 @@ def main():
     cfg = load_config(CONFIG_PATH)
     aws_cfg = cfg.get('aws', {})
     restrictive_sg = cfg.get('restrictive_security_group_id')
-    if not restrictive_sg:
+    if not restrictive_sg and not args.rollback:
         logging.error('restrictive_security_group_id not set in config.yml')
         sys.exit(1)
 
@@ -88,8 +266,14 @@ def main():
     )
     ec2_client = session.client('ec2')
 
-    # Perform isolation
-    isolate_instance(args.instance_id, restrictive_sg, ec2_client)
+    limiter = RateLimiter(args.rate)
+    if args.rollback:
+        results = rollback_instances(args.instance_ids, ec2_client, args.concurrency, limiter)
+    else:
+        # Perform isolation
+        results = isolate_instances(args.instance_ids, restrictive_sg, ec2_client, args.concurrency, limiter)
+    if not all(results.values()):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
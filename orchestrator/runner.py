@@ -4,19 +4,38 @@ runner.py: Orquestador principal que supervisa anomalías de Elastic ML y ejecut
  - anomaly_login -> bloquea IP con block_ip.py
  - anomaly_traffic -> aísla instancias EC2 con isolate_endpoint.py
 
+Los playbooks se ejecutan en el mismo proceso mediante un pool de workers
+(orchestrator/executor.py) que comparte configuración y clientes.
+
 Configuración en orchestrator/playbooks/config.yml:
   aws: {access_key, secret_key, region}
   firewall: {api_url, api_key}
-  (Opcional) elasticsearch_host, score_threshold, poll_interval
+  (Opcional) elasticsearch_host, score_threshold, poll_interval, page_size
+  (Opcional) state_dir: directorio donde se persisten los cursores por job
+  (Opcional) dedup: {ttl_seconds, max_entries, bucket_seconds, persist}
+  (Opcional) executor: {max_workers, limits: {isolate_endpoint}}
+  (Opcional) firewall: {batch_window, batch_size, max_attempts, retries, retry_backoff}
+  (Opcional) isolation: {max_concurrency, rate}
+  (Opcional) inventory: {ttl_seconds, negative_ttl_seconds, prewarm, vpc_id}
+  (Opcional) mode: sync | async (también ORCHESTRATOR_MODE o --mode)
+  (Opcional) action_log: {enabled, index, flush_size, flush_interval}: registro
+             de acciones en Elasticsearch para las métricas de respuesta
+  (Opcional) async_workers, queue_size, jobs: parámetros del modo asíncrono
 """
 import os
 import time
+import asyncio
 import logging
-import subprocess
+import argparse
 
 import boto3
 from elasticsearch import Elasticsearch
 from orchestrator.utils import setup_logging, load_yaml_config
+from orchestrator.executor import PlaybookExecutor
+from orchestrator.cursors import JobCursorStore, iter_new_records, DEFAULT_INITIAL_LOOKBACK
+from orchestrator.dedup import DedupStore
+from orchestrator.inventory import InstanceResolver
+from orchestrator.action_log import ActionLog, DEFAULT_INDEX as ACTIONS_INDEX
 
 # Cargar configuración del playbook
 default_config_path = os.path.join(os.path.dirname(__file__), 'playbooks', 'config.yml')
@@ -26,15 +45,28 @@ config = load_yaml_config(default_config_path)
 ES_HOST = os.getenv('ELASTICSEARCH_HOST', config.get('elasticsearch_host', 'http://elasticsearch:9200'))
 SCORE_THRESHOLD = config.get('score_threshold', 75.0)
 POLL_INTERVAL = config.get('poll_interval', 60)
+PAGE_SIZE = config.get('page_size', 100)
+RUNNER_MODE = os.getenv('ORCHESTRATOR_MODE', config.get('mode', 'sync'))
+
+# Estado persistente (cursores de los jobs de ML)
+STATE_DIR = os.getenv('ORCHESTRATOR_STATE_DIR', config.get('state_dir', os.path.join(os.path.dirname(__file__), 'state')))
+CURSOR_FILE = os.path.join(STATE_DIR, 'ml_cursors.json')
+# Segundos hacia atrás desde los que empieza un job sin cursor guardado (null: todo el historial)
+INITIAL_LOOKBACK = config.get('initial_lookback', DEFAULT_INITIAL_LOOKBACK)
+
+# Deduplicación de acciones (TTL, tope de memoria y respaldo opcional en SQLite)
+DEDUP_CFG = config.get('dedup') or {}
+DEDUP_FILE = os.path.join(STATE_DIR, 'dedup.sqlite')
+
+# Caché de resolución IP -> InstanceId
+INVENTORY_CFG = config.get('inventory') or {}
+
+# Registro de acciones en Elasticsearch (MTTD/MTTR en metrics/es_metrics.py)
+ACTION_LOG_CFG = config.get('action_log') or {}
 
 # AWS y Firewall (block_ip e isolate_endpoint usan estas credenciales internamente)
 AWS_CFG = config.get('aws', {})
 
-# Paths de scripts
-BASE_DIR = os.getcwd()
-BLOCK_IP_SCRIPT = os.path.join(BASE_DIR, 'orchestrator', 'playbooks', 'block_ip.py')
-ISOLATE_SCRIPT = os.path.join(BASE_DIR, 'orchestrator', 'playbooks', 'isolate_endpoint.py')
-
 
 def get_es_client():
     return Elasticsearch([ES_HOST])
@@ -48,59 +80,157 @@ def get_aws_client():
     ).client('ec2')
 
 
-def process_login_anomalies(es, processed):
+def get_dedup_store():
+    path = None
+    if DEDUP_CFG.get('persist', True):
+        os.makedirs(STATE_DIR, exist_ok=True)
+        path = DEDUP_FILE
+    return DedupStore(
+        ttl=DEDUP_CFG.get('ttl_seconds', 24 * 3600),
+        max_entries=DEDUP_CFG.get('max_entries', 100000),
+        bucket_seconds=DEDUP_CFG.get('bucket_seconds', 3600),
+        path=path
+    )
+
+
+def get_action_log(es):
+    if not ACTION_LOG_CFG.get('enabled', True):
+        return None
+    return ActionLog(
+        es,
+        index=ACTION_LOG_CFG.get('index', ACTIONS_INDEX),
+        flush_size=ACTION_LOG_CFG.get('flush_size', 500),
+        flush_interval=ACTION_LOG_CFG.get('flush_interval', 5.0)
+    )
+
+
+def process_login_anomalies(es, executor, cursors, dedup, action_log=None):
     try:
-        resp = es.ml.get_records(job_id='anomaly_login', record_score=SCORE_THRESHOLD, size=100)
-        for rec in resp.get('records', []):
+        for rec in iter_new_records(es, 'anomaly_login', cursors, SCORE_THRESHOLD, PAGE_SIZE):
+            cursors.advance('anomaly_login', rec)
             rid = rec['record_id']
-            if rid in processed:
-                continue
-            processed.add(rid)
             ip = rec.get('partition_field_value')
             if not ip:
                 continue
+            if dedup.check_and_add(f'block_ip:{ip}'):
+                logging.info(f"[LoginAnomaly] ID={rid}, IP={ip} ya bloqueada recientemente")
+                continue
             logging.info(f"[LoginAnomaly] ID={rid}, IP={ip}")
-            subprocess.run(['python3', BLOCK_IP_SCRIPT, ip], check=False)
+            future = executor.block_ip(ip)
+            dedup.release_on_failure(future, f'block_ip:{ip}')
+            if action_log is not None:
+                action_log.record(future, 'block_ip', ip, rec)
     except Exception as e:
         logging.error(f"Error procesando anomaly_login: {e}")
+    finally:
+        cursors.save()
 
 
-def process_traffic_anomalies(es, aws, processed):
+def process_traffic_anomalies(es, resolver, executor, cursors, dedup, action_log=None):
     try:
-        resp = es.ml.get_records(job_id='anomaly_traffic', record_score=SCORE_THRESHOLD, size=100)
-        for rec in resp.get('records', []):
+        # Recoger las IPs del ciclo para resolverlas en una sola llamada a EC2
+        pending = []
+        # Primer registro de anomalía de cada IP, para el registro de acciones
+        records_by_ip = {}
+        # Posición previa al ciclo, para reintentar los registros si falla la resolución
+        start_cursor = cursors.get('anomaly_traffic')
+        for rec in iter_new_records(es, 'anomaly_traffic', cursors, SCORE_THRESHOLD, PAGE_SIZE):
+            cursors.advance('anomaly_traffic', rec)
             rid = rec['record_id']
-            if rid in processed:
-                continue
-            processed.add(rid)
             ip = rec.get('partition_field_value')
             if not ip:
                 continue
             logging.info(f"[TrafficAnomaly] ID={rid}, IP={ip}")
-            # Resolver IP a InstanceId
-            try:
-                ec2 = aws
-                out = ec2.describe_instances(Filters=[{'Name': 'private-ip-address', 'Values': [ip]}])
-                instances = [i['InstanceId'] for r in out['Reservations'] for i in r['Instances']]
-                for iid in instances:
-                    logging.info(f"Aislando instancia {iid} para IP {ip}")
-                    subprocess.run(['python3', ISOLATE_SCRIPT, iid], check=False)
-            except Exception as ae:
-                logging.error(f"Error aislando instancia para IP {ip}: {ae}")
+            pending.append(ip)
+            records_by_ip.setdefault(ip, rec)
+        if not pending:
+            return
+        # Resolver IP a InstanceId
+        try:
+            instances_by_ip = resolver.resolve(pending)
+        except Exception as ae:
+            logging.error(f"Error resolviendo instancias para {len(pending)} IPs: {ae}; se reintentará")
+            cursors.reset('anomaly_traffic', start_cursor)
+            return
+        to_isolate = []
+        for ip in dict.fromkeys(pending):
+            for iid in instances_by_ip.get(ip, []):
+                if dedup.check_and_add(f'isolate:{iid}'):
+                    logging.info(f"Instancia {iid} ya aislada recientemente")
+                    continue
+                logging.info(f"Aislando instancia {iid} para IP {ip}")
+                to_isolate.append((iid, records_by_ip[ip]))
+        if to_isolate:
+            future = executor.isolate_instances([iid for iid, _ in to_isolate])
+            # El lote falla si falla cualquier instancia; se liberan todas (aislar es idempotente)
+            dedup.release_on_failure(future, *(f'isolate:{iid}' for iid, _ in to_isolate))
+            if action_log is not None:
+                for iid, rec in to_isolate:
+                    action_log.record(future, 'isolate_endpoint', iid, rec)
     except Exception as e:
         logging.error(f"Error procesando anomaly_traffic: {e}")
+    finally:
+        cursors.save()
+
+
+def get_instance_resolver(aws):
+    resolver = InstanceResolver(
+        aws,
+        ttl=INVENTORY_CFG.get('ttl_seconds', 300),
+        negative_ttl=INVENTORY_CFG.get('negative_ttl_seconds', 60)
+    )
+    if INVENTORY_CFG.get('prewarm', False):
+        try:
+            resolver.prewarm(INVENTORY_CFG.get('vpc_id'))
+        except Exception as e:
+            logging.warning(f"No se pudo precargar el inventario EC2: {e}")
+    return resolver
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Orquestador de respuesta a anomalías de Elastic ML.")
+    parser.add_argument('--mode', choices=['sync', 'async'], default=RUNNER_MODE,
+                        help='sync: sondeo secuencial; async: una tarea asyncio por job de ML')
+    return parser.parse_args()
 
 
 def main():
     setup_logging()
-    es = get_es_client()
+    args = parse_args()
     aws = get_aws_client()
-    processed = set()
+    executor = PlaybookExecutor(config, aws)
+    cursors = JobCursorStore(CURSOR_FILE, INITIAL_LOOKBACK)
+    dedup = get_dedup_store()
+    resolver = get_instance_resolver(aws)
+    es = get_es_client()
+    action_log = get_action_log(es)
+
+    if args.mode == 'async':
+        from orchestrator import async_runner
+        try:
+            asyncio.run(async_runner.run(
+                config, ES_HOST, resolver, executor, cursors, dedup,
+                SCORE_THRESHOLD, PAGE_SIZE, POLL_INTERVAL, action_log=action_log
+            ))
+        finally:
+            executor.shutdown()
+            if action_log is not None:
+                action_log.close()
+            dedup.close()
+        return
+
     logging.info("Orquestador iniciado. Monitoreando anomalías...")
-    while True:
-        process_login_anomalies(es, processed)
-        process_traffic_anomalies(es, aws, processed)
-        time.sleep(POLL_INTERVAL)
+    try:
+        while True:
+            process_login_anomalies(es, executor, cursors, dedup, action_log)
+            process_traffic_anomalies(es, resolver, executor, cursors, dedup, action_log)
+            logging.debug(f"Dedup stats: {dedup.stats()}")
+            time.sleep(POLL_INTERVAL)
+    finally:
+        executor.shutdown()
+        if action_log is not None:
+            action_log.close()
+        dedup.close()
 
 
 if __name__ == '__main__':
@@ -1,19 +1,18 @@
 #!/usr/bin/env python3
 """
 cve_feed.py: RSS scraper for recent CVEs from the NVD (National Vulnerability Database).
-Fetches the NVD RSS feed and writes parsed entries to a timestamped JSON file.
+Fetches the NVD RSS feed and appends parsed entries to the compacted feed store.
+Downloads go through FeedCache, so an unchanged feed is neither parsed nor written again.
 """
-import os
-import json
 import logging
-from datetime import datetime
 
 import feedparser
 
+from feed_cache import FeedCache
+from feed_store import FeedStore
+
 # URL of the NVD CVE RSS feed
 FEED_URL = 'https://nvd.nist.gov/feeds/xml/cve/misc/nvd-rss.xml'
-# Directory to store output JSON files
-OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
 
 
 def setup_logging():
@@ -25,10 +24,20 @@ def setup_logging():
     )
 
 
-def fetch_feed(url):
-    """Fetch and parse RSS feed entries."""
+def fetch_feed(url, cache=None):
+    """Fetch and parse RSS feed entries.
+
+    With a FeedCache, returns None when the feed has not changed since the
+    last committed fetch.
+    """
     logging.info(f'Fetching CVE feed from {url}')
-    feed = feedparser.parse(url)
+    if cache is not None:
+        content = cache.fetch(url)
+        if content is None:
+            return None
+        feed = feedparser.parse(content)
+    else:
+        feed = feedparser.parse(url)
     if feed.bozo:
         logging.error(f'Error parsing feed: {feed.bozo_exception}')
         raise feed.bozo_exception
@@ -51,24 +60,26 @@ def parse_entries(entries):
     return parsed
 
 
-def save_to_file(data, output_dir):
-    """Save parsed data to a timestamped JSON file."""
-    os.makedirs(output_dir, exist_ok=True)
-    timestamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
-    filename = f'cve_feed_{timestamp}.json'
-    path = os.path.join(output_dir, filename)
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
-    logging.info(f'Saved {len(data)} CVE entries to {path}')
+def save_to_store(data, store):
+    """Append parsed entries to the feed store, keyed by CVE entry ID."""
+    records = ({'type': 'cve', 'value': entry['id'], **entry} for entry in data if entry.get('id'))
+    path = store.append(records, kind='cve', source='cve_feed')
+    logging.info(f'Saved {len(data)} CVE entries to the feed store')
     return path
 
 
 def main():
     setup_logging()
     try:
-        entries = fetch_feed(FEED_URL)
+        cache = FeedCache()
+        entries = fetch_feed(FEED_URL, cache)
+        if entries is None:
+            logging.info('CVE feed unchanged; nothing to save.')
+            return
         parsed = parse_entries(entries)
-        save_to_file(parsed, OUTPUT_DIR)
+        save_to_store(parsed, FeedStore())
+        cache.commit(FEED_URL)
+        cache.save()
     except Exception as e:
         logging.exception('Failed to fetch or save CVE feed')
         exit(1)
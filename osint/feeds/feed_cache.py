@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+feed_cache.py: HTTP cache for OSINT/CVE feed downloads.
+Stores ETag/Last-Modified validators and a content hash per feed URL so that
+unchanged feeds are answered with 304 Not Modified (or detected by hash) and
+callers can skip parsing and writing output.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Dict, Optional
+
+import requests
+
+# Default location of the cache state, next to the feed output files
+CACHE_FILE = os.path.join(os.path.dirname(__file__), 'output', '.feed_cache.json')
+DEFAULT_TIMEOUT = 30
+
+
+class FeedCache:
+    """Conditional GET + content-hash cache keyed by feed URL."""
+
+    def __init__(self, path: str = CACHE_FILE, session: Optional[requests.Session] = None,
+                 timeout: int = DEFAULT_TIMEOUT):
+        """
+        :param path: JSON file holding validators and hashes per URL.
+        :param session: Optional shared requests.Session.
+        :param timeout: Request timeout in seconds.
+        """
+        self.path = path
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self._entries: Dict[str, dict] = {}
+        self._pending: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f'Could not load feed cache {path}: {e}')
+
+    def fetch(self, url: str) -> Optional[bytes]:
+        """
+        Download ``url`` unless it is unchanged since the last committed fetch.
+
+        :return: The body if the feed changed, None if it did not.
+        """
+        with self._lock:
+            entry = dict(self._entries.get(url, {}))
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        resp = self.session.get(url, headers=headers, timeout=self.timeout)
+        if resp.status_code == 304:
+            logging.info(f'Feed {url} not modified (304)')
+            return None
+        resp.raise_for_status()
+
+        content = resp.content
+        digest = hashlib.sha256(content).hexdigest()
+        new_entry = {
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified'),
+            'sha256': digest,
+        }
+        if digest == entry.get('sha256'):
+            logging.info(f'Feed {url} content unchanged')
+            with self._lock:
+                self._entries[url] = new_entry
+            return None
+        with self._lock:
+            self._pending[url] = new_entry
+        return content
+
+    def commit(self, url: str) -> None:
+        """Mark the last fetched version of ``url`` as processed."""
+        with self._lock:
+            if url in self._pending:
+                self._entries[url] = self._pending.pop(url)
+
+    def save(self) -> None:
+        """Persist committed entries."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = dict(self._entries)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
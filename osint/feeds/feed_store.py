@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+feed_store.py: Compacted, deduplicated storage for feed output.
+Crawlers append records to small append-only JSON-lines segments; compaction
+folds the segments into a single SQLite snapshot keyed by (kind, type, value)
+that tracks first_seen/last_seen per record, and expires records not seen
+within the retention period. Readers only scan the snapshot, so load time
+does not grow with the number of crawler runs.
+
+Usage:
+  python feed_store.py compact [--retention-days N]
+  python feed_store.py import <legacy.json|legacy.jsonl> ... [--delete]
+  python feed_store.py stats
+"""
+import os
+import glob
+import json
+import time
+import fcntl
+import sqlite3
+import logging
+import argparse
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+# Store location, next to the feed output files
+STORE_DIR = os.getenv('FEED_STORE_DIR', os.path.join(os.path.dirname(__file__), 'output', 'store'))
+# Records not seen for this many days are expired during compaction
+RETENTION_DAYS = float(os.getenv('FEED_RETENTION_DAYS', '90'))
+# Compact automatically once this many segments are pending
+COMPACT_THRESHOLD = int(os.getenv('FEED_COMPACT_THRESHOLD', '10'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    kind TEXT NOT NULL,
+    type TEXT NOT NULL,
+    value TEXT NOT NULL,
+    source TEXT,
+    payload TEXT,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (kind, type, value)
+);
+CREATE INDEX IF NOT EXISTS records_last_seen ON records (last_seen);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s %(message)s',
+        datefmt='%Y-%m-%dT%H:%M:%SZ'
+    )
+
+
+class FeedStore:
+    """Append-only segments compacted into a deduplicated SQLite snapshot."""
+
+    def __init__(self, root: str = STORE_DIR, retention_days: float = RETENTION_DAYS,
+                 compact_threshold: int = COMPACT_THRESHOLD):
+        """
+        :param root: Directory holding segments/ and snapshot.sqlite.
+        :param retention_days: Expire records whose last_seen is older than this (0 disables).
+        :param compact_threshold: Pending segments that trigger compaction on append.
+        """
+        self.root = root
+        self.segments_dir = os.path.join(root, 'segments')
+        self.snapshot_path = os.path.join(root, 'snapshot.sqlite')
+        self.lock_path = os.path.join(root, '.compact.lock')
+        self.retention_days = retention_days
+        self.compact_threshold = compact_threshold
+        os.makedirs(self.segments_dir, exist_ok=True)
+
+    def append(self, records: Iterable[Dict[str, Any]], kind: str, source: str) -> Optional[str]:
+        """
+        Write records to a new segment.
+
+        :param records: Dicts with 'type' and 'value' keys (the dedup key); the whole dict is kept as payload.
+        :param kind: Record family, e.g. 'ioc', 'cve', 'osint'.
+        :param source: Producer name stored with each record.
+        :return: Segment path, or None if there were no records.
+        """
+        now = time.time()
+        name = f'{now:.6f}_{source}.jsonl'
+        tmp_path = os.path.join(self.segments_dir, '.' + name + '.tmp')
+        count = 0
+        with open(tmp_path, 'w') as f:
+            for record in records:
+                rtype, value = record.get('type'), record.get('value')
+                if not rtype or not value:
+                    continue
+                f.write(json.dumps({
+                    'kind': kind, 'type': str(rtype), 'value': str(value),
+                    'source': source, 'seen': now, 'payload': record,
+                }, separators=(',', ':')))
+                f.write('\n')
+                count += 1
+        if not count:
+            os.remove(tmp_path)
+            return None
+        path = os.path.join(self.segments_dir, name)
+        os.replace(tmp_path, path)
+        logging.info(f'Appended {count} {kind} records from {source} to {path}')
+        if len(self.pending_segments()) >= self.compact_threshold:
+            self.compact()
+        return path
+
+    def pending_segments(self):
+        return sorted(glob.glob(os.path.join(self.segments_dir, '*.jsonl')))
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.snapshot_path)
+        db.executescript(SCHEMA)
+        return db
+
+    def compact(self) -> Dict[str, int]:
+        """
+        Fold pending segments into the snapshot and expire stale records.
+
+        Holds an exclusive lock on the store, so crawlers compacting at the
+        same time run one after the other instead of merging and deleting the
+        same segments twice.
+        """
+        with open(self.lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                return self._compact()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _compact(self) -> Dict[str, int]:
+        segments = []
+        merged = 0
+        db = self._connect()
+        try:
+            with db:
+                for segment in self.pending_segments():
+                    try:
+                        f = open(segment)
+                    except FileNotFoundError:
+                        # Already folded by a compaction outside this lock
+                        continue
+                    segments.append(segment)
+                    with f:
+                        rows = (
+                            (r['kind'], r['type'], r['value'], r['source'],
+                             json.dumps(r['payload'], separators=(',', ':')), r['seen'], r['seen'])
+                            for r in map(json.loads, f)
+                        )
+                        cur = db.executemany(
+                            """
+                            INSERT INTO records (kind, type, value, source, payload, first_seen, last_seen)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT (kind, type, value) DO UPDATE SET
+                                source = excluded.source,
+                                payload = excluded.payload,
+                                first_seen = MIN(first_seen, excluded.first_seen),
+                                last_seen = MAX(last_seen, excluded.last_seen)
+                            """,
+                            rows
+                        )
+                        merged += cur.rowcount
+                expired = self._expire(db)
+                if merged or expired:
+                    self._bump_version(db)
+            for segment in segments:
+                try:
+                    os.remove(segment)
+                except FileNotFoundError:
+                    pass
+        finally:
+            db.close()
+        logging.info(f'Compacted {len(segments)} segments ({merged} records), expired {expired}')
+        return {'segments': len(segments), 'records': merged, 'expired': expired}
+
+    def _expire(self, db: sqlite3.Connection) -> int:
+        if not self.retention_days:
+            return 0
+        cutoff = time.time() - self.retention_days * 86400
+        return db.execute('DELETE FROM records WHERE last_seen < ?', (cutoff,)).rowcount
+
+    def _bump_version(self, db: sqlite3.Connection) -> None:
+        db.execute(
+            "INSERT INTO meta (key, value) VALUES ('version', '1') "
+            "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    def version(self) -> int:
+        """Counter bumped whenever compaction changes the snapshot."""
+        db = self._connect()
+        try:
+            row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        finally:
+            db.close()
+        return int(row[0]) if row else 0
+
+    def iter_records(self, kind: str, with_payload: bool = False) -> Iterator[tuple]:
+        """Yield (type, value[, payload]) of every snapshot record of ``kind``."""
+        columns = 'type, value, payload' if with_payload else 'type, value'
+        db = self._connect()
+        try:
+            for row in db.execute(f'SELECT {columns} FROM records WHERE kind = ?', (kind,)):
+                if with_payload:
+                    yield row[0], row[1], json.loads(row[2])
+                else:
+                    yield row
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        db = self._connect()
+        try:
+            counts = dict(db.execute('SELECT kind, COUNT(*) FROM records GROUP BY kind').fetchall())
+        finally:
+            db.close()
+        return {'records': counts, 'pending_segments': len(self.pending_segments()), 'version': self.version()}
+
+
+def iter_legacy_file(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the records of a legacy timestamped .json/.jsonl feed file."""
+    with open(path) as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+
+def legacy_iocs(records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Turn legacy records ({type, value} or flat ip/domain/hash keys) into IOC records."""
+    for item in records:
+        if not isinstance(item, dict):
+            continue
+        if item.get('type') and item.get('value'):
+            yield item
+            continue
+        for field, ioc_type in (('ip', 'ip'), ('domain', 'domain'), ('md5', 'hash'),
+                                ('sha1', 'hash'), ('sha256', 'hash'), ('hash', 'hash')):
+            if item.get(field):
+                yield {'type': ioc_type, 'value': item[field]}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Manage the compacted feed store.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    compact = sub.add_parser('compact', help='Fold pending segments into the snapshot')
+    compact.add_argument('--retention-days', type=float, default=RETENTION_DAYS)
+    imp = sub.add_parser('import', help='Import legacy timestamped IOC feed files and compact')
+    imp.add_argument('files', nargs='+')
+    imp.add_argument('--delete', action='store_true', help='Delete the files once imported')
+    sub.add_parser('stats', help='Show record counts')
+    return parser.parse_args()
+
+
+def main():
+    setup_logging()
+    args = parse_args()
+    if args.command == 'compact':
+        FeedStore(retention_days=args.retention_days).compact()
+    elif args.command == 'import':
+        store = FeedStore()
+        for path in args.files:
+            store.append(legacy_iocs(iter_legacy_file(path)), kind='ioc', source=os.path.basename(path))
+        store.compact()
+        if args.delete:
+            for path in args.files:
+                os.remove(path)
+    else:
+        print(json.dumps(FeedStore().stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
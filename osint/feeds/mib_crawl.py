@@ -1,19 +1,32 @@
 #!/usr/bin/env python3
 """
 mib_crawl.py: Custom OSINT & MISP crawler.
-- Fetches recent events from a MISP instance via REST API.
-- Optionally, crawls additional OSINT RSS/JSON feeds for IOCs.
-- Writes combined IOC list to a timestamped JSON file.
+- Fetches recent events from a MISP instance via REST API, splitting the
+  lookback window into time slices fetched concurrently page by page, with a
+  checkpoint so an interrupted crawl resumes where it stopped.
+- Flattens event and object attributes into a typed, deduplicated IOC stream
+  appended to the compacted feed store ({"type", "value", "misp_type"}).
+- Optionally, crawls additional OSINT RSS/JSON feeds for IOCs, concurrently and
+  with conditional GETs so unchanged feeds are skipped.
 """
 import os
+import glob
 import json
+import time
+import shutil
 import logging
-from datetime import datetime, timedelta
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
 from feedparser import parse as parse_feed
 
-# Output directory for JSON files\ OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
+from feed_cache import FeedCache
+from feed_store import FeedStore
+
+# Output directory for crawl state
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
 # Environment variables to configure MISP connection
 MISP_URL = os.getenv('MISP_URL')  # e.g. https://misp.example.com
 MISP_KEY = os.getenv('MISP_KEY')  # your API key
@@ -22,8 +35,28 @@ OSINT_FEEDS = [
     # 'https://example.com/iocs-feed.json',
     # 'https://some-rss-feed.com/osint.xml',
 ]
+OSINT_FETCH_WORKERS = int(os.getenv('OSINT_FETCH_WORKERS', '8'))
 # Time window for MISP events (in hours)
 MISP_LOOKBACK_HOURS = int(os.getenv('MISP_LOOKBACK_HOURS', '24'))
+# The window is fetched in slices of MISP_SLICE_HOURS, MISP_PAGE_SIZE events per page
+MISP_SLICE_HOURS = float(os.getenv('MISP_SLICE_HOURS', '1'))
+MISP_PAGE_SIZE = int(os.getenv('MISP_PAGE_SIZE', '100'))
+MISP_FETCH_WORKERS = int(os.getenv('MISP_FETCH_WORKERS', '4'))
+MISP_TIMEOUT = int(os.getenv('MISP_TIMEOUT', '120'))
+# Resumable crawl state: completed slices and their IOC part files
+CHECKPOINT_FILE = os.path.join(OUTPUT_DIR, '.mib_crawl_checkpoint.json')
+PARTS_DIR = os.path.join(OUTPUT_DIR, '.mib_crawl_parts')
+# MISP attribute type -> IOC type understood by osint/ioc_enrichment
+MISP_TYPE_MAP = {
+    'ip-src': 'ip',
+    'ip-dst': 'ip',
+    'domain': 'domain',
+    'hostname': 'domain',
+    'md5': 'hash',
+    'sha1': 'hash',
+    'sha256': 'hash',
+    'url': 'url',
+}
 
 
 def setup_logging():
@@ -33,74 +66,238 @@ def setup_logging():
         datefmt='%Y-%m-%dT%H:%M:%SZ'
     )
 
-def fetch_misp_events():
-    """Fetch events from MISP in the last N hours."""
+def time_slices(start, end, slice_seconds):
+    """Split the [start, end) epoch window into consecutive slices."""
+    slices = []
+    cursor = start
+    while cursor < end:
+        slices.append((cursor, min(cursor + slice_seconds, end)))
+        cursor += slice_seconds
+    return slices
+
+
+def misp_session(pool_size=MISP_FETCH_WORKERS):
+    """Pooled session carrying the MISP auth headers."""
     if not MISP_URL or not MISP_KEY:
         raise ValueError('MISP_URL and MISP_KEY environment variables must be set')
-    since = (datetime.utcnow() - timedelta(hours=MISP_LOOKBACK_HOURS)).isoformat()
-    logging.info(f'Fetching MISP events since {since} UTC')
-    url = f"{MISP_URL.rstrip('/')}/events/restSearch"
-    headers = {
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({
         'Authorization': MISP_KEY,
-        'Accept': 'application/json'
-    }
-    params = {
-        'returnFormat': 'json',
-        'last': MISP_LOOKBACK_HOURS * 3600
-    }
-    resp = requests.get(url, headers=headers, params=params, verify=False)
-    resp.raise_for_status()
-    data = resp.json()
-    events = data.get('response', [])
-    logging.info(f'Retrieved {len(events)} events from MISP')
+        'Accept': 'application/json',
+        'Content-Type': 'application/json'
+    })
+    session.verify = False
+    return session
+
+
+def fetch_misp_slice(session, start, end, page_size=MISP_PAGE_SIZE):
+    """Fetch all events modified within [start, end), page by page."""
+    url = f"{MISP_URL.rstrip('/')}/events/restSearch"
+    events = []
+    page = 1
+    while True:
+        body = {
+            'returnFormat': 'json',
+            'timestamp': [str(int(start)), str(int(end) - 1)],
+            'limit': page_size,
+            'page': page
+        }
+        resp = session.post(url, json=body, timeout=MISP_TIMEOUT)
+        resp.raise_for_status()
+        batch = resp.json().get('response', [])
+        events.extend(batch)
+        if len(batch) < page_size:
+            break
+        page += 1
     return events
 
 
-def fetch_osint_feeds():
-    """Fetch IOCs from configured OSINT feeds."""
+def load_checkpoint():
+    if not os.path.exists(CHECKPOINT_FILE):
+        return None
+    with open(CHECKPOINT_FILE) as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint):
+    tmp_path = CHECKPOINT_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, CHECKPOINT_FILE)
+
+
+def crawl_misp(store):
+    """
+    Crawl the MISP lookback window slice by slice, resumably.
+
+    Each completed slice writes its IOCs to a part file under PARTS_DIR and is
+    recorded in the checkpoint, so an interrupted crawl resumes with the same
+    window and skips finished slices. Parts are merged into one deduplicated
+    stream appended to the feed store once every slice is done.
+    """
+    os.makedirs(PARTS_DIR, exist_ok=True)
+    checkpoint = load_checkpoint()
+    if checkpoint:
+        start, end = checkpoint['window']
+        logging.info(f"Resuming MISP crawl: {len(checkpoint['completed'])} slices already done")
+    else:
+        end = int(time.time())
+        start = end - MISP_LOOKBACK_HOURS * 3600
+        checkpoint = {'window': [start, end], 'completed': []}
+        save_checkpoint(checkpoint)
+
+    done = {tuple(sl) for sl in checkpoint['completed']}
+    pending = [sl for sl in time_slices(start, end, int(MISP_SLICE_HOURS * 3600)) if sl not in done]
+    logging.info(f'Fetching {len(pending)} MISP time slices with {MISP_FETCH_WORKERS} workers')
+    session = misp_session()
+    lock = threading.Lock()
+
+    def run_slice(sl):
+        events = fetch_misp_slice(session, *sl)
+        part = os.path.join(PARTS_DIR, f'{sl[0]}_{sl[1]}.jsonl')
+        with open(part, 'w') as f:
+            for record in extract_iocs(events):
+                f.write(json.dumps(record, separators=(',', ':')))
+                f.write('\n')
+        with lock:
+            checkpoint['completed'].append(list(sl))
+            save_checkpoint(checkpoint)
+        return len(events)
+
+    with ThreadPoolExecutor(max_workers=MISP_FETCH_WORKERS) as pool:
+        total = sum(pool.map(run_slice, pending))
+    logging.info(f'Retrieved {total} events from MISP')
+
+    path = store.append(merge_parts(), kind='ioc', source='mib_crawl')
+    shutil.rmtree(PARTS_DIR, ignore_errors=True)
+    os.remove(CHECKPOINT_FILE)
+    return path
+
+
+def merge_parts():
+    """Stream the IOC records of every part file, deduplicated."""
+    seen = set()
+    for part in sorted(glob.glob(os.path.join(PARTS_DIR, '*.jsonl'))):
+        with open(part) as f:
+            for line in f:
+                record = json.loads(line)
+                key = (record['type'], record['value'])
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield record
+
+
+def fetch_osint_feed(feed_url, cache):
+    """Fetch one OSINT feed; returns None if it is unchanged since the last run."""
+    logging.info(f'Fetching OSINT feed {feed_url}')
+    content = cache.fetch(feed_url)
+    if content is None:
+        return None
+    feed = parse_feed(content)
+    return [
+        {
+            'title': entry.get('title'),
+            'link': entry.get('link'),
+            'published': entry.get('published'),
+            'summary': entry.get('summary')
+        }
+        for entry in feed.entries
+    ]
+
+
+def fetch_osint_feeds(feeds=None, cache=None):
+    """Fetch IOCs from configured OSINT feeds concurrently, skipping unchanged ones.
+
+    Fetched feeds are committed to ``cache``; the caller saves it once the
+    items are stored. Without a cache, a default one is used and saved here.
+    """
+    feeds = OSINT_FEEDS if feeds is None else feeds
+    own_cache = cache is None
+    cache = cache or FeedCache()
     iocs = []
-    for feed_url in OSINT_FEEDS:
-        logging.info(f'Fetching OSINT feed {feed_url}')
-        feed = parse_feed(feed_url)
-        for entry in feed.entries:
-            iocs.append({
-                'title': entry.get('title'),
-                'link': entry.get('link'),
-                'published': entry.get('published'),
-                'summary': entry.get('summary')
-            })
+
+    def fetch(feed_url):
+        try:
+            return feed_url, fetch_osint_feed(feed_url, cache)
+        except Exception as e:
+            logging.error(f'Error fetching OSINT feed {feed_url}: {e}')
+            return feed_url, None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(feeds), OSINT_FETCH_WORKERS))) as pool:
+        for feed_url, items in pool.map(fetch, feeds):
+            if items is None:
+                continue
+            iocs.extend(items)
+            cache.commit(feed_url)
+    if own_cache:
+        cache.save()
     logging.info(f'Collected {len(iocs)} items from OSINT feeds')
     return iocs
 
 
-def save_to_file(data, prefix):
-    """Save data to a timestamped JSON file in OUTPUT_DIR."""
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    timestamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
-    filename = f'{prefix}_{timestamp}.json'
-    path = os.path.join(OUTPUT_DIR, filename)
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
-    logging.info(f'Saved {len(data)} items to {path}')
-    return path
+def iter_event_attributes(event):
+    """Yield every attribute of a MISP event, including those inside objects."""
+    ev = event.get('Event', event)
+    yield from ev.get('Attribute', []) or []
+    for obj in ev.get('Object', []) or []:
+        yield from obj.get('Attribute', []) or []
+
+
+def normalize_attribute(attr):
+    """
+    Yield (ioc_type, misp_type, value) for a MISP attribute.
+    Composite types such as 'ip-dst|port' or 'filename|sha256' are split.
+    """
+    misp_types = str(attr.get('type', '')).split('|')
+    raw = attr.get('value')
+    if raw is None:
+        return
+    values = str(raw).split('|') if len(misp_types) > 1 else [str(raw)]
+    for misp_type, value in zip(misp_types, values):
+        ioc_type = MISP_TYPE_MAP.get(misp_type)
+        value = value.strip()
+        if not ioc_type or not value:
+            continue
+        if ioc_type in ('domain', 'hash'):
+            value = value.lower().rstrip('.')
+        yield ioc_type, misp_type, value
+
+
+def extract_iocs(events):
+    """Flatten MISP events into deduplicated IOC records."""
+    seen = set()
+    for event in events:
+        for attr in iter_event_attributes(event):
+            for ioc_type, misp_type, value in normalize_attribute(attr):
+                if (ioc_type, value) in seen:
+                    continue
+                seen.add((ioc_type, value))
+                yield {'type': ioc_type, 'value': value, 'misp_type': misp_type}
 
 
 def main():
     setup_logging()
-    all_iocs = []
+    store = FeedStore()
+    saved = False
     try:
-        misp_events = fetch_misp_events()
-        all_iocs.extend(misp_events)
+        saved = crawl_misp(store) is not None
     except Exception as e:
         logging.exception('Error fetching MISP events')
     try:
-        osint_items = fetch_osint_feeds()
-        all_iocs.extend(osint_items)
+        cache = FeedCache()
+        osint_items = fetch_osint_feeds(cache=cache)
+        if osint_items:
+            records = ({'type': 'osint', 'value': item.get('link') or item.get('title'), **item}
+                       for item in osint_items)
+            saved = (store.append(records, kind='osint', source='osint_feeds') is not None) or saved
+        cache.save()
     except Exception as e:
         logging.exception('Error fetching OSINT feeds')
-    if all_iocs:
-        save_to_file(all_iocs, 'mib_crawl')
-    else:
+    if not saved:
         logging.warning('No items collected; nothing to save.')
 
 
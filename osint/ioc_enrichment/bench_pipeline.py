@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+bench_pipeline.py: Benchmark the per-document cost of the IOC enrichment pipeline.
+For each IOC set size, loads synthetic IOCs into a scratch source index,
+executes the enrich policies and runs a batch of sample events through
+_ingest/pipeline/_simulate. Optionally compares against the previous
+script-based pipeline that scanned IOC lists passed as params.
+
+Example:
+  python bench_pipeline.py --es-host http://localhost:9200 --sizes 1000 100000 1000000 --legacy
+"""
+import time
+import hashlib
+import logging
+import argparse
+import ipaddress
+
+from elasticsearch import Elasticsearch
+
+from enrich_iocs import (
+    setup_logging, ensure_ioc_index, index_iocs, ensure_enrich_policies,
+    execute_enrich_policies, build_pipeline, install_pipeline,
+)
+
+BENCH_INDEX = 'ioc-bench-indicators'
+BENCH_POLICY_PREFIX = 'ioc-bench'
+BENCH_PIPELINE_ID = 'ioc-bench-enrichment'
+LEGACY_PIPELINE_ID = 'ioc-bench-legacy'
+
+
+def synthetic_iocs(n):
+    """Generate ``n`` IPs, domains and MD5 hashes."""
+    base = int(ipaddress.IPv4Address('10.0.0.0'))
+    ips = [str(ipaddress.IPv4Address(base + i)) for i in range(n)]
+    domains = [f'bad{i}.example.com' for i in range(n)]
+    hashes = [hashlib.md5(str(i).encode()).hexdigest() for i in range(n)]
+    return ips, domains, hashes
+
+
+def sample_docs(ips, domains, hashes, count, hit_ratio):
+    """Build simulate docs; roughly ``hit_ratio`` of them match an IOC."""
+    docs = []
+    hit_every = max(1, int(round(1 / hit_ratio))) if hit_ratio > 0 else 0
+    for i in range(count):
+        hit = hit_every and i % hit_every == 0
+        j = (i * 7919) % len(ips)
+        docs.append({'_source': {
+            'source': {'ip': ips[j] if hit else '192.0.2.1'},
+            'destination': {'ip': '198.51.100.1'},
+            'http': {'request': {'domain': domains[j] if hit else 'example.org'}},
+            'file': {'hash': hashes[j] if hit else '0' * 32},
+        }})
+    return docs
+
+
+def build_legacy_pipeline(ips, domains, hashes):
+    """The former pipeline: IOC lists as script params, scanned per document."""
+    def tag(cond, tag_name, field, value):
+        return {'script': {'lang': 'painless', 'source': (
+            f"if ({cond}) {{ ctx.tags = ctx.tags == null ? [] : ctx.tags; ctx.tags.add('{tag_name}');"
+            f" ctx.ioc = ctx.ioc == null ? [:] : ctx.ioc; ctx.ioc.{field} = {value}; }}"
+        ), 'params': {'ips': ips, 'domains': domains, 'hashes': hashes}}}
+    return {'processors': [
+        tag("ctx.source != null && params.ips.contains(ctx.source.ip)", 'ioc.ip', 'ip', 'ctx.source.ip'),
+        tag("ctx.destination != null && params.ips.contains(ctx.destination.ip)",
+            'ioc.dest_ip', 'dest_ip', 'ctx.destination.ip'),
+        tag("ctx.http != null && ctx.http.request != null && params.domains.contains(ctx.http.request.domain)",
+            'ioc.domain', 'domain', 'ctx.http.request.domain'),
+        {'script': {'lang': 'painless', 'source': (
+            "for (h in params.hashes) { if (ctx.file != null && ctx.file.hash == h) {"
+            " ctx.tags = ctx.tags == null ? [] : ctx.tags; ctx.tags.add('ioc.hash');"
+            " ctx.ioc = ctx.ioc == null ? [:] : ctx.ioc; ctx.ioc.hash = h; } }"
+        ), 'params': {'hashes': hashes}}},
+    ]}
+
+
+def time_simulate(es, pipeline_id, docs, rounds):
+    """Return the best per-document simulate latency in microseconds."""
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        es.ingest.simulate(id=pipeline_id, body={'docs': docs}, request_timeout=600)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(docs) * 1e6
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark IOC enrichment pipeline cost per document.")
+    parser.add_argument('--es-host', default='http://localhost:9200', help='Scratch Elasticsearch cluster')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000],
+                        help='IOC set sizes to benchmark')
+    parser.add_argument('--docs', type=int, default=1000, help='Documents per simulate call')
+    parser.add_argument('--hit-ratio', type=float, default=0.1, help='Fraction of documents matching an IOC')
+    parser.add_argument('--rounds', type=int, default=3, help='Simulate rounds per size (best is reported)')
+    parser.add_argument('--legacy', action='store_true', help='Also benchmark the script-param pipeline')
+    parser.add_argument('--legacy-max', type=int, default=100000,
+                        help='Largest IOC set size to try with the legacy pipeline')
+    return parser.parse_args()
+
+
+def main():
+    setup_logging()
+    args = parse_args()
+    es = Elasticsearch([args.es_host])
+
+    ensure_ioc_index(es, index=BENCH_INDEX)
+    ensure_enrich_policies(es, index=BENCH_INDEX, policy_prefix=BENCH_POLICY_PREFIX)
+    install_pipeline(es, build_pipeline(policy_prefix=BENCH_POLICY_PREFIX), pipeline_id=BENCH_PIPELINE_ID)
+
+    rows = []
+    for size in args.sizes:
+        ips, domains, hashes = synthetic_iocs(size)
+        index_iocs(es, ips, domains, hashes, index=BENCH_INDEX)
+        start = time.perf_counter()
+        execute_enrich_policies(es, policy_prefix=BENCH_POLICY_PREFIX)
+        policy_secs = time.perf_counter() - start
+
+        docs = sample_docs(ips, domains, hashes, args.docs, args.hit_ratio)
+        enrich_us = time_simulate(es, BENCH_PIPELINE_ID, docs, args.rounds)
+
+        legacy_us = None
+        if args.legacy and size <= args.legacy_max:
+            install_pipeline(es, build_legacy_pipeline(ips, domains, hashes), pipeline_id=LEGACY_PIPELINE_ID)
+            legacy_us = time_simulate(es, LEGACY_PIPELINE_ID, docs, args.rounds)
+        rows.append((size, policy_secs, enrich_us, legacy_us))
+        logging.info(f'{size} IOCs: enrich {enrich_us:.1f} us/doc')
+
+    print(f"{'IOCs':>10} {'policy exec (s)':>16} {'enrich (us/doc)':>16} {'legacy (us/doc)':>16}")
+    for size, policy_secs, enrich_us, legacy_us in rows:
+        legacy = f'{legacy_us:16.1f}' if legacy_us is not None else f"{'-':>16}"
+        print(f'{size:>10} {policy_secs:16.2f} {enrich_us:16.1f} {legacy}')
+
+    es.indices.delete(index=BENCH_INDEX, ignore_unavailable=True)
+
+
+if __name__ == '__main__':
+    main()
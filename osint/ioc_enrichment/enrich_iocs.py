@@ -1,15 +1,37 @@
 #!/usr/bin/env python3
 """
 enrich_iocs.py: Enrich logs in Elasticsearch with IOC data by installing an ingest pipeline.
-Reads IOC JSON files produced by osint/feeds and creates or updates an Elasticsearch ingest pipeline
-that tags events matching known malicious IPs, domains, or file hashes.
+Reads IOCs from the osint/feeds compacted feed store (and any loose IOC JSON
+files left in the feed output directory), loads them into an IOC source index
+backing one enrich policy per IOC type, and creates or updates an Elasticsearch
+ingest pipeline that tags events matching known malicious IPs, domains, or file hashes.
 """
 import os
+import sys
 import glob
 import json
+import time
+import hashlib
 import logging
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 
-from elasticsearch import Elasticsearch, exceptions as es_exceptions
+from elasticsearch import Elasticsearch, helpers, exceptions as es_exceptions
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'feeds'))
+from feed_store import FeedStore
+
+# Optional: incremental JSON parsing of large feed arrays
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
 # Configuration
 ES_HOST = os.getenv('ELASTICSEARCH_HOST', 'http://elasticsearch:9200')
@@ -18,7 +40,24 @@ ES_PIPELINE_ID = 'ioc_enrichment'
 IOC_FEED_DIR = os.path.normpath(
     os.path.join(os.path.dirname(__file__), '..', 'feeds', 'output')
 )
-IOC_FILE_PATTERN = '*.json'
+IOC_FILE_PATTERNS = ('*.json', '*.jsonl', '*.ndjson')
+JSON_LINES_SUFFIXES = ('.jsonl', '.ndjson')
+# Incremental mode state (feed fingerprints and the IOCs each one contributed)
+STATE_FILE = os.getenv(
+    'IOC_ENRICH_STATE_FILE', os.path.join(os.path.dirname(__file__), 'enrich_state.json')
+)
+# Source index and enrich policies used for constant-time IOC lookups
+IOC_INDEX = 'ioc-indicators'
+ENRICH_POLICY_PREFIX = 'ioc'
+IOC_TYPES = ('ip', 'domain', 'hash')
+# (event field, IOC type, match key, tag)
+IOC_TAGS = [
+    ('source.ip', 'ip', 'ip', 'ioc.ip'),
+    ('destination.ip', 'ip', 'dest_ip', 'ioc.dest_ip'),
+    ('http.request.domain', 'domain', 'domain', 'ioc.domain'),
+    ('file.hash', 'hash', 'hash', 'ioc.hash'),
+]
+IOC_MATCH_FIELDS = [(field, ioc_type, key) for field, ioc_type, key, _ in IOC_TAGS]
 
 
 def setup_logging():
@@ -29,107 +68,403 @@ def setup_logging():
     )
 
 
-def load_iocs():
-    """Load IOC values from all JSON feed files."""
-    ips = set()
-    domains = set()
-    hashes = set()
+def iter_feed_records(feed_file):
+    """
+    Yield the records of a feed file one at a time.
+
+    JSON-lines files (.jsonl/.ndjson) are read line by line. JSON arrays are
+    parsed incrementally with ijson when it is installed; otherwise the file
+    is loaded whole as before.
+    """
+    if feed_file.endswith(JSON_LINES_SUFFIXES):
+        with open(feed_file) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        return
+    with open(feed_file, 'rb') as f:
+        if ijson is not None:
+            yield from ijson.items(f, 'item')
+        else:
+            yield from json.load(f)
+
+
+def extract_iocs(item):
+    """Yield normalized (ioc_type, value) pairs found in one feed record."""
+    if not isinstance(item, dict):
+        return
+    # Typed records, e.g. {"type": "ip", "value": "1.2.3.4"}
+    if item.get('type') in IOC_TYPES and item.get('value'):
+        yield item['type'], normalize_ioc(item['type'], item['value'])
+        return
+    # IP IOC
+    if item.get('ip'):
+        yield 'ip', normalize_ioc('ip', item['ip'])
+    # Domain IOC
+    if item.get('domain'):
+        yield 'domain', normalize_ioc('domain', item['domain'])
+    # File hash IOC (md5, sha1, sha256)
+    for key in ('md5', 'sha1', 'sha256', 'hash'):
+        if item.get(key):
+            yield 'hash', normalize_ioc('hash', item[key])
+
+
+def normalize_ioc(ioc_type, value):
+    value = str(value).strip()
+    if ioc_type == 'domain':
+        return value.lower().rstrip('.')
+    if ioc_type == 'hash':
+        return value.lower()
+    return value
+
+
+def scan_feed_file(feed_file):
+    """
+    Stream one feed file into a set of (ioc_type, value) pairs.
+    Returns (iocs, records, ok); ``ok`` is False if the file could not be
+    parsed to the end, in which case ``iocs`` holds what was read before the error.
+    """
+    iocs = set()
+    records = 0
+    try:
+        for item in iter_feed_records(feed_file):
+            records += 1
+            iocs.update(extract_iocs(item))
+    except Exception as e:
+        logging.warning(f'Could not load {feed_file}: {e}')
+        return iocs, records, False
+    return iocs, records, True
+
+
+def load_file_iocs(feed_file):
+    """Load the IOCs of one feed file as a set of (ioc_type, value) pairs."""
+    return scan_feed_file(feed_file)[0]
+
+
+def scan_feed_files(files, workers=None):
+    """
+    Parse several feed files, in parallel across processes when there is
+    more than one. Returns ({feed_file: iocs}, failed files) and logs
+    records/sec and peak memory.
+    """
+    start = time.perf_counter()
+    if len(files) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            scanned = list(pool.map(scan_feed_file, files))
+    else:
+        scanned = [scan_feed_file(feed_file) for feed_file in files]
+    elapsed = time.perf_counter() - start
+
+    records = sum(count for _, count, _ in scanned)
+    rate = records / elapsed if elapsed > 0 else float('inf')
+    logging.info(
+        f'Parsed {records} records from {len(files)} feed files in {elapsed:.2f}s '
+        f'({rate:.0f} records/s, peak RSS {peak_memory_mb():.1f} MB)'
+    )
+    parsed = {feed_file: iocs for feed_file, (iocs, _, _) in zip(files, scanned)}
+    failed = [feed_file for feed_file, (_, _, ok) in zip(files, scanned) if not ok]
+    return parsed, failed
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process and its finished workers, in MB."""
+    if resource is None:
+        return float('nan')
+    peak_kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    return peak_kb / 1024.0
 
-    feed_path = os.path.join(IOC_FEED_DIR, IOC_FILE_PATTERN)
-    for feed_file in glob.glob(feed_path):
+
+def split_iocs(iocs):
+    """Split (ioc_type, value) pairs into IP, domain and hash lists."""
+    by_type = {ioc_type: [] for ioc_type in IOC_TYPES}
+    for ioc_type, value in iocs:
+        by_type[ioc_type].append(value)
+    return by_type['ip'], by_type['domain'], by_type['hash']
+
+
+def feed_files():
+    """Return the feed files currently present in IOC_FEED_DIR."""
+    files = set()
+    for pattern in IOC_FILE_PATTERNS:
+        files.update(glob.glob(os.path.join(IOC_FEED_DIR, pattern)))
+    return sorted(files)
+
+
+def store_iocs(store):
+    """Return the IOCs of the feed store snapshot as a set of (ioc_type, value) pairs."""
+    iocs = {
+        (ioc_type, normalize_ioc(ioc_type, value))
+        for ioc_type, value in store.iter_records('ioc') if ioc_type in IOC_TYPES
+    }
+    logging.info(f'Loaded {len(iocs)} IOCs from the feed store (version {store.version()})')
+    return iocs
+
+
+def load_iocs(workers=None, store=None):
+    """
+    Load IOC values from the feed store and any loose feed files.
+    :return: (state, ips, domains, hashes); the state is saved so a later incremental run starts from it.
+    """
+    files = feed_files()
+    for feed_file in files:
         logging.info(f'Loading IOCs from {feed_file}')
+    state, iocs, _ = compute_delta({'files': {}}, files, workers, store=store or FeedStore())
+
+    ips, domains, hashes = split_iocs(iocs)
+    logging.info(f'Total IOCs loaded: {len(ips)} IPs, {len(domains)} domains, {len(hashes)} hashes')
+    return state, ips, domains, hashes
+
+
+def fingerprint_file(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_state(path=STATE_FILE):
+    """Load the incremental state: per-feed fingerprint and the IOCs it contributed."""
+    if not os.path.exists(path):
+        return {'files': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_FILE):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def compute_delta(state, files, workers=None, store=None):
+    """
+    Compare the feed store and feed files against the previous state.
+
+    The store is only re-read when its compaction version changed. Unchanged
+    files (same size/mtime, or same content hash) reuse the IOCs recorded for
+    them; only new or modified files are parsed. A file that fails to parse
+    keeps its previous entry (or none), so it is parsed again next run.
+    :return: (new_state, added, removed) with added/removed as sets of (ioc_type, value).
+    """
+    previous = state.get('files', {})
+    current = {}
+    previous_store = state.get('store', {'version': None, 'iocs': []})
+    store_entry = previous_store
+    if store is not None:
+        store.compact()
+        version = store.version()
+        if version != previous_store['version']:
+            logging.info(f'Feed store changed: version {previous_store["version"]} -> {version}')
+            store_entry = {'version': version, 'iocs': [list(ioc) for ioc in sorted(store_iocs(store))]}
+    changed = {}
+    for feed_file in files:
+        st = os.stat(feed_file)
+        entry = previous.get(feed_file)
+        if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+            current[feed_file] = entry
+            continue
+        sha = fingerprint_file(feed_file)
+        if entry and entry['sha256'] == sha:
+            current[feed_file] = dict(entry, size=st.st_size, mtime=st.st_mtime)
+            continue
+        logging.info(f'Feed changed: {feed_file}')
+        changed[feed_file] = {'sha256': sha, 'size': st.st_size, 'mtime': st.st_mtime}
+
+    parsed, failed = scan_feed_files(list(changed), workers)
+    for feed_file in failed:
+        # Keep what the file contributed before; it is parsed again next run
+        logging.warning(f'Leaving the state of {feed_file} unchanged until it parses')
+        if feed_file in previous:
+            current[feed_file] = previous[feed_file]
+        del parsed[feed_file]
+    for feed_file, iocs in parsed.items():
+        current[feed_file] = dict(changed[feed_file], iocs=[list(ioc) for ioc in sorted(iocs)])
+
+    def union(entries):
+        return {tuple(ioc) for entry in entries.values() for ioc in entry['iocs']}
+
+    old_iocs = union(previous) | {tuple(ioc) for ioc in previous_store['iocs']}
+    new_iocs = union(current) | {tuple(ioc) for ioc in store_entry['iocs']}
+    return {'files': current, 'store': store_entry}, new_iocs - old_iocs, old_iocs - new_iocs
+
+
+def apply_delta(es, added, removed, index=IOC_INDEX):
+    """
+    Index added IOCs and delete removed ones from the IOC source index.
+    :return: (failed_added, failed_removed) sets of (ioc_type, value) to retry on the next run.
+    """
+    batch = datetime.utcnow().strftime('%Y%m%dT%H%M%S%fZ')
+    actions = [
+        {
+            '_index': index,
+            '_id': ioc_doc_id(ioc_type, value),
+            '_source': {'indicator': value, 'ioc_type': ioc_type, 'batch': batch},
+        }
+        for ioc_type, value in added
+    ] + [
+        {'_op_type': 'delete', '_index': index, '_id': ioc_doc_id(ioc_type, value)}
+        for ioc_type, value in removed
+    ]
+    ok, errors = helpers.bulk(es, actions, chunk_size=5000, raise_on_error=False, request_timeout=120)
+    by_id = {ioc_doc_id(ioc_type, value): (ioc_type, value) for ioc_type, value in list(added) + list(removed)}
+    failed_added, failed_removed = set(), set()
+    for error in errors:
+        op_type, info = next(iter(error.items()))
+        ioc = by_id.get(info.get('_id'))
+        if ioc is None:
+            continue
+        if op_type == 'delete':
+            # Already gone is as good as deleted
+            if info.get('status') != 404:
+                failed_removed.add(ioc)
+        else:
+            failed_added.add(ioc)
+    if failed_added or failed_removed:
+        logging.warning(f'{len(failed_added) + len(failed_removed)} IOC delta operations failed; '
+                        f'they will be retried on the next run')
+    es.indices.refresh(index=index)
+    logging.info(f'Applied IOC delta: +{len(added)} -{len(removed)} ({ok} operations)')
+    return failed_added, failed_removed
+
+
+def pipeline_installed(es, pipeline_id=ES_PIPELINE_ID):
+    try:
+        es.ingest.get_pipeline(id=pipeline_id)
+        return True
+    except es_exceptions.NotFoundError:
+        return False
+
+
+def ensure_ioc_index(es, index=IOC_INDEX):
+    """Create the IOC source index used by the enrich policies if it does not exist."""
+    if es.indices.exists(index=index):
+        return
+    es.indices.create(index=index, body={
+        'settings': {'number_of_shards': 1},
+        'mappings': {'properties': {
+            'indicator': {'type': 'keyword'},
+            'ioc_type': {'type': 'keyword'},
+            'batch': {'type': 'keyword'},
+        }}
+    })
+    logging.info(f'Created IOC source index "{index}"')
+
+
+def ioc_doc_id(ioc_type, value):
+    """Deterministic document ID of an IOC in the source index."""
+    return f'{ioc_type}:{value}'
+
+
+def index_iocs(es, ips, domains, hashes, index=IOC_INDEX):
+    """
+    Replace the contents of the IOC source index with the given IOCs.
+    Documents are upserted by ID and those missing from this run are deleted.
+    """
+    batch = datetime.utcnow().strftime('%Y%m%dT%H%M%S%fZ')
+    actions = (
+        {
+            '_index': index,
+            '_id': ioc_doc_id(ioc_type, value),
+            '_source': {'indicator': value, 'ioc_type': ioc_type, 'batch': batch},
+        }
+        for ioc_type, values in (('ip', ips), ('domain', domains), ('hash', hashes))
+        for value in values
+    )
+    indexed, _ = helpers.bulk(es, actions, chunk_size=5000, request_timeout=120)
+    es.indices.refresh(index=index)
+    stale = es.delete_by_query(
+        index=index,
+        body={'query': {'bool': {'must_not': {'term': {'batch': batch}}}}},
+        refresh=True, conflicts='proceed'
+    )
+    logging.info(f'Indexed {indexed} IOCs into "{index}", removed {stale.get("deleted", 0)} stale')
+
+
+def ensure_enrich_policies(es, index=IOC_INDEX, policy_prefix=ENRICH_POLICY_PREFIX):
+    """Create one match enrich policy per IOC type (policies are immutable once created)."""
+    for ioc_type in IOC_TYPES:
+        name = f'{policy_prefix}-{ioc_type}'
         try:
-            data = json.load(open(feed_file))
-        except Exception as e:
-            logging.warning(f'Could not load {feed_file}: {e}')
+            existing = es.enrich.get_policy(name=name).get('policies', [])
+        except es_exceptions.NotFoundError:
+            existing = []
+        if existing:
             continue
-        for item in data:
-            # IP IOC
-            if 'ip' in item:
-                ips.add(item['ip'])
-            # Domain IOC
-            if 'domain' in item:
-                domains.add(item['domain'])
-            # File hash IOC (md5, sha1, sha256)
-            for key in ('md5', 'sha1', 'sha256', 'hash'):
-                if key in item:
-                    hashes.add(item[key])
+        es.enrich.put_policy(name=name, body={
+            'match': {
+                'indices': index,
+                'match_field': 'indicator',
+                'enrich_fields': ['ioc_type'],
+                'query': {'term': {'ioc_type': ioc_type}},
+            }
+        })
+        logging.info(f'Created enrich policy "{name}"')
 
-    logging.info(f'Total IOCs loaded: {len(ips)} IPs, {len(domains)} domains, {len(hashes)} hashes')
-    return list(ips), list(domains), list(hashes)
+
+def execute_enrich_policies(es, policy_prefix=ENRICH_POLICY_PREFIX):
+    """Rebuild the enrich indices so the pipeline sees the current IOC set."""
+    for ioc_type in IOC_TYPES:
+        name = f'{policy_prefix}-{ioc_type}'
+        es.enrich.execute_policy(name=name, wait_for_completion=True)
+        logging.info(f'Executed enrich policy "{name}"')
 
 
-def build_pipeline(ips, domains, hashes):
-    """Construct the ingest pipeline definition for IOC enrichment."""
+def enrich_indices_exist(es, policy_prefix=ENRICH_POLICY_PREFIX):
+    """True once every enrich policy has been executed at least once."""
+    return all(es.indices.exists(index=f'.enrich-{policy_prefix}-{ioc_type}') for ioc_type in IOC_TYPES)
+
+
+def build_pipeline(policy_prefix=ENRICH_POLICY_PREFIX):
+    """
+    Construct the ingest pipeline definition for IOC enrichment.
+
+    Matching is done by ``enrich`` processors, i.e. a constant-time term
+    lookup in the enrich index per field, instead of scanning IOC lists
+    embedded as script params. The pipeline body no longer depends on the
+    number of IOCs.
+    """
     processors = []
 
-    # Script processor to tag matching IPs
-    ip_script = {
-        'script': {
-            'lang': 'painless',
-            'source': (
-                "if (ctx.source != null && params.ips.contains(ctx.source.ip)) {"
-                "ctx.tags = ctx.tags == null ? [] : ctx.tags;"
-                "ctx.tags.add('ioc.ip');"
-                "ctx.ioc = ctx.ioc == null ? [:] : ctx.ioc;"
-                "ctx.ioc.ip = ctx.source.ip;"
-                "}"),
-            'params': {'ips': ips}
-        }
-    }
-    processors.append(ip_script)
+    # Enrich lookups: event field -> IOC type
+    for field, ioc_type, match_key in IOC_MATCH_FIELDS:
+        processors.append({
+            'enrich': {
+                'policy_name': f'{policy_prefix}-{ioc_type}',
+                'field': field,
+                'target_field': f'ioc_lookup.{match_key}',
+                'ignore_missing': True,
+                'ignore_failure': True,
+            }
+        })
 
-    # Script processor to tag matching destination IPs
-    dest_ip_script = {
+    # Tag matches exactly as the previous script processors did
+    tag_script = {
         'script': {
             'lang': 'painless',
             'source': (
-                "if (ctx.destination != null && params.ips.contains(ctx.destination.ip)) {"
-                "ctx.tags = ctx.tags == null ? [] : ctx.tags;"
-                "ctx.tags.add('ioc.dest_ip');"
-                "ctx.ioc = ctx.ioc == null ? [:] : ctx.ioc;"
-                "ctx.ioc.dest_ip = ctx.destination.ip;"
+                "if (ctx.ioc_lookup != null) {"
+                " for (entry in params.tags.entrySet()) {"
+                "  def m = ctx.ioc_lookup[entry.getKey()];"
+                "  if (m != null) {"
+                "   ctx.tags = ctx.tags == null ? [] : ctx.tags;"
+                "   ctx.tags.add(entry.getValue());"
+                "   ctx.ioc = ctx.ioc == null ? [:] : ctx.ioc;"
+                "   ctx.ioc[entry.getKey()] = m.indicator;"
+                "  }"
+                " }"
+                " ctx.remove('ioc_lookup');"
                 "}"),
-            'params': {'ips': ips}
+            'params': {'tags': {key: tag for _, _, key, tag in IOC_TAGS}}
         }
     }
-    processors.append(dest_ip_script)
-
-    # Script processor to tag matching domains (if HTTP request exists)
-    if domains:
-        domain_script = {
-            'script': {
-                'lang': 'painless',
-                'source': (
-                    "if (ctx.http != null && ctx.http.request != null && params.domains.contains(ctx.http.request.domain)) {"
-                    "ctx.tags = ctx.tags == null ? [] : ctx.tags;"
-                    "ctx.tags.add('ioc.domain');"
-                    "ctx.ioc = ctx.ioc == null ? [:] : ctx.ioc;"
-                    "ctx.ioc.domain = ctx.http.request.domain;"
-                    "}"),
-                'params': {'domains': domains}
-            }
-        }
-        processors.append(domain_script)
-
-    # Script processor to tag matching file hashes
-    if hashes:
-        hash_script = {
-            'script': {
-                'lang': 'painless',
-                'source': (
-                    "for (h in params.hashes) {"
-                    " if (ctx.file != null && ctx.file.hash != null && ctx.file.hash == h) {"
-                    " ctx.tags = ctx.tags == null ? [] : ctx.tags;"
-                    " ctx.tags.add('ioc.hash');"
-                    " ctx.ioc = ctx.ioc == null ? [:] : ctx.ioc;"
-                    " ctx.ioc.hash = h;"
-                    " }"
-                    "}"),
-                'params': {'hashes': hashes}
-            }
-        }
-        processors.append(hash_script)
+    processors.append(tag_script)
 
     pipeline = {
         'description': 'IOC enrichment pipeline',
@@ -141,31 +476,79 @@ def build_pipeline(ips, domains, hashes):
     return pipeline
 
 
-def install_pipeline(es, pipeline_body):
+def install_pipeline(es, pipeline_body, pipeline_id=ES_PIPELINE_ID):
     """Create or update the ingest pipeline in Elasticsearch."""
     try:
-        es.ingest.put_pipeline(id=ES_PIPELINE_ID, body=pipeline_body)
-        logging.info(f'Ingest pipeline "{ES_PIPELINE_ID}" installed successfully')
+        es.ingest.put_pipeline(id=pipeline_id, body=pipeline_body)
+        logging.info(f'Ingest pipeline "{pipeline_id}" installed successfully')
     except es_exceptions.ElasticsearchException as e:
         logging.error(f'Failed to install ingest pipeline: {e}')
         raise
 
 
+def run_incremental(es, workers=None):
+    """
+    Apply only the IOCs added/removed since the last run and re-execute policies if needed.
+    Operations Elasticsearch rejected are saved as ``pending`` in the state and retried next run.
+    """
+    state = load_state()
+    new_state, added, removed = compute_delta(state, feed_files(), workers, store=FeedStore())
+    # Operations that failed last time, unless the feeds have since reverted them
+    pending = state.get('pending', {})
+    added |= {tuple(ioc) for ioc in pending.get('added', [])} - removed
+    removed |= {tuple(ioc) for ioc in pending.get('removed', [])} - added
+    ensure_ioc_index(es)
+    ensure_enrich_policies(es)
+    failed_added, failed_removed = set(), set()
+    if added or removed:
+        failed_added, failed_removed = apply_delta(es, added, removed)
+    if added or removed or not enrich_indices_exist(es):
+        execute_enrich_policies(es)
+    else:
+        logging.info('No IOC changes since last run; enrich policies left as is')
+    if not pipeline_installed(es):
+        install_pipeline(es, build_pipeline())
+    new_state['pending'] = {
+        'added': [list(ioc) for ioc in sorted(failed_added)],
+        'removed': [list(ioc) for ioc in sorted(failed_removed)],
+    }
+    save_state(new_state)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Install the IOC enrichment pipeline from OSINT feeds.")
+    parser.add_argument('--incremental', action='store_true',
+                        help='Apply only the IOC delta since the last run (state in enrich_state.json)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processes used to parse feed files (default: CPU count)')
+    return parser.parse_args()
+
+
 def main():
     setup_logging()
+    args = parse_args()
+
+    if args.incremental:
+        run_incremental(Elasticsearch([ES_HOST]), args.workers)
+        return
 
     # Load IOCs
-    ips, domains, hashes = load_iocs()
+    state, ips, domains, hashes = load_iocs(args.workers)
     if not any([ips, domains, hashes]):
         logging.warning('No IOCs found; skipping pipeline installation.')
         return
 
-    # Build pipeline definition
-    pipeline = build_pipeline(ips, domains, hashes)
-
-    # Connect to Elasticsearch and install pipeline
+    # Connect to Elasticsearch and refresh the IOC source index
     es = Elasticsearch([ES_HOST])
-    install_pipeline(es, pipeline)
+    ensure_ioc_index(es)
+    index_iocs(es, ips, domains, hashes)
+
+    # Rebuild enrich indices and install the (IOC-independent) pipeline
+    ensure_enrich_policies(es)
+    execute_enrich_policies(es)
+    install_pipeline(es, build_pipeline())
+    # Everything loaded is now indexed: a later --incremental run starts from here
+    save_state(state)
 
 
 if __name__ == '__main__':
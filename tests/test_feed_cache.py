@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+test_feed_cache.py: FeedCache against a local http.server that honours
+ETag/If-None-Match and Last-Modified/If-Modified-Since.
+"""
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'osint', 'feeds'))
+from feed_cache import FeedCache
+
+LAST_MODIFIED = 'Wed, 01 May 2024 10:00:00 GMT'
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Serves ``server.feed`` and answers 304 when the validators match."""
+
+    def do_GET(self):
+        feed = self.server.feed
+        self.server.requests.append(dict(self.headers))
+        etag_ok = feed['etag'] is not None and self.headers.get('If-None-Match') == feed['etag']
+        date_ok = self.headers.get('If-Modified-Since') == feed['last_modified']
+        if feed['conditional'] and (etag_ok or date_ok):
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if feed['etag']:
+            self.send_header('ETag', feed['etag'])
+        self.send_header('Last-Modified', feed['last_modified'])
+        self.send_header('Content-Length', str(len(feed['body'])))
+        self.end_headers()
+        self.wfile.write(feed['body'])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+    httpd.feed = {'body': b'[{"ip": "1.2.3.4"}]', 'etag': '"v1"', 'last_modified': LAST_MODIFIED,
+                  'conditional': True}
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}/feed.json'
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_first_fetch_is_unconditional(server, tmp_path):
+    cache = FeedCache(str(tmp_path / 'cache.json'))
+    assert cache.fetch(server.url) == server.feed['body']
+    assert 'If-None-Match' not in server.requests[0]
+    assert 'If-Modified-Since' not in server.requests[0]
+
+
+def test_committed_feed_sends_validators_and_skips_304(server, tmp_path):
+    cache = FeedCache(str(tmp_path / 'cache.json'))
+    cache.fetch(server.url)
+    cache.commit(server.url)
+
+    assert cache.fetch(server.url) is None
+    assert server.requests[1]['If-None-Match'] == '"v1"'
+    assert server.requests[1]['If-Modified-Since'] == LAST_MODIFIED
+
+
+def test_if_modified_since_alone_gets_304(server, tmp_path):
+    server.feed['etag'] = None
+    cache = FeedCache(str(tmp_path / 'cache.json'))
+    cache.fetch(server.url)
+    cache.commit(server.url)
+
+    assert cache.fetch(server.url) is None
+    assert 'If-None-Match' not in server.requests[1]
+    assert server.requests[1]['If-Modified-Since'] == LAST_MODIFIED
+
+
+def test_uncommitted_fetch_is_downloaded_again(server, tmp_path):
+    cache = FeedCache(str(tmp_path / 'cache.json'))
+    cache.fetch(server.url)
+
+    assert cache.fetch(server.url) == server.feed['body']
+    assert 'If-None-Match' not in server.requests[1]
+
+
+def test_unchanged_body_detected_by_hash_without_304(server, tmp_path):
+    server.feed['conditional'] = False
+    cache = FeedCache(str(tmp_path / 'cache.json'))
+    cache.fetch(server.url)
+    cache.commit(server.url)
+
+    assert cache.fetch(server.url) is None
+
+
+def test_changed_feed_is_returned(server, tmp_path):
+    cache = FeedCache(str(tmp_path / 'cache.json'))
+    cache.fetch(server.url)
+    cache.commit(server.url)
+    server.feed.update(body=b'[{"ip": "5.6.7.8"}]', etag='"v2"', last_modified='Thu, 02 May 2024 10:00:00 GMT')
+
+    assert cache.fetch(server.url) == b'[{"ip": "5.6.7.8"}]'
+    assert server.requests[1]['If-None-Match'] == '"v1"'
+
+
+def test_validators_survive_save_and_reload(server, tmp_path):
+    path = str(tmp_path / 'cache.json')
+    cache = FeedCache(path)
+    cache.fetch(server.url)
+    cache.commit(server.url)
+    cache.save()
+
+    assert FeedCache(path).fetch(server.url) is None
+    assert server.requests[1]['If-None-Match'] == '"v1"'